@@ -81,6 +81,37 @@ create table session(
     , platform int references platform(id) on delete cascade not null
 );
 
+/*
+Check that a pcpatch column exists. Partitioned parent tables have their own attributes
+in pg_attribute, so a partitioned patch table can be referenced by its parent.
+*/
+create or replace function has_pcpatch_column(schema_name text, table_name text,
+        column_name text)
+returns boolean as $$
+    declare
+        rec record;
+    begin
+        if li3ds.postgres_version() < '9.6.0'  then
+            execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
+                           'attrelid=to_regclass(($1 || ''.%I'')::cstring) and '
+                           'attname=$2 and '
+                           'atttypid=''pcpatch''::regtype and attnum > 0 and '
+                           'not attisdropped', table_name)
+                    into rec
+                    using schema_name, column_name;
+        else
+            execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
+                           'attrelid=to_regclass($1 || ''.%I'') and '
+                           'attname=$2 and '
+                           'atttypid=''pcpatch''::regtype and attnum > 0 and '
+                           'not attisdropped', table_name)
+                    into rec
+                    using schema_name, column_name;
+        end if;
+        return rec.cnt::int = 1;
+    end;
+$$ language plpgsql;
+
 create or replace function check_datasource_uri(uri text)
 returns boolean as $$
     declare
@@ -88,7 +119,6 @@ returns boolean as $$
         scheme text;
         uri_split text[];
         path_split text[];
-        rec record;
     begin
         uri_split := regexp_split_to_array(uri, ':');
 
@@ -109,25 +139,7 @@ returns boolean as $$
                 return false;
             end if;
 
-            if li3ds.postgres_version() < '9.6.0'  then
-                execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
-                               'attrelid=to_regclass(($1 || ''.%I'')::cstring) and '
-                               'attname=$2 and '
-                               'atttypid=''pcpatch''::regtype and attnum > 0 and '
-                               'not attisdropped', path_split[2])
-                        into rec
-                        using path_split[1], path_split[3];
-            else
-                execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
-                               'attrelid=to_regclass($1 || ''.%I'') and '
-                               'attname=$2 and '
-                               'atttypid=''pcpatch''::regtype and attnum > 0 and '
-                               'not attisdropped', path_split[2])
-                        into rec
-                        using path_split[1], path_split[3];
-            end if;
-
-            return rec.cnt::int = 1;
+            return li3ds.has_pcpatch_column(path_split[1], path_split[2], path_split[3]);
         end if;
 
         return true;
@@ -155,6 +167,11 @@ create table processing(
     , tool varchar
     , source int references datasource(id) on delete cascade not null
     , target int references datasource(id) on delete cascade not null
+    -- lineage of the processings that li3ds can redo
+    , config int  -- references platform_config(id), added once the table exists
+    , transfos integer[]  -- transfo path from the source to the target referential
+    , ttime float8
+    , stale boolean not null default false
 );
 
 create table transfo_type(
@@ -211,7 +228,6 @@ create or replace function check_pcpatch_column(schema_table_column varchar)
 returns boolean as $$
     declare
       schema_table_column_array text[];
-      rec record;
     begin
         if schema_table_column is null then
             return true;
@@ -220,24 +236,9 @@ returns boolean as $$
         if array_length(schema_table_column_array, 1) <> 3 then
             return false;
         end if;
-        if li3ds.postgres_version() < '9.6.0'  then
-            execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
-                           'attrelid=to_regclass(($1 || ''.%I'')::cstring) and '
-                           'attname=$2 and '
-                           'atttypid=''pcpatch''::regtype and attnum > 0 and '
-                           'not attisdropped', schema_table_column_array[2])
-                    into rec
-                    using schema_table_column_array[1], schema_table_column_array[3];
-        else
-            execute format('select count(*) as cnt from pg_catalog.pg_attribute where '
-                           'attrelid=to_regclass($1 || ''.%I'') and '
-                           'attname=$2 and '
-                           'atttypid=''pcpatch''::regtype and attnum > 0 and '
-                           'not attisdropped', schema_table_column_array[2])
-                    into rec
-                    using schema_table_column_array[1], schema_table_column_array[3];
-        end if;
-        return rec.cnt::int = 1;
+        return li3ds.has_pcpatch_column(schema_table_column_array[1],
+                                        schema_table_column_array[2],
+                                        schema_table_column_array[3]);
     end;
 $$ language plpgsql;
 
@@ -514,3 +515,1333 @@ $CODE$
     import pg_li3ds
     return pg_li3ds.transform_patch_config(patch, config, source, target, ttime)
 $CODE$ language plpython2u;
+
+
+---
+-- Multi-echo lidar
+---
+
+create or replace function pcid_dimensions(pcid integer)
+returns varchar[] as $$
+    select array_agg(dim.name order by dim.position)
+    from (
+        select (xpath('pc:name/text()', d, n.ns))[1]::varchar as name
+               , (xpath('pc:position/text()', d, n.ns))[1]::text::integer as position
+        from pointcloud_formats f
+        , (select array[array['pc', 'http://pointcloud.org/schemas/PC/1.1']] as ns) n
+        , lateral unnest(xpath('/pc:PointCloudSchema/pc:dimension', f.schema::xml, n.ns)) d
+        where f.pcid = $1
+    ) dim
+$$ language sql stable;
+
+create or replace function split_echoes(patch pcpatch, pulse_pcid integer, echo_pcid integer,
+        offset_dim varchar default 'echo_offset', echo_dim varchar default 'echo',
+        out pulse pcpatch, out echo pcpatch) as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.split_echoes(patch, pulse_pcid, echo_pcid, offset_dim, echo_dim)
+$CODE$ language plpython2u;
+
+create or replace function join_echoes(pulse pcpatch, echo pcpatch, pcid integer,
+        offset_dim varchar default 'echo_offset', num_echoes_dim varchar default 'num_echoes')
+returns pcpatch as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.join_echoes(pulse, echo, pcid, offset_dim, num_echoes_dim)
+$CODE$ language plpython2u;
+
+
+---
+-- Image visibility
+---
+
+create table image_frustum(
+    datasource int references datasource(id) on delete cascade not null
+    , config int references platform_config(id) on delete cascade not null
+    , referential int references referential(id) on delete cascade not null
+    , capture_time timestamptz
+    , near float8  -- depths of the frustum planes
+    , far float8
+    , geom geometry(polyhedralsurfacez) not null
+    , primary key (datasource, config, referential)
+);
+
+create index on image_frustum using gist (geom gist_geometry_ops_nd);
+
+create or replace function update_image_frustums(config integer, referential integer,
+        near float8 default 1.0, far float8 default 100.0)
+returns integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.update_image_frustums(config, referential, near, far)
+$CODE$ language plpython2u;
+
+create or replace function images_seeing(config integer, referential integer, geom geometry)
+returns setof integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.images_seeing(config, referential, geom)
+$CODE$ language plpython2u;
+
+create or replace function colorize(patch pcpatch, config integer, referential integer)
+returns table(image integer, point integer, u float8, v float8) as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.colorize(patch, config, referential)
+$CODE$ language plpython2u;
+
+
+---
+-- Transform diagnostics
+---
+
+create table transform_stats(
+    func_name varchar not null
+    , kind varchar not null
+    , object varchar not null
+    , calls bigint not null
+    , total_ms float8 not null
+    , primary key (func_name, kind, object)
+);
+
+create or replace function explain_transform(config integer, source integer, target integer,
+        ttime float8 default 0.0, run_analyze boolean default false, patch pcpatch default null)
+returns table(hop integer, transfo integer, name varchar, func_name varchar, kind varchar,
+              path_cached boolean, estimated_ms float8, lookup_ms float8,
+              actual_ms float8) as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.explain_transform(config, source, target, ttime, patch, run_analyze)
+$CODE$ language plpython2u;
+
+create or replace function explain_transform(config integer, source integer, target integer,
+        ttime text, run_analyze boolean default false, patch pcpatch default null)
+returns table(hop integer, transfo integer, name varchar, func_name varchar, kind varchar,
+              path_cached boolean, estimated_ms float8, lookup_ms float8,
+              actual_ms float8) as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.explain_transform(config, source, target, ttime, patch, run_analyze)
+$CODE$ language plpython2u;
+
+
+---
+-- Level of detail
+---
+
+create table datasource_lod(
+    datasource int references datasource(id) on delete cascade not null
+    , level int not null check (level > 0)
+    , uri text not null constraint uri_scheme check (check_datasource_uri(uri))
+    , decimation int not null  -- number of points of the previous level per point
+    , resolution float8  -- mean horizontal point spacing
+    , bounds double precision[6]  -- [xmin, ymin, zmin, xmax, ymax, zmax]
+    , num_points bigint
+    , primary key (datasource, level)
+);
+
+/*
+Keep every nth point of a patch
+*/
+create or replace function decimate(patch pcpatch, n integer)
+returns pcpatch as $$
+    select pc_patch(p.point)
+    from (
+        select point, row_number() over () as i from pc_explode($1) point
+    ) p
+    where (p.i - 1) % $2 = 0
+$$ language sql immutable strict;
+
+/*
+Append the decimated new patch to each level of detail of the datasource TG_ARGV[0],
+and update the bounds, number of points and resolution of the levels. Levels share
+the bounds of the datasource, which are extended with the whole patch.
+*/
+create or replace function update_lod()
+returns trigger as $$
+    declare
+        lod record;
+        source pcpatch;
+        patch pcpatch;
+        path_ text[];
+        extent double precision[];
+        new_bounds double precision[];
+    begin
+        -- TG_ARGV[0] is the datasource id, TG_ARGV[1] the patch column
+        execute format('select ($1).%I', TG_ARGV[1]) using new into source;
+        extent := li3ds.patch_extent(source);
+        patch := source;
+        for lod in
+            select * from li3ds.datasource_lod l
+            where l.datasource = TG_ARGV[0]::integer order by l.level
+        loop
+            patch := li3ds.decimate(patch, lod.decimation);
+            exit when patch is null;
+            path_ := regexp_split_to_array(split_part(lod.uri, ':', 2), '\.');
+            execute format('insert into %I.%I (%I) values ($1)', path_[1], path_[2], path_[3])
+                using patch;
+            new_bounds := li3ds.merge_bounds(lod.bounds, extent);
+            update li3ds.datasource_lod l
+            set bounds = new_bounds
+                , num_points = coalesce(l.num_points, 0) + pc_numpoints(patch)
+                , resolution = sqrt((new_bounds[4] - new_bounds[1]) *
+                                    (new_bounds[5] - new_bounds[2]) /
+                                    (coalesce(l.num_points, 0) + pc_numpoints(patch)))
+            where l.datasource = lod.datasource and l.level = lod.level;
+        end loop;
+        return null;
+    end;
+$$ language plpgsql;
+
+create or replace function build_lod(datasource integer, levels integer default 4,
+        factor integer default 4)
+returns integer as $$
+    declare
+        ds record;
+        path_ text[];
+        source_table text;
+        lod_table text;
+        npoints bigint;
+        extent double precision[];
+        lvl integer;
+    begin
+        select * from li3ds.datasource d where d.id = $1 into ds;
+        if ds is null then
+            raise exception 'no datasource with id %', $1;
+        end if;
+        if split_part(ds.uri, ':', 1) <> 'column' then
+            raise exception 'datasource % is not a column datasource', $1;
+        end if;
+        path_ := regexp_split_to_array(split_part(ds.uri, ':', 2), '\.');
+        source_table := format('%I.%I', path_[1], path_[2]);
+
+        extent := ds.bounds;
+        if extent is null then
+            execute format('select array[min(pc_patchmin(%1$I, ''x'')), min(pc_patchmin(%1$I, ''y'')), '
+                           'min(pc_patchmin(%1$I, ''z'')), max(pc_patchmax(%1$I, ''x'')), '
+                           'max(pc_patchmax(%1$I, ''y'')), max(pc_patchmax(%1$I, ''z''))] '
+                           'from %2$s', path_[3], source_table)
+                into extent;
+        end if;
+
+        delete from li3ds.datasource_lod l where l.datasource = $1;
+        execute format('drop trigger if exists %I on %s', path_[2] || '_lod', source_table);
+
+        for lvl in 1..levels loop
+            lod_table := format('%I.%I', path_[1], path_[2] || '_lod' || lvl);
+            execute format('drop table if exists %s', lod_table);
+            execute format('create table %s (id serial primary key, %I pcpatch)',
+                           lod_table, path_[3]);
+            execute format('insert into %1$s (%2$I) select li3ds.decimate(%2$I, %3$s) '
+                           'from %4$s where %2$I is not null',
+                           lod_table, path_[3], factor, source_table);
+            execute format('select sum(pc_numpoints(%I)) from %s', path_[3], lod_table)
+                into npoints;
+
+            insert into li3ds.datasource_lod
+                (datasource, level, uri, decimation, resolution, bounds, num_points)
+            values ($1, lvl,
+                    format('column:%s.%s.%s', path_[1], path_[2] || '_lod' || lvl, path_[3]),
+                    factor,
+                    sqrt((extent[4] - extent[1]) * (extent[5] - extent[2]) / nullif(npoints, 0)),
+                    extent, coalesce(npoints, 0));
+            source_table := lod_table;
+        end loop;
+
+        execute format('create trigger %I after insert on %I.%I for each row '
+                       'execute procedure li3ds.update_lod(%s, %L)',
+                       path_[2] || '_lod', path_[1], path_[2], $1, path_[3]);
+        return levels;
+    end;
+$$ language plpgsql;
+
+/*
+Return the uri of the coarsest level of detail whose resolution is finer than the
+requested one, or the datasource uri if there is none
+*/
+create or replace function lod_for_resolution(datasource integer, resolution float8)
+returns text as $$
+    select coalesce(
+        (select l.uri from li3ds.datasource_lod l
+         where l.datasource = $1 and l.resolution <= $2
+         order by l.level desc limit 1),
+        (select d.uri from li3ds.datasource d where d.id = $1))
+$$ language sql stable;
+
+
+---
+-- Export
+---
+
+create or replace function export_datasource(datasource integer, config integer,
+        target_referential integer, path text, format text default 'las',
+        ttime float8 default 0.0)
+returns bigint as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.export_datasource(datasource, config, target_referential, path, format, ttime)
+$CODE$ language plpython2u;
+
+
+---
+-- Datasource bounds and time ranges
+---
+
+/*
+Return the bounds of a patch as [xmin, ymin, zmin, xmax, ymax, zmax], the bounds of the
+x, y or z dimensions missing from its schema being null. dims are the dimensions of the
+patch schema, looked up if not provided.
+*/
+create or replace function patch_extent(patch pcpatch, dims varchar[] default null)
+returns double precision[] as $$
+    declare
+        dim varchar;
+        mins double precision[];
+        maxs double precision[];
+    begin
+        if patch is null then
+            return null;
+        end if;
+        dims := coalesce(dims, li3ds.pcid_dimensions(pc_pcid(patch)));
+        foreach dim in array array['x', 'y', 'z'] loop
+            if dim = any(dims) then
+                mins := array_append(mins, pc_patchmin(patch, dim));
+                maxs := array_append(maxs, pc_patchmax(patch, dim));
+            else
+                mins := array_append(mins, null::double precision);
+                maxs := array_append(maxs, null::double precision);
+            end if;
+        end loop;
+        return mins || maxs;
+    end;
+$$ language plpgsql stable;
+
+/*
+Return the bounds containing both bounds and extent
+*/
+create or replace function merge_bounds(bounds double precision[], extent double precision[])
+returns double precision[] as $$
+    select case
+        when $2 is null then $1
+        when $1 is null then $2
+        else array[
+            least($1[1], $2[1]), least($1[2], $2[2]), least($1[3], $2[3]),
+            greatest($1[4], $2[4]), greatest($1[5], $2[5]), greatest($1[6], $2[6])]
+    end
+$$ language sql immutable;
+
+create or replace function extend_bounds(bounds double precision[], patch pcpatch)
+returns double precision[] as $$
+    select li3ds.merge_bounds($1, li3ds.patch_extent($2))
+$$ language sql stable;
+
+/*
+Aggregates the bounds of patches as [xmin, ymin, zmin, xmax, ymax, zmax]
+*/
+create aggregate bounds_agg(pcpatch) (
+    SFUNC = extend_bounds,
+    STYPE = double precision[]
+);
+
+create or replace function extend_time_range(time_range double precision[], patch pcpatch)
+returns double precision[] as $$
+    select case
+        when $2 is null then $1
+        when $1 is null then array[pc_patchmin($2, 'time'), pc_patchmax($2, 'time')]
+        else array[least($1[1], pc_patchmin($2, 'time')),
+                   greatest($1[2], pc_patchmax($2, 'time'))]
+    end
+$$ language sql immutable;
+
+/*
+Aggregates the time range of patches as [tmin, tmax]
+*/
+create aggregate time_range_agg(pcpatch) (
+    SFUNC = extend_time_range,
+    STYPE = double precision[]
+);
+
+create or replace function update_session_time_range(session integer)
+returns void as $$
+    update li3ds.session s
+    set start_time = t.start_time, end_time = t.end_time
+    from (
+        select min(d.capture_start) as start_time, max(d.capture_end) as end_time
+        from li3ds.datasource d where d.session = $1
+    ) t
+    where s.id = $1
+$$ language sql;
+
+/*
+Extend the bounds and capture times of the datasources of the patch column
+TG_ARGV[0] of table TG_ARGV[1] with the new patch, and the time range of their
+sessions. The table is passed explicitly as the trigger may be installed on the
+partitions of a partitioned patch table. Patch times are seconds since the epoch, in
+a "time" dimension.
+*/
+create or replace function update_datasource_bounds()
+returns trigger as $$
+    declare
+        patch pcpatch;
+        dims varchar[];
+        extent double precision[];
+        time_range double precision[];
+        patch_uri text;
+    begin
+        execute format('select ($1).%I', TG_ARGV[0]) using new into patch;
+        if patch is null then
+            return null;
+        end if;
+        patch_uri := format('column:%s.%s', TG_ARGV[1], TG_ARGV[0]);
+        dims := li3ds.pcid_dimensions(pc_pcid(patch));
+        extent := li3ds.patch_extent(patch, dims);
+        if 'time' = any(dims) then
+            time_range := li3ds.extend_time_range(null, patch);
+        end if;
+
+        -- the datasource row is only locked when its bounds or capture times grow
+        update li3ds.datasource d
+        set bounds = li3ds.merge_bounds(d.bounds, extent)
+            , capture_start = least(d.capture_start, to_timestamp(time_range[1]))
+            , capture_end = greatest(d.capture_end, to_timestamp(time_range[2]))
+        where d.uri = patch_uri
+        and (d.bounds is distinct from li3ds.merge_bounds(d.bounds, extent)
+             or d.capture_start is distinct from least(d.capture_start, to_timestamp(time_range[1]))
+             or d.capture_end is distinct from greatest(d.capture_end, to_timestamp(time_range[2])));
+
+        if time_range is not null then
+            -- the session row is only locked when its time range grows
+            update li3ds.session s
+            set start_time = least(s.start_time, to_timestamp(time_range[1]))
+                , end_time = greatest(s.end_time, to_timestamp(time_range[2]))
+            from li3ds.datasource d
+            where d.uri = patch_uri and s.id = d.session
+            and (s.start_time is null or s.start_time > to_timestamp(time_range[1])
+                 or s.end_time is null or s.end_time < to_timestamp(time_range[2]));
+
+            if tg_op = 'INSERT' then
+                perform li3ds.extend_trajectory_summary(d.id, patch)
+                from li3ds.datasource d where d.uri = patch_uri and d.type = 'trajectory';
+            else
+                perform li3ds.refresh_trajectory_summary(d.id)
+                from li3ds.datasource d where d.uri = patch_uri and d.type = 'trajectory';
+            end if;
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+/*
+Recompute the bounds and capture times of a "column:" datasource from all its
+patches, and the time range of its session
+*/
+create or replace function refresh_datasource_bounds(datasource integer)
+returns double precision[] as $$
+    declare
+        ds record;
+        path_ text[];
+        new_bounds double precision[];
+        time_range double precision[];
+    begin
+        select * from li3ds.datasource d where d.id = $1 into ds;
+        if not found then
+            raise exception 'no datasource with id %', $1;
+        end if;
+        if split_part(ds.uri, ':', 1) <> 'column' then
+            return ds.bounds;
+        end if;
+        path_ := regexp_split_to_array(split_part(ds.uri, ':', 2), '\.');
+        execute format('select li3ds.bounds_agg(%1$I), '
+                       'li3ds.time_range_agg(%1$I) filter (where ''time'' = '
+                       'any(li3ds.pcid_dimensions(pc_pcid(%1$I)))) from %2$I.%3$I',
+                       path_[3], path_[1], path_[2])
+            into new_bounds, time_range;
+
+        update li3ds.datasource d
+        set bounds = new_bounds
+            , capture_start = coalesce(to_timestamp(time_range[1]), d.capture_start)
+            , capture_end = coalesce(to_timestamp(time_range[2]), d.capture_end)
+        where d.id = $1;
+        perform li3ds.update_session_time_range(ds.session);
+        return new_bounds;
+    end;
+$$ language plpgsql;
+
+/*
+Install the trigger maintaining the bounds of the datasources of the patch column
+patch_column of table uri_table ("schema.table", as in datasource uris) on relation,
+which is the table itself or one of its partitions
+*/
+create or replace function install_bounds_trigger(relation regclass, patch_column name,
+        uri_table text)
+returns void as $$
+    begin
+        if not exists (
+            select 1 from pg_trigger
+            where tgrelid = relation and tgname = patch_column || '_bounds'
+        ) then
+            execute format('create trigger %I after insert or update of %I on %s '
+                           'for each row execute procedure li3ds.update_datasource_bounds(%L, %L)',
+                           patch_column || '_bounds', patch_column, relation,
+                           patch_column, uri_table);
+        end if;
+    end;
+$$ language plpgsql;
+
+/*
+Install the trigger maintaining the bounds on the patch table of a new "column:"
+datasource, and compute its initial bounds. Before PostgreSQL 11 partitioned tables
+cannot have row triggers, the trigger is then installed on each partition, and
+add_patch_partition installs it on the partitions added later.
+*/
+create or replace function track_datasource_bounds()
+returns trigger as $$
+    declare
+        path_ text[];
+        relation regclass;
+        leaf regclass;
+    begin
+        if split_part(new.uri, ':', 1) <> 'column' then
+            return null;
+        end if;
+        path_ := regexp_split_to_array(split_part(new.uri, ':', 2), '\.');
+        relation := format('%I.%I', path_[1], path_[2])::regclass;
+        if current_setting('server_version_num')::integer < 110000
+            and (select relkind from pg_class where oid = relation) = 'p' then
+            for leaf in
+                with recursive tree(relid) as (
+                    select relation::oid
+                    union all
+                    select i.inhrelid from pg_inherits i join tree t on i.inhparent = t.relid
+                )
+                select t.relid::regclass from tree t
+                join pg_class c on c.oid = t.relid
+                where c.relkind = 'r'
+            loop
+                perform li3ds.install_bounds_trigger(leaf, path_[3], path_[1] || '.' || path_[2]);
+            end loop;
+        else
+            perform li3ds.install_bounds_trigger(relation, path_[3], path_[1] || '.' || path_[2]);
+        end if;
+        if new.bounds is null then
+            perform li3ds.refresh_datasource_bounds(new.id);
+        end if;
+        if new.type = 'trajectory' then
+            insert into li3ds.trajectory_summary (datasource) values (new.id);
+            perform li3ds.refresh_trajectory_summary(new.id);
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger datasource_bounds after insert on datasource
+for each row execute procedure track_datasource_bounds();
+
+
+---
+-- Processing lineage
+---
+
+alter table processing
+    add foreign key (config) references platform_config(id) on delete set null;
+
+create index on processing using gin (transfos);
+
+/*
+Mark the processings and, recursively, the processings using their targets as
+sources as stale. Returns the number of processings marked.
+*/
+create or replace function mark_processing_stale(processings integer[])
+returns integer as $$
+    declare
+        cnt integer;
+    begin
+        with recursive stale(id, target) as (
+            select p.id, p.target from li3ds.processing p where p.id = any($1)
+            union
+            select p.id, p.target from li3ds.processing p join stale s on p.source = s.target
+        )
+        update li3ds.processing p set stale = true
+        from stale s where p.id = s.id and not p.stale;
+        get diagnostics cnt = row_count;
+        return cnt;
+    end;
+$$ language plpgsql;
+
+create or replace function transfo_changed()
+returns trigger as $$
+    begin
+        -- new is not assigned on delete, so that it is only read in a nested if
+        if tg_op = 'UPDATE' then
+            if (new.source, new.target) = (old.source, old.target) then
+                -- only the processings whose path goes through the transfo are affected
+                perform li3ds.mark_processing_stale(array(
+                    select p.id from li3ds.processing p where p.transfos @> array[old.id]));
+                return null;
+            end if;
+        end if;
+        -- the paths of the configs containing the transfo may change
+        perform li3ds.mark_processing_stale(array(
+            select p.id from li3ds.processing p
+            join li3ds.platform_config pc on pc.id = p.config
+            join li3ds.transfo_tree tt on tt.id = any(pc.transfo_trees)
+            where old.id = any(tt.transfos)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger transfo_changed after update or delete on transfo
+for each row execute procedure transfo_changed();
+
+create or replace function transfo_tree_changed()
+returns trigger as $$
+    begin
+        perform li3ds.mark_processing_stale(array(
+            select p.id from li3ds.processing p
+            join li3ds.platform_config pc on pc.id = p.config
+            where old.id = any(pc.transfo_trees)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger transfo_tree_changed after update or delete on transfo_tree
+for each row execute procedure transfo_tree_changed();
+
+create or replace function platform_config_changed()
+returns trigger as $$
+    begin
+        if new.transfo_trees is distinct from old.transfo_trees then
+            perform li3ds.mark_processing_stale(array(
+                select p.id from li3ds.processing p where p.config = old.id));
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger platform_config_changed after update on platform_config
+for each row execute procedure platform_config_changed();
+
+create or replace function transform_datasource(source integer, config integer, target integer,
+        ttime float8 default 0.0)
+returns integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_datasource(source, config, target, ttime)
+$CODE$ language plpython2u;
+
+create or replace function reprocess_stale()
+returns integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.reprocess_stale()
+$CODE$ language plpython2u;
+
+
+---
+-- Georeferencing
+---
+
+/*
+Move the points of the lidar patches into the frame of the trajectory, using the
+trajectory pose interpolated at the time of each point. Returns the lidar_key of each
+lidar row with its georeferenced patch, which is null if no trajectory patch covers
+the lidar patch.
+*/
+create or replace function georeference(lidar_table regclass, lidar_col name,
+        traj_table regclass, traj_col name, dimension varchar default 'time',
+        lidar_key name default 'id')
+returns table(id bigint, patch pcpatch) as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.georeference(lidar_table, lidar_col, traj_table, traj_col, dimension,
+                                 lidar_key)
+$CODE$ language plpython2u;
+
+
+---
+-- Partitioned patch tables
+---
+
+create table patch_partitioning(
+    parent regclass primary key
+    , patch_column name not null
+    , dimension varchar not null
+    , max_patch_duration float8 not null
+);
+
+create table patch_partition(
+    partition regclass primary key
+    , parent regclass references patch_partitioning(parent) on delete cascade not null
+    , session int references session(id) on delete cascade not null
+    , start_time float8 not null
+    , end_time float8 not null
+);
+
+/*
+Return the table of a "schema.table.column" parameters column, or null if it does not
+exist
+*/
+create or replace function parameters_table(parameters_column varchar)
+returns regclass as $$
+    select to_regclass(format('%I.%I', split_part($1, '.', 1), split_part($1, '.', 2)))
+$$ language sql stable strict;
+
+/*
+Snapshot the platform configs using a patch table whose partitioning changes, so that
+their new versions record its maximum patch duration
+*/
+create or replace function patch_partitioning_changed()
+returns trigger as $$
+    begin
+        perform li3ds.snapshot_platform_configs(array(
+            select pc.id from li3ds.platform_config pc
+            where exists (
+                select 1 from li3ds.transfo_tree tr
+                join li3ds.transfo t on t.id = any(tr.transfos)
+                where tr.id = any(pc.transfo_trees)
+                and li3ds.parameters_table(t.parameters_column) =
+                    case when tg_op = 'DELETE' then old.parent else new.parent end
+            )));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger patch_partitioning_changed after insert or update or delete
+on patch_partitioning
+for each row execute procedure patch_partitioning_changed();
+
+create or replace function check_partitioning_support()
+returns void as $$
+    begin
+        if current_setting('server_version_num')::integer < 100000 then
+            raise exception 'partitioned patch tables require PostgreSQL 10 or later';
+        end if;
+    end;
+$$ language plpgsql;
+
+/*
+Create a patch table partitioned by session and by patch start time. The duration
+of the patches is bounded so that time-bounded queries can prune partitions on both
+sides of the time window.
+*/
+create or replace function create_patch_table(schema_name name, table_name name,
+        max_patch_duration float8, patch_column name default 'points',
+        dimension varchar default 'time')
+returns regclass as $$
+    declare
+        parent regclass;
+    begin
+        perform li3ds.check_partitioning_support();
+        execute format('create table %1$I.%2$I ('
+                       'id bigserial, session integer not null, %3$I pcpatch not null, '
+                       'check (pc_patchmax(%3$I, %4$L) - pc_patchmin(%3$I, %4$L) <= %5$s)'
+                       ') partition by list (session)',
+                       schema_name, table_name, patch_column, dimension, max_patch_duration);
+        parent := format('%I.%I', schema_name, table_name)::regclass;
+        insert into li3ds.patch_partitioning (parent, patch_column, dimension, max_patch_duration)
+        values (parent, patch_column, dimension, max_patch_duration);
+        return parent;
+    end;
+$$ language plpgsql;
+
+/*
+Add the partition of a session for patches starting in [start_time, end_time). The
+partition is named after the session and the start time, which are unique as the
+partitions of a session cannot overlap.
+*/
+create or replace function add_patch_partition(parent regclass, session integer,
+        start_time float8, end_time float8)
+returns regclass as $$
+    declare
+        part record;
+        schema_name name;
+        table_name name;
+        session_table regclass;
+        partition_name text;
+    begin
+        perform li3ds.check_partitioning_support();
+        select * from li3ds.patch_partitioning p where p.parent = $1 into part;
+        if not found then
+            raise exception '% is not a li3ds partitioned patch table', $1;
+        end if;
+        select n.nspname, c.relname from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.oid = $1
+        into schema_name, table_name;
+
+        session_table := to_regclass(format('%I.%I', schema_name, table_name || '_s' || $2));
+        if session_table is null then
+            execute format('create table %1$I.%2$I partition of %3$s for values in (%4$s) '
+                           'partition by range (pc_patchmin(%5$I, %6$L))',
+                           schema_name, table_name || '_s' || $2, $1, $2,
+                           part.patch_column, part.dimension);
+            session_table := format('%I.%I', schema_name, table_name || '_s' || $2)::regclass;
+        end if;
+
+        partition_name := table_name || '_s' || $2 || '_' || translate($3::text, '-.+', 'm_p');
+        execute format('create table %I.%I partition of %s for values from (%s) to (%s)',
+                       schema_name, partition_name, session_table, $3, $4);
+        execute format('create index on %I.%I (pc_patchmin(%I, %L))',
+                       schema_name, partition_name, part.patch_column, part.dimension);
+        if current_setting('server_version_num')::integer < 110000 and exists (
+            select 1 from li3ds.datasource d
+            where d.uri = format('column:%s.%s.%s', schema_name, table_name, part.patch_column)
+        ) then
+            perform li3ds.install_bounds_trigger(
+                format('%I.%I', schema_name, partition_name)::regclass,
+                part.patch_column, schema_name || '.' || table_name);
+        end if;
+
+        insert into li3ds.patch_partition (partition, parent, session, start_time, end_time)
+        values (format('%I.%I', schema_name, partition_name)::regclass, $1, $2, $3, $4);
+        return format('%I.%I', schema_name, partition_name)::regclass;
+    end;
+$$ language plpgsql;
+
+/*
+Drop the partitions of a patch table whose patches all start before a time
+*/
+create or replace function drop_patch_partitions(parent regclass, before float8)
+returns integer as $$
+    declare
+        part record;
+        cnt integer := 0;
+    begin
+        for part in
+            select p.partition from li3ds.patch_partition p
+            where p.parent = $1 and p.end_time <= $2
+        loop
+            delete from li3ds.patch_partition p where p.partition = part.partition;
+            execute format('drop table %s', part.partition);
+            cnt := cnt + 1;
+        end loop;
+        return cnt;
+    end;
+$$ language plpgsql;
+
+
+---
+-- Batch transformation functions, for many times at once
+---
+
+create or replace function transfo_params(transfo integer, ttimes float8[])
+returns setof jsonb as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transfo_params(transfo, ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(box4d libox4d, transfo integer, ttimes float8[])
+returns setof libox4d as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_box4d_times(box4d, [transfo], ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(box4d libox4d, transfos integer[], ttimes float8[])
+returns setof libox4d as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_box4d_times(box4d, transfos, ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(box4d libox4d, config integer, source integer, target integer, ttimes float8[])
+returns setof libox4d as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_box4d_times_config(box4d, config, source, target, ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(point float8[3], transfo integer, ttimes float8[])
+returns setof float8[3] as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_point_times(point, [transfo], ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(point float8[3], transfos integer[], ttimes float8[])
+returns setof float8[3] as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_point_times(point, transfos, ttimes)
+$CODE$ language plpython2u;
+
+create or replace function transform(point float8[3], config integer, source integer, target integer, ttimes float8[])
+returns setof float8[3] as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transform_point_times_config(point, config, source, target, ttimes)
+$CODE$ language plpython2u;
+
+
+---
+-- Transformed views
+---
+
+/*
+3D bounding box of a patch, used to index and prune patches on their x, y and z bounds
+*/
+create or replace function patch_bounds(patch pcpatch)
+returns geometry as $$
+    select st_3dmakebox(
+        st_makepoint(pc_patchmin($1, 'x'), pc_patchmin($1, 'y'), pc_patchmin($1, 'z')),
+        st_makepoint(pc_patchmax($1, 'x'), pc_patchmax($1, 'y'), pc_patchmax($1, 'z'))
+    )::geometry
+$$ language sql immutable strict;
+
+create table transformed_view(
+    relation regclass primary key
+    , datasource int references datasource(id) on delete cascade not null
+    , config int references platform_config(id) on delete cascade not null
+    , referential int references referential(id) on delete cascade not null
+    , column_name name not null  -- transformed patch column
+);
+
+/*
+Create a view exposing the patches of a "column:" datasource transformed into the
+target referential, with their bounds in the datasource referential in a
+source_bounds column, and index the patch table on those bounds
+*/
+create or replace function create_transformed_view(datasource integer, config integer,
+        target_referential integer, view_name name default null)
+returns regclass as $$
+    declare
+        ds record;
+        path_ text[];
+        columns_ text;
+        view_ regclass;
+    begin
+        select * from li3ds.datasource d where d.id = $1 into ds;
+        if ds is null then
+            raise exception 'no datasource with id %', $1;
+        end if;
+        if split_part(ds.uri, ':', 1) <> 'column' then
+            raise exception 'datasource % is not a column datasource', $1;
+        end if;
+        if ds.referential <> target_referential
+                and li3ds.dijkstra(config, ds.referential, target_referential) = '{}' then
+            raise exception 'no path from referential % to referential % with config %',
+                ds.referential, target_referential, config;
+        end if;
+        path_ := regexp_split_to_array(split_part(ds.uri, ':', 2), '\.');
+        view_name := coalesce(view_name, path_[2] || '_ref' || target_referential);
+
+        select string_agg(
+            case when a.attname = path_[3]
+            then format('li3ds.transform(t.%1$I, %2$s, %3$s, %4$s) as %1$I',
+                        a.attname, config, ds.referential, target_referential)
+            else format('t.%I', a.attname) end,
+            ', ' order by a.attnum)
+        from pg_attribute a
+        where a.attrelid = format('%I.%I', path_[1], path_[2])::regclass
+            and a.attnum > 0 and not a.attisdropped
+        into columns_;
+
+        execute format('create or replace view %I.%I as '
+                       'select %s, li3ds.patch_bounds(t.%I) as source_bounds from %I.%I t',
+                       path_[1], view_name, columns_, path_[3], path_[1], path_[2]);
+        execute format('create index if not exists %I on %I.%I '
+                       'using gist (li3ds.patch_bounds(%I) gist_geometry_ops_nd)',
+                       path_[2] || '_' || path_[3] || '_bounds', path_[1], path_[2], path_[3]);
+
+        view_ := format('%I.%I', path_[1], view_name)::regclass;
+        delete from li3ds.transformed_view v where v.relation = view_;
+        insert into li3ds.transformed_view (relation, datasource, config, referential, column_name)
+        values (view_, $1, config, target_referential, path_[3]);
+        return view_;
+    end;
+$$ language plpgsql;
+
+create or replace function transformed_view_bounds(relation regclass, geom geometry)
+returns geometry as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.transformed_view_bounds(relation, geom)
+$CODE$ language plpython2u stable;
+
+/*
+Return the rows of the transformed view whose type is the type of relation (use
+null::view) and whose transformed patch intersects the bounding box of geom. geom is
+first transformed back into the datasource referential so that only the patches
+which can intersect it are transformed. All patches are transformed if the transform
+path of the view cannot be inverted.
+*/
+create or replace function transformed_view_patches(relation anyelement, geom geometry)
+returns setof anyelement as $$
+    declare
+        view_ regclass := pg_typeof(relation)::text::regclass;
+        column_name_ name;
+    begin
+        select v.column_name from li3ds.transformed_view v where v.relation = view_
+        into column_name_;
+        if column_name_ is null then
+            raise exception '% is not a transformed view', view_;
+        end if;
+        -- "offset 0" keeps the view from being flattened, so that each patch
+        -- is transformed once
+        return query execute format(
+            'select v.* from ('
+            '  select * from %s v where $1 is null or v.source_bounds &&& $1 offset 0'
+            ') v where li3ds.patch_bounds(v.%I) &&& $2',
+            view_, column_name_)
+        using li3ds.transformed_view_bounds(view_, geom), geom;
+    end;
+$$ language plpgsql stable;
+
+
+---
+-- Compiled transforms
+---
+
+create table compiled_transform(
+    config int references platform_config(id) on delete cascade not null
+    , source int references referential(id) on delete cascade not null
+    , target int references referential(id) on delete cascade not null
+    , transfos integer[] not null
+    , function_name name not null
+    , primary key (config, source, target)
+);
+
+create or replace function drop_compiled_transform()
+returns trigger as $$
+    begin
+        execute format('drop function if exists li3ds.%I(pcpatch)', old.function_name);
+        execute format('drop function if exists li3ds.%I(libox4d)', old.function_name);
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger compiled_transform_deleted after delete on compiled_transform
+for each row execute procedure drop_compiled_transform();
+
+/*
+Generate the li3ds.transform_<config>_<source>_<target>(pcpatch) and
+li3ds.transform_<config>_<source>_<target>(libox4d) functions, which apply the
+static transform path from source to target with the transfo parameters inlined. The
+box function bounds the transformed box samples, as transform(libox4d, ...) does
+*/
+create or replace function compile_transform(config integer, source integer, target integer)
+returns text as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.compile_transform(config, source, target)
+$CODE$ language plpython2u;
+
+create or replace function recompile_transforms(configs integer[])
+returns integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.recompile_transforms(configs)
+$CODE$ language plpython2u;
+
+create or replace function recompile_transforms_on_transfo()
+returns trigger as $$
+    begin
+        perform li3ds.recompile_transforms(array(
+            select distinct pc.id from li3ds.platform_config pc
+            join li3ds.transfo_tree tt on tt.id = any(pc.transfo_trees)
+            where old.id = any(tt.transfos)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger recompile_transforms after update or delete on transfo
+for each row execute procedure recompile_transforms_on_transfo();
+
+create or replace function recompile_transforms_on_transfo_tree()
+returns trigger as $$
+    begin
+        perform li3ds.recompile_transforms(array(
+            select pc.id from li3ds.platform_config pc where old.id = any(pc.transfo_trees)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger recompile_transforms after update or delete on transfo_tree
+for each row execute procedure recompile_transforms_on_transfo_tree();
+
+create or replace function recompile_transforms_on_platform_config()
+returns trigger as $$
+    begin
+        if new.transfo_trees is distinct from old.transfo_trees then
+            perform li3ds.recompile_transforms(array[old.id]);
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger recompile_transforms after update on platform_config
+for each row execute procedure recompile_transforms_on_platform_config();
+
+
+---
+-- Trajectory summaries
+---
+
+/*
+Simplified trajectory of each "column:" trajectory datasource, in the srid of its
+referential, with the patch times (seconds since the epoch) as measures
+*/
+create table trajectory_summary(
+    datasource int primary key references datasource(id) on delete cascade
+    , tolerance float8 not null default 0.1  -- simplification tolerance, in srid units
+    , geom geometry(linestringzm)
+    , time_range tstzrange
+);
+
+create index on trajectory_summary using gist (geom);
+create index on trajectory_summary using gist (time_range);
+
+/*
+Line through the points of a trajectory patch ordered by time, the time being the
+measure of each vertex
+*/
+create or replace function patch_linestring(patch pcpatch, srid integer default 0)
+returns geometry as $$
+    select st_setsrid(st_makeline(
+        st_makepoint(pc_get(p, 'x'), pc_get(p, 'y'), pc_get(p, 'z'), pc_get(p, 'time'))
+        order by pc_get(p, 'time')), $2)
+    from pc_explode($1) p
+$$ language sql immutable strict;
+
+create or replace function trajectory_srid(datasource integer)
+returns integer as $$
+    select coalesce(r.srid, 0)
+    from li3ds.datasource d join li3ds.referential r on r.id = d.referential
+    where d.id = $1
+$$ language sql stable;
+
+create or replace function set_trajectory_summary(datasource integer, geom geometry)
+returns void as $$
+    update li3ds.trajectory_summary s
+    set geom = $2
+        , time_range = case when $2 is not null then
+              tstzrange(to_timestamp(st_m(st_startpoint($2))),
+                        to_timestamp(st_m(st_endpoint($2))), '[]') end
+    where s.datasource = $1
+$$ language sql;
+
+/*
+Rebuild the summary of a trajectory datasource from all its patches
+*/
+create or replace function refresh_trajectory_summary(datasource integer)
+returns geometry as $$
+    declare
+        ds record;
+        path_ text[];
+        tolerance_ float8;
+        geom_ geometry;
+    begin
+        select * from li3ds.datasource d where d.id = $1 into ds;
+        if ds is null then
+            raise exception 'no datasource with id %', $1;
+        end if;
+        select s.tolerance from li3ds.trajectory_summary s where s.datasource = $1
+        into tolerance_;
+        if tolerance_ is null or split_part(ds.uri, ':', 1) <> 'column' then
+            return null;
+        end if;
+        path_ := regexp_split_to_array(split_part(ds.uri, ':', 2), '\.');
+        execute format('select st_simplify(st_makeline(li3ds.patch_linestring(%1$I, $1) '
+                       'order by pc_patchmin(%1$I, ''time'')), $2, true) '
+                       'from %2$I.%3$I', path_[3], path_[1], path_[2])
+            using li3ds.trajectory_srid($1), tolerance_
+            into geom_;
+        perform li3ds.set_trajectory_summary($1, geom_);
+        return geom_;
+    end;
+$$ language plpgsql;
+
+/*
+Append a new patch to the summary of a trajectory datasource. Patches are expected to
+be appended in time order, the summary is rebuilt otherwise.
+*/
+create or replace function extend_trajectory_summary(datasource integer, patch pcpatch)
+returns geometry as $$
+    declare
+        geom_ geometry;
+    begin
+        -- a single update, so that concurrent appends do not overwrite each other
+        update li3ds.trajectory_summary s
+        set geom = case when s.geom is null then p.part else st_makeline(s.geom, p.part) end
+            , time_range = tstzrange(
+                coalesce(lower(s.time_range), to_timestamp(st_m(st_startpoint(p.part)))),
+                to_timestamp(st_m(st_endpoint(p.part))), '[]')
+        from (
+            select st_simplify(li3ds.patch_linestring($2, li3ds.trajectory_srid($1)),
+                               t.tolerance, true) as part
+            from li3ds.trajectory_summary t where t.datasource = $1
+        ) p
+        where s.datasource = $1 and p.part is not null
+        and (s.geom is null or pc_patchmin($2, 'time') >= st_m(st_endpoint(s.geom)))
+        returning s.geom into geom_;
+        if found then
+            return geom_;
+        end if;
+        if exists (select 1 from li3ds.trajectory_summary s where s.datasource = $1) then
+            return li3ds.refresh_trajectory_summary($1);
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+
+---
+-- Platform config versions
+---
+
+/*
+Immutable copies of the transfos of the platform configs. A new version is created
+whenever a platform config, or one of its transfo trees or transfos, is modified.
+Readers use the latest version of a config, or the one pinned by the
+li3ds.config_<config>_version setting. Version ids come from a sequence, so that they
+are never reused, even by rolled back modifications, and can key backend caches.
+*/
+create table platform_config_version(
+    config int references platform_config(id) on delete cascade not null
+    , version serial
+    , created timestamptz not null default now()
+    , transfo_trees integer[]
+    , transfos jsonb not null
+    , primary key (config, version)
+);
+
+create or replace function snapshot_platform_config(config integer)
+returns integer as $$
+    insert into li3ds.platform_config_version (config, transfo_trees, transfos)
+    select pc.id
+        , pc.transfo_trees
+        , coalesce((
+            select jsonb_agg(jsonb_build_object(
+                'id', t.id, 'name', t.name, 'source', t.source, 'target', t.target,
+                'params_column', t.parameters_column, 'params', t.parameters,
+                'func_name', tt.name, 'func_sign', tt.func_signature,
+                'max_patch_duration', pp.max_patch_duration) order by t.id)
+            from li3ds.transfo t
+            left join li3ds.transfo_type tt on tt.id = t.transfo_type
+            left join li3ds.patch_partitioning pp
+                on pp.parent = li3ds.parameters_table(t.parameters_column)
+                and pp.patch_column = split_part(t.parameters_column, '.', 3)
+                and pp.dimension = 'time'
+            where t.id in (
+                select unnest(tr.transfos) from li3ds.transfo_tree tr
+                where tr.id = any(pc.transfo_trees))
+          ), '[]')
+    from li3ds.platform_config pc
+    where pc.id = $1
+    returning version
+$$ language sql;
+
+create or replace function snapshot_platform_configs(configs integer[])
+returns integer as $$
+    select count(li3ds.snapshot_platform_config(c))::integer
+    from (select distinct unnest($1) c) configs
+$$ language sql;
+
+create or replace function platform_config_version_on_transfo()
+returns trigger as $$
+    begin
+        perform li3ds.snapshot_platform_configs(array(
+            select pc.id from li3ds.platform_config pc
+            join li3ds.transfo_tree tt on tt.id = any(pc.transfo_trees)
+            where old.id = any(tt.transfos)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger platform_config_version after update or delete on transfo
+for each row execute procedure platform_config_version_on_transfo();
+
+create or replace function platform_config_version_on_transfo_tree()
+returns trigger as $$
+    begin
+        perform li3ds.snapshot_platform_configs(array(
+            select pc.id from li3ds.platform_config pc where old.id = any(pc.transfo_trees)));
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger platform_config_version after update or delete on transfo_tree
+for each row execute procedure platform_config_version_on_transfo_tree();
+
+create or replace function platform_config_version_on_platform_config()
+returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            perform li3ds.snapshot_platform_config(new.id);
+        elsif new.transfo_trees is distinct from old.transfo_trees then
+            perform li3ds.snapshot_platform_config(new.id);
+        end if;
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger platform_config_version after insert or update on platform_config
+for each row execute procedure platform_config_version_on_platform_config();
+
+
+---
+-- File datasources
+---
+
+/*
+Indexed LAS or PLY files of "file:" datasources. The size and modification time of the
+file when it was indexed tell whether the index is still valid.
+*/
+create table file_index(
+    datasource int primary key references datasource(id) on delete cascade
+    , file_size bigint not null
+    , file_mtime float8 not null
+);
+
+/*
+Chunks of the indexed files, with their offset in the file and their time range and
+bounds
+*/
+create table file_chunk_index(
+    datasource int references file_index(datasource) on delete cascade not null
+    , chunk int not null
+    , file_offset bigint not null  -- offset of the first point of the chunk
+    , num_points int not null
+    , tmin float8
+    , tmax float8
+    , bounds geometry not null  -- 3D box of the points of the chunk
+    , primary key (datasource, chunk)
+);
+
+create index on file_chunk_index using gist (bounds gist_geometry_ops_nd);
+
+create or replace function file_datasource_changed()
+returns trigger as $$
+    begin
+        delete from li3ds.file_index where datasource = old.id;
+        return null;
+    end;
+$$ language plpgsql;
+
+create trigger file_datasource_changed after update of uri, parameters on datasource
+for each row execute procedure file_datasource_changed();
+
+create or replace function index_file_datasource(datasource integer,
+        chunk_size integer default null)
+returns integer as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.index_file_datasource(datasource, chunk_size)
+$CODE$ language plpython2u;
+
+/*
+Read the chunks of a "file:" datasource intersecting a time range and the bounding box
+of a geometry as patches of the pcid of the datasource parameters. The file is memory
+mapped and only the selected chunks are read. The file is indexed first if needed,
+which cannot be done in read-only transactions, for instance on standbys, where
+index_file_datasource must have been run on the primary beforehand.
+*/
+create or replace function read_file_datasource(datasource integer,
+        time_min float8 default null, time_max float8 default null,
+        geom geometry default null)
+returns setof pcpatch as
+$CODE$
+    import pg_li3ds
+    return pg_li3ds.read_file_datasource(datasource, time_min, time_max, geom)
+$CODE$ language plpython2u;
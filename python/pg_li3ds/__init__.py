@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 from heapq import heappop, heappush
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 from itertools import chain
+import copy
 import json
+import math
+import mmap
+import os
 import bisect
 import datetime
+import struct
 import dateutil.parser
+from timeit import default_timer as timer
 
 import plpy
 
+from pg_li3ds.bounds import box_samples, bounding_box
+
 
 __version__ = '0.1.dev0'
 
@@ -22,6 +30,14 @@ func_names = {
     'projective_pinhole_inverse': 'PC_ProjectivePinholeInverse',
 }
 
+# inverse of each function, for the functions which have one
+inverse_func_names = {
+    'affine_quat': 'affine_quat_inverse',
+    'affine_quat_inverse': 'affine_quat',
+    'projective_pinhole': 'projective_pinhole_inverse',
+    'projective_pinhole_inverse': 'projective_pinhole',
+}
+
 
 def isconnected(transfos, doubletransfo=False):
     """
@@ -84,56 +100,89 @@ def isconnected(transfos, doubletransfo=False):
     return success
 
 
-def dijkstra(config, source, target, stoptosensor=''):
+# platform config versions, as dicts of their transfos keyed on transfo id, keyed on
+# (config, version), and the transfo paths found in them, keyed on (config, version,
+# source, target). Versions are immutable, so that these caches are never invalidated,
+# but the least recently used entries are evicted to bound their size.
+config_versions = OrderedDict()
+config_paths = OrderedDict()
+max_config_versions = 64
+max_config_paths = 1024
+
+
+def cache_get(cache, key):
+    ''' Return the value of key in the cache, marking it as the most recently used, or
+        None if the cache does not contain key.
     '''
-    returns the transfo list needed to go from source referential to target
-    referential
+    if key not in cache:
+        return None
+    value = cache.pop(key)
+    cache[key] = value
+    return value
+
+
+def cache_put(cache, key, value, max_size):
+    ''' Add key to the cache, evicting the least recently used entries beyond max_size.
     '''
+    cache[key] = value
+    while len(cache) > max_size:
+        cache.popitem(last=False)
 
-    # get all transformations involved in the transfo tree list
-    transfo_list = plpy.execute(
-        """
-        select array_aggmult(tt.transfos) as trf
-        from li3ds.platform_config pf
-        join li3ds.transfo_tree tt on tt.id = ANY(pf.transfo_trees)
-        where pf.id = {}
-        """.format(config)
-    )[0]['trf']
-
-    transfo_list_coma_separated = ','.join(map(str, transfo_list))
-
-    # list of adjacent nodes (referentials)
-    # adj_list = [ref1: [ref7, ref1], ref2: [ref3]...]
-    result = plpy.execute(
-        """
-        select
-            r.id
-            , array_agg(t.target)
-              filter (where t.target is not NULL) as adj_list
-              -- we keep a NULL column instead of an array
-              -- with a null value inside
-        from li3ds.referential r
-        left join li3ds.transfo t
-            -- we only keep direct transformations
-            on t.source = r.id
-            and array[t.id] <@ array[{}]::integer[]
-        group by r.id
-        """.format(transfo_list_coma_separated)
-    )
-    # build graph
-    # graph = {ref1: [(1, ref7), (1, ref3)...], ...}
-    graph = {}
-    for column in result:
-        if column['adj_list'] is not None:
-            graph[column['id']] = [(1, idt) for idt in column['adj_list']]
-        else:
-            graph[column['id']] = []
 
-    if source not in graph:
+def config_version(config):
+    ''' Return the version of config pinned by the "li3ds.config_<config>_version"
+        setting, or its latest version.
+    '''
+    rv = plpy.execute(
+        '''
+        select coalesce(
+            nullif(current_setting('li3ds.config_{0:d}_version', true), '')::integer,
+            (select max(version) from li3ds.platform_config_version where config = {0:d})
+        ) as version
+        '''.format(config))
+    version = rv[0]['version']
+    if version is None:
+        plpy.error('no platform config with id {:d}'.format(config))
+    return version
+
+
+def get_config_version(config, version):
+    ''' Return the transfos of the version of config, as a dict keyed on transfo id.
+    '''
+    key = (config, version)
+    transfos = cache_get(config_versions, key)
+    if transfos is None:
+        rv = plpy.execute(
+            '''
+            select transfos from li3ds.platform_config_version
+            where config = {:d} and version = {:d}
+            '''.format(config, version))
+        if not rv:
+            plpy.error('no version {:d} of platform config {:d}'.format(version, config))
+        transfos = dict(
+            (transfo['id'], transfo) for transfo in json.loads(rv[0]['transfos']))
+        cache_put(config_versions, key, transfos, max_config_versions)
+    return transfos
+
+
+def referential_path(transfos, config, source, target):
+    ''' Return the shortest list of referentials going from source to target through the
+        transfos, or an empty list if there is none.
+    '''
+    rv = plpy.execute(
+        'select id from li3ds.referential where id in ({:d}, {:d})'.format(source, target))
+    referentials = set(r['id'] for r in rv)
+    if source not in referentials:
         raise Exception("No referential with id {}".format(source))
-    if target not in graph:
+    if target not in referentials:
         raise Exception("No referential with id {}".format(target))
 
+    # build graph
+    # graph = {ref1: [(1, ref7), (1, ref3)...], ...}
+    graph = defaultdict(list)
+    for transfo in sorted(transfos.values(), key=lambda t: t['id']):
+        graph[transfo['source']].append((1, transfo['target']))
+
     M = set()
     d = {source: 0}
     p = {}
@@ -166,8 +215,44 @@ def dijkstra(config, source, target, stoptosensor=''):
                         .format(source, target, config))
             return []
         shortest_path.insert(0, x)
+    return shortest_path
+
 
+def config_path(config, source, target, version=None):
+    ''' Return the transfo list needed to go from source referential to target
+        referential in version of config, or its pinned or latest version if version is
+        None, the transfos of that version, and whether the path was already cached.
+    '''
+    if version is None:
+        version = config_version(config)
+    transfos = get_config_version(config, version)
+    key = (config, version, source, target)
+    path = cache_get(config_paths, key)
+    cached = path is not None
+    if not cached:
+        shortest_path = referential_path(transfos, config, source, target)
+        # we have referentials now we need all transformations
+        # assembling refs by pair
+        edges = {}
+        for transfo in sorted(transfos.values(), key=lambda t: t['id'], reverse=True):
+            edges[(transfo['source'], transfo['target'])] = transfo['id']
+        path = [
+            edges[(shortest_path[i], shortest_path[i + 1])]
+            for i in range(0, len(shortest_path) - 1)]
+        cache_put(config_paths, key, path, max_config_paths)
+    return list(path), transfos, cached
+
+
+def dijkstra(config, source, target, stoptosensor=''):
+    '''
+    returns the transfo list needed to go from source referential to target
+    referential
+    '''
     if stoptosensor:
+        transfos = get_config_version(config, config_version(config))
+        shortest_path = referential_path(transfos, config, source, target)
+        if not shortest_path:
+            return []
         # if a sensor type was requested we want to return
         # the first referential matching that type
         for ref in shortest_path:
@@ -180,23 +265,7 @@ def dijkstra(config, source, target, stoptosensor=''):
         raise Exception(
             "No referential in path with type {}".format(stoptosensor))
 
-    # we have referentials now we need all transformations
-    # assembling refs by pair
-    ref_pair = [
-        shortest_path[i:i + 2]
-        for i in range(0, len(shortest_path) - 1)]
-
-    transfos = []
-    for ref_source, ref_target in ref_pair:
-        transfos.append(plpy.execute(
-            """
-            select id
-            from li3ds.transfo
-            where source = {} and target = {}
-            and array[id] <@ array[{}]::integer[]
-            """.format(ref_source, ref_target, transfo_list_coma_separated))[0]['id'])
-
-    return transfos
+    return config_path(config, source, target)[0]
 
 
 def append_dim_select(dim, select):
@@ -205,8 +274,49 @@ def append_dim_select(dim, select):
     select.append('PC_Get(point, \'{}\') {}'.format(dim, plpy.quote_ident(dim)))
 
 
-def get_dyn_transfo_params_form_1(params_column, params, time):
-    ''' Return the dynamic transfo parameters.
+def max_patch_duration(params_column):
+    ''' Return the maximum patch duration if params_column belongs to a patch table
+        created by create_patch_table, and None otherwise.
+    '''
+    schema, table, column = params_column.split('.')
+    plan = plpy.prepare(
+        '''
+        select max_patch_duration from li3ds.patch_partitioning
+        where parent = to_regclass($1) and patch_column = $2 and dimension = 'time'
+        ''', ['text', 'text'])
+    rv = plpy.execute(plan, [
+        '{}.{}'.format(plpy.quote_ident(schema), plpy.quote_ident(table)), column])
+    if not rv:
+        return None
+    return rv[0]['max_patch_duration']
+
+
+def transfo_patch_duration(transfo):
+    ''' Return the maximum patch duration of the parameters column of a form-1 transfo.
+        Config version snapshots record it when they are taken, and are taken again when
+        the partitioned patch tables change, so that it is only looked up for the
+        transfos read from the transfo table or from older snapshots.
+    '''
+    if 'max_patch_duration' in transfo:
+        return transfo['max_patch_duration']
+    return max_patch_duration(transfo['params_column'])
+
+
+def partition_filter(params_column, time, duration):
+    ''' Return an additional condition on the patch start time if params_column belongs
+        to a patch table created by create_patch_table, whose patch duration is bounded
+        by duration. The condition lets the planner prune the partitions ending before
+        time.
+    '''
+    if duration is None:
+        return ''
+    column = plpy.quote_ident(params_column.split('.')[2])
+    return ' and pc_patchmin({}, \'time\') >= {:f}'.format(column, time - duration)
+
+
+def get_dyn_transfo_params_form_1(params_column, params, time, duration=None):
+    ''' Return the dynamic transfo parameters. duration is the maximum patch duration
+        of params_column, if bounded.
     '''
     if isinstance(time, datetime.datetime):
         plpy.error('times as strings unsupported for dynamic transforms of form 1')
@@ -229,9 +339,10 @@ def get_dyn_transfo_params_form_1(params_column, params, time):
             select pc_interpolate({column}, 'time', {time:f}, true) point
             from {schema}.{table}
             where pc_patchmin({column}, 'time') <= {time:f} and
-                  pc_patchmax({column}, 'time') >  {time:f}
+                  pc_patchmax({column}, 'time') >  {time:f}{partition_filter}
         ) select %s from patch
-        ''' % select).format(schema=schema, table=table, column=column, time=time)
+        ''' % select).format(schema=schema, table=table, column=column, time=time,
+                             partition_filter=partition_filter(params_column, time, duration))
     plpy.debug(q)
     rv = plpy.execute(q)
     if len(rv) == 0:
@@ -241,43 +352,120 @@ def get_dyn_transfo_params_form_1(params_column, params, time):
         plpy.error('multiple rows returned from time interpolation')
     values = rv[0]
 
+    result = {}
     for key, param in params.items():
         if isinstance(param, list):
-            for i, dim in enumerate(param):
-                val = values[dim]
-                param[i] = val
+            result[key] = [values[dim] for dim in param]
         else:
-            dim = param
-            val = values[dim]
-            params[key] = val
+            result[key] = values[param]
+    return result
+
+
+def get_dyn_transfo_params_form_1_batch(params_column, params, times, duration=None):
+    ''' Return the dynamic transfo parameters for each time of the times list, resolved
+        with a single query. Items are None for times without parameters. duration is
+        the maximum patch duration of params_column, if bounded.
+    '''
+    schema, table, column = tuple(map(plpy.quote_ident, params_column.split('.')))
+    params = params[0]
 
-    return params
+    select = []
+    for param in params.values():
+        for dim in (param if isinstance(param, list) else [param]):
+            append_dim_select(dim, select)
+    select = ', '.join(select)
 
+    lower = ''
+    if duration is not None:
+        lower = " and pc_patchmin({}, 'time') >= t.time - {:f}".format(column, duration)
 
-def get_dyn_transfo_params_form_2(params, time):
-    ''' Return the dynamic transfo parameters.
+    q = ('''
+        select t.i, %s
+        from unnest($1::float8[]) with ordinality t(time, i)
+        join lateral (
+            select pc_interpolate({column}, 'time', t.time, true) point
+            from {schema}.{table}
+            where pc_patchmin({column}, 'time') <= t.time and
+                  pc_patchmax({column}, 'time') > t.time{lower}
+        ) patch on true
+        order by t.i
+        ''' % select).format(schema=schema, table=table, column=column, lower=lower)
+    plpy.debug(q)
+    rv = plpy.execute(plpy.prepare(q, ['float8[]']), [times])
+
+    result = [None] * len(times)
+    for values in rv:
+        i = values['i'] - 1
+        if result[i] is not None:
+            plpy.error('multiple rows returned from time interpolation')
+        item = {}
+        for key, param in params.items():
+            if isinstance(param, list):
+                item[key] = [values[dim] for dim in param]
+            else:
+                item[key] = values[param]
+        result[i] = item
+    missing = result.count(None)
+    if missing:
+        plpy.warning('no parameters for {} of the provided times'.format(missing))
+    return result
+
+
+def form_2_times(params, time):
+    ''' Return the sorted "_time" values of the params, parsed as datetimes if time is a
+        datetime.
     '''
     _times = (p['_time'] for p in params)
     if isinstance(time, datetime.datetime):
         _times = map(dateutil.parser.parse, _times)
-    _times = list(_times)
+    return list(_times)
+
+
+def form_2_index(_times, time):
+    ''' Return the index of the params to use for time, or None.
+    '''
     # find leftmost value greather than or equal to time
     i = bisect.bisect_left(_times, time)
     if i == len(_times) or (i == 0 and time < _times[0]):
+        return None
+    return i
+
+
+def get_dyn_transfo_params_form_2(params, time):
+    ''' Return the dynamic transfo parameters.
+    '''
+    i = form_2_index(form_2_times(params, time), time)
+    if i is None:
         plpy.warning('no parameters for the provided time ({})'.format(time.isoformat()))
         return None
     return params[i]
 
 
-def get_transform(transfoid, time):
-    ''' Return information about the transfo whose id is transfoid. A dict with keys "name",
-        "params", "func_name", and "func_sign".
+def get_dyn_transfo_params_form_2_batch(params, times):
+    ''' Return the dynamic transfo parameters for each time of the times list. Items
+        are None for times without parameters.
     '''
-    if not isinstance(time, (float, str)):
-        plpy.error('unexpected type for "time" parameter ({})'.format(type(time)))
-    if isinstance(time, str):
-        # if time is a string parse it to a datetime object
-        time = dateutil.parser.parse(time)
+    if not times:
+        return []
+    _times = form_2_times(params, times[0])
+    result = []
+    for time in times:
+        i = form_2_index(_times, time)
+        result.append(None if i is None else params[i])
+    missing = result.count(None)
+    if missing:
+        plpy.warning('no parameters for {} of the provided times'.format(missing))
+    return result
+
+
+def transfo_row(transfoid, snapshot=None):
+    ''' Return the transfo whose id is transfoid as a dict with keys "name",
+        "params_column", "params" (decoded), "func_name" and "func_sign", from snapshot,
+        the transfos of a platform config version, if it is provided and contains it.
+        Snapshot transfos are copied, as the snapshot is cached.
+    '''
+    if snapshot is not None and transfoid in snapshot:
+        return copy.deepcopy(snapshot[transfoid])
     q = '''
         select t.name as name,
                t.parameters_column as params_column, t.parameters as params,
@@ -290,15 +478,30 @@ def get_transform(transfoid, time):
     rv = plpy.execute(q)
     if len(rv) < 1:
         plpy.error('no transfo with id {:d}'.format(transfoid))
-    transfo = rv[0]
+    transfo = dict(rv[0])
+    transfo['params'] = json.loads(transfo['params'])
+    return transfo
+
+
+def get_transform(transfoid, time, snapshot=None):
+    ''' Return information about the transfo whose id is transfoid. A dict with keys "name",
+        "params", "func_name", and "func_sign".
+    '''
+    if not isinstance(time, (float, str)):
+        plpy.error('unexpected type for "time" parameter ({})'.format(type(time)))
+    if isinstance(time, str):
+        # if time is a string parse it to a datetime object
+        time = dateutil.parser.parse(time)
+    transfo = transfo_row(transfoid, snapshot)
     params_column = transfo['params_column']
-    params = json.loads(transfo['params'])
+    params = transfo['params']
     if params_column:
         # dynamic transform form 1
         if not time:
             plpy.error('no time value provided for dynamic transfo "{}"'
                        .format(transfo['name']))
-        params = get_dyn_transfo_params_form_1(params_column, params, time)
+        params = get_dyn_transfo_params_form_1(params_column, params, time,
+                                               transfo_patch_duration(transfo))
     elif params:
         if len(params) > 1:
             # dynamic tranform form 2
@@ -314,12 +517,33 @@ def get_transform(transfoid, time):
     return transfo['name'], params, transfo['func_name'], transfo['func_sign']
 
 
-def args_to_array_string(args):
-    ''' Return args wrapped into ARRAY[]'s.
+def get_transforms(transfoid, times, snapshot=None):
+    ''' Return information about the transfo whose id is transfoid for each time of the
+        times list: a tuple with the name, the list of params (None for the times without
+        parameters), the func_name and the func_sign. Parameters are resolved with at
+        most one query, whatever the number of times.
+    '''
+    transfo = transfo_row(transfoid, snapshot)
+    params_column = transfo['params_column']
+    params = transfo['params']
+    if params_column:
+        # dynamic transform form 1
+        params_list = get_dyn_transfo_params_form_1_batch(params_column, params, times,
+                                                          transfo_patch_duration(transfo))
+    elif params and len(params) > 1:
+        # dynamic tranform form 2
+        params_list = get_dyn_transfo_params_form_2_batch(params, times)
+    else:
+        # static transform
+        params_list = [params[0] if params else None] * len(times)
+    return transfo['name'], params_list, transfo['func_name'], transfo['func_sign']
+
+
+def args_to_array_string(args, idx=1):
+    ''' Return args wrapped into ARRAY[]'s, the first one being the parameter $idx.
     '''
     args_str = ''
     args_val = []
-    idx = 1
     for arg in args:
         args_str += ', '
         if isinstance(arg, list):
@@ -344,11 +568,12 @@ def _transform(obj, type_, func_name, func_sign, params):
     if isinstance(params, basestring):  # NOQA
         params = json.loads(params)
     args = [params[p] for p in func_sign if p != '_time']
-    args_str, args_val = args_to_array_string(args)
-    q = 'select {}(\'{}\'::{}{}) r'.format(func_name, obj, type_, args_str)
+    # the object is passed as the first parameter so that it is not copied into the query
+    args_str, args_val = args_to_array_string(args, 2)
+    q = 'select {}($1::{}{}) r'.format(func_name, type_, args_str)
     plpy.debug(q, args_val)
-    plan = plpy.prepare(q, ['numeric'] * len(args_val))
-    rv = plpy.execute(plan, args_val)
+    plan = plpy.prepare(q, [type_] + ['numeric'] * len(args_val))
+    rv = plpy.execute(plan, [obj] + args_val)
     if len(rv) != 1:
         plpy.error('unexpected number of rows ({}) returned from {}'.format(len(rv), q))
     result = rv[0].get('r')
@@ -357,17 +582,57 @@ def _transform(obj, type_, func_name, func_sign, params):
     return result
 
 
+def _transform_box4d_batch(boxes, func_name, func_sign, params_list):
+    ''' Transform each box4d of boxes, using func_name, func_sign and the params of the
+        same index in params_list, with a single query. The resulting boxes contain
+        the images of all the points of the boxes: the sample points of each box at
+        which the transformed coordinates reach their extrema are transformed, and
+        bounded. The time range is kept. Items are None where the box or the params
+        are None.
+    '''
+    samples = []
+    owners = []
+    sample_params = []
+    for i, (box4d, params) in enumerate(zip(boxes, params_list)):
+        if box4d is None or params is None:
+            continue
+        mins, maxs = parse_box4d(box4d)
+        try:
+            points = box_samples(func_name, mins, maxs)
+        except ValueError as e:
+            plpy.error('cannot transform {}: {}'.format(box4d, e))
+        samples.extend(make_box4d(point, point) for point in points)
+        owners.extend([i] * len(points))
+        sample_params.extend([params] * len(points))
+
+    transformed = defaultdict(list)
+    for i, box4d in zip(owners, _transform_batch(samples, 'LIBOX4D', func_name,
+                                                 func_sign, sample_params)):
+        transformed[i].append(parse_box4d(box4d)[0])
+
+    result = [None] * len(boxes)
+    for i, points in transformed.items():
+        mins, maxs = bounding_box(points)
+        times = parse_box4d(boxes[i])
+        if len(times[0]) > 3:
+            mins.append(times[0][3])
+            maxs.append(times[1][3])
+        result[i] = make_box4d(mins, maxs)
+    return result
+
+
 def _transform_box4d(box4d, func_name, func_sign, params):
-    ''' Transform the box4d, using func_name, func_sign and params.
+    ''' Transform the box4d, using func_name, func_sign and params. The resulting box
+        contains the images of all the points of the box.
     '''
-    return _transform(box4d, 'LIBOX4D', func_name, func_sign, params)
+    return _transform_box4d_batch([box4d], func_name, func_sign, [params])[0]
 
 
-def transform_box4d_one(box4d, transfoid, time):
+def transform_box4d_one(box4d, transfoid, time, snapshot=None):
     ''' Transform the box4d, using transfoid and time. time is ignored if the transform
         is static.
     '''
-    transfo = get_transform(transfoid, time)
+    transfo = get_transform(transfoid, time, snapshot)
     if not transfo:
         return None
     name, params, func_name, func_sign = transfo
@@ -375,10 +640,12 @@ def transform_box4d_one(box4d, transfoid, time):
     return _transform_box4d(box4d, func_name, func_sign, params)
 
 
-def transform_box4d_list(box4d, transfoids, time):
-    ''' Transform the box4d, using all the transforms in the transfoids list. '''
+def transform_box4d_list(box4d, transfoids, time, snapshot=None):
+    ''' Transform the box4d, using all the transforms in the transfoids list, taken from
+        snapshot, the transfos of a platform config version, if provided.
+    '''
     for transfoid in transfoids:
-        box4d = transform_box4d_one(box4d, transfoid, time)
+        box4d = transform_box4d_one(box4d, transfoid, time, snapshot)
         if not box4d:
             break
     return box4d
@@ -387,8 +654,8 @@ def transform_box4d_list(box4d, transfoids, time):
 def transform_box4d_config(box4d, config, source, target, time):
     ''' Apply the transform path from "source" to "target" for the provided "config".
     '''
-    transforms = dijkstra(config, source, target)
-    return transform_box4d_list(box4d, transforms, time)
+    transforms, snapshot, cached = config_path(config, source, target)
+    return transform_box4d_list(box4d, transforms, time, snapshot)
 
 
 def _transform_point(point, func_name, func_sign, params):
@@ -396,16 +663,16 @@ def _transform_point(point, func_name, func_sign, params):
     '''
     point_str = ' '.join(map(str, point))
     box4d = 'BOX4D({point_str},{point_str})'.format(point_str=point_str)
-    box4d_out = _transform_box4d(box4d, func_name, func_sign, params)
+    box4d_out = _transform(box4d, 'LIBOX4D', func_name, func_sign, params)
     point_out = list(map(float, box4d_out[6:-1].split(',')[0].split(' ')))
     return point_out
 
 
-def transform_point_one(point, transfoid, time):
+def transform_point_one(point, transfoid, time, snapshot=None):
     ''' Transform the point, using transfoid and time. time is ignored if the transform
         is static.
     '''
-    transfo = get_transform(transfoid, time)
+    transfo = get_transform(transfoid, time, snapshot)
     if not transfo:
         return None
     name, params, func_name, func_sign = transfo
@@ -413,10 +680,12 @@ def transform_point_one(point, transfoid, time):
     return _transform_point(point, func_name, func_sign, params)
 
 
-def transform_point_list(point, transfoids, time):
-    ''' Transform the point, using all the transforms in the transfoids list. '''
+def transform_point_list(point, transfoids, time, snapshot=None):
+    ''' Transform the point, using all the transforms in the transfoids list, taken from
+        snapshot, the transfos of a platform config version, if provided.
+    '''
     for transfoid in transfoids:
-        point = transform_point_one(point, transfoid, time)
+        point = transform_point_one(point, transfoid, time, snapshot)
         if not point:
             break
     return point
@@ -425,8 +694,8 @@ def transform_point_list(point, transfoids, time):
 def transform_point_config(point, config, source, target, time):
     ''' Apply the transform path from "source" to "target" for the provided "config".
     '''
-    transforms = dijkstra(config, source, target)
-    return transform_point_list(point, transforms, time)
+    transforms, snapshot, cached = config_path(config, source, target)
+    return transform_point_list(point, transforms, time, snapshot)
 
 
 def _transform_patch(patch, func_name, func_sign, params):
@@ -435,11 +704,74 @@ def _transform_patch(patch, func_name, func_sign, params):
     return _transform(patch, 'PCPATCH', func_name, func_sign, params)
 
 
-def transform_patch_one(patch, transfoid, time):
-    ''' Transform the patch, using transfoid and time. time is ignored if the transform
-        is static.
+def transform_chunk_size():
+    ''' Return the number of points above which patches are transformed by chunks, as
+        set by the "li3ds.transform_chunk_size" setting, or 0 if chunking is disabled.
+    '''
+    rv = plpy.execute(
+        "select current_setting('li3ds.transform_chunk_size', true) as chunk_size")
+    chunk_size = rv[0]['chunk_size']
+    return int(chunk_size) if chunk_size else 0
+
+
+def patch_num_points(patch):
+    ''' Return the number of points of the patch.
+    '''
+    plan = plpy.prepare('select pc_numpoints($1) as npoints', ['pcpatch'])
+    return plpy.execute(plan, [patch])[0]['npoints']
+
+
+def transform_patch_chunked(patch, transfoids, time, chunk_size, snapshot=None):
+    ''' Transform the patch, using all the transforms in the transfoids list, chunk_size
+        points at a time. Each chunk goes through the whole transform path before the
+        next one is extracted, so that intermediate results are bounded by the chunk
+        size. Transformed chunks are merged as they come, each with the merged patch of
+        as many chunks before it, if any, so that they are not all kept until the end
+        and each point is copied a logarithmic number of times.
     '''
-    transfo = get_transform(transfoid, time)
+    transfos = []
+    for transfoid in transfoids:
+        transfo = get_transform(transfoid, time, snapshot)
+        if not transfo:
+            return None
+        name, params, func_name, func_sign = transfo
+        plpy.log('apply transfo "{}" (function: "{}") to patch by chunks of {:d} points'
+                 .format(name, func_name, chunk_size))
+        transfos.append(transfo)
+
+    plan = plpy.prepare(
+        '''
+        select pc_range($1, start, $2) as patch
+        from generate_series(1, pc_numpoints($1), $2) start
+        order by start
+        ''', ['pcpatch', 'integer'])
+    union = plpy.prepare(
+        'select pc_union(p order by i) as patch '
+        'from unnest(array[$1, $2]) with ordinality u(p, i)',
+        ['pcpatch', 'pcpatch'])
+    # stack of (merged patch, number of chunks), with decreasing numbers of chunks
+    merged = []
+    for row in fetch_rows(plpy.cursor(plan, [patch, chunk_size]), 1):
+        chunk = row['patch']
+        for name, params, func_name, func_sign in transfos:
+            chunk = _transform_patch(chunk, func_name, func_sign, params)
+        count = 1
+        while merged and merged[-1][1] == count:
+            chunk = plpy.execute(union, [merged.pop()[0], chunk])[0]['patch']
+            count *= 2
+        merged.append((chunk, count))
+
+    patch = None
+    for chunk, count in reversed(merged):
+        patch = chunk if patch is None else \
+            plpy.execute(union, [chunk, patch])[0]['patch']
+    return patch
+
+
+def transform_patch_hop(patch, transfoid, time, snapshot=None):
+    ''' Transform the patch, using transfoid and time, in a single query.
+    '''
+    transfo = get_transform(transfoid, time, snapshot)
     if not transfo:
         return None
     name, params, func_name, func_sign = transfo
@@ -447,10 +779,25 @@ def transform_patch_one(patch, transfoid, time):
     return _transform_patch(patch, func_name, func_sign, params)
 
 
-def transform_patch_list(patch, transfoids, time):
-    ''' Transform the patch, using all the transforms in the transfoids list. '''
+def transform_patch_one(patch, transfoid, time):
+    ''' Transform the patch, using transfoid and time. time is ignored if the transform
+        is static.
+    '''
+    return transform_patch_list(patch, [transfoid], time)
+
+
+def transform_patch_list(patch, transfoids, time, snapshot=None, chunk_size=None):
+    ''' Transform the patch, using all the transforms in the transfoids list, taken from
+        snapshot, the transfos of a platform config version, if provided. chunk_size is
+        the value of transform_chunk_size(), read if not provided, so that callers
+        transforming many patches read it once.
+    '''
+    if chunk_size is None:
+        chunk_size = transform_chunk_size()
+    if chunk_size and transfoids and patch_num_points(patch) > chunk_size:
+        return transform_patch_chunked(patch, transfoids, time, chunk_size, snapshot)
     for transfoid in transfoids:
-        patch = transform_patch_one(patch, transfoid, time)
+        patch = transform_patch_hop(patch, transfoid, time, snapshot)
         if not patch:
             break
     return patch
@@ -459,5 +806,1392 @@ def transform_patch_list(patch, transfoids, time):
 def transform_patch_config(patch, config, source, target, time):
     ''' Apply the transform path from "source" to "target" for the provided "config".
     '''
-    transforms = dijkstra(config, source, target)
-    return transform_patch_list(patch, transforms, time)
+    transforms, snapshot, cached = config_path(config, source, target)
+    return transform_patch_list(patch, transforms, time, snapshot)
+
+
+def get_dimensions(pcid):
+    ''' Return the dimension names of the pointcloud schema pcid, ordered by position.
+    '''
+    rv = plpy.execute('select li3ds.pcid_dimensions({:d}) dims'.format(pcid))
+    if not rv or rv[0]['dims'] is None:
+        plpy.error('no pointcloud schema with pcid {:d}'.format(pcid))
+    return rv[0]['dims']
+
+
+def dimension_index(dims):
+    ''' Return a dict mapping the lowercased dimension names to their index.
+    '''
+    return dict((dim.lower(), i) for i, dim in enumerate(dims))
+
+
+def patch_points(patch):
+    ''' Return the pcid of the patch and the list of its points, each point being the
+        list of its dimension values.
+    '''
+    plan = plpy.prepare('select pc_pcid($1) pcid', ['pcpatch'])
+    pcid = plpy.execute(plan, [patch])[0]['pcid']
+    plan = plpy.prepare('select pc_get(point) point from pc_explode($1) point', ['pcpatch'])
+    rv = plpy.execute(plan, [patch])
+    return pcid, [r['point'] for r in rv]
+
+
+def make_patch(pcid, points):
+    ''' Return a patch of schema pcid made of points. Return None if points is empty.
+    '''
+    if not points:
+        return None
+    plan = plpy.prepare('select pc_makepatch($1, $2) patch', ['integer', 'float8[]'])
+    return plpy.execute(plan, [pcid, list(chain.from_iterable(points))])[0]['patch']
+
+
+def split_echoes(patch, pulse_pcid, echo_pcid, offset_dim, echo_dim):
+    ''' Split the multi-echo lidar patch into a pulse patch of schema pulse_pcid and an
+        echo patch of schema echo_pcid. The echoes of a pulse are expected to be
+        consecutive in the patch, the pulse starting at the point whose "echo_dim" is 1.
+        Dimensions are copied by name, except the "offset_dim" pulse dimension that is set
+        to the index of the first echo of the pulse in the echo patch (the partial sum
+        of the pulse echo counts).
+    '''
+    pcid, points = patch_points(patch)
+    index = dimension_index(get_dimensions(pcid))
+    pulse_dims = [dim.lower() for dim in get_dimensions(pulse_pcid)]
+    echo_dims = [dim.lower() for dim in get_dimensions(echo_pcid)]
+    offset_dim = offset_dim.lower()
+
+    for dim in [echo_dim.lower()] + echo_dims + pulse_dims:
+        if dim != offset_dim and dim not in index:
+            plpy.error('no dimension "{}" in schema {:d}'.format(dim, pcid))
+    if offset_dim not in pulse_dims:
+        plpy.error('no dimension "{}" in schema {:d}'.format(offset_dim, pulse_pcid))
+
+    echo_idx = index[echo_dim.lower()]
+    pulse_idx = [index.get(dim) for dim in pulse_dims]
+    echo_idx_list = [index[dim] for dim in echo_dims]
+
+    pulses = []
+    echoes = []
+    for point in points:
+        if not pulses or point[echo_idx] <= 1:
+            offset = len(echoes)
+            pulses.append([offset if dim == offset_dim else point[i]
+                           for dim, i in zip(pulse_dims, pulse_idx)])
+        echoes.append([point[i] for i in echo_idx_list])
+
+    return make_patch(pulse_pcid, pulses), make_patch(echo_pcid, echoes)
+
+
+def join_echoes(pulse, echo, pcid, offset_dim, num_echoes_dim):
+    ''' Rebuild a multi-echo lidar patch of schema pcid from a pulse patch and an echo
+        patch, as produced by split_echoes. Each echo gets the attributes of its pulse,
+        pulse dimensions taking precedence over echo dimensions of the same name.
+    '''
+    pulse_pcid, pulses = patch_points(pulse)
+    echo_pcid, echoes = patch_points(echo)
+    pulse_index = dimension_index(get_dimensions(pulse_pcid))
+    echo_index = dimension_index(get_dimensions(echo_pcid))
+
+    for dim in (offset_dim, num_echoes_dim):
+        if dim.lower() not in pulse_index:
+            plpy.error('no dimension "{}" in schema {:d}'.format(dim, pulse_pcid))
+    offset_idx = pulse_index[offset_dim.lower()]
+    num_echoes_idx = pulse_index[num_echoes_dim.lower()]
+
+    sources = []
+    for dim in get_dimensions(pcid):
+        dim = dim.lower()
+        if dim in pulse_index:
+            sources.append((True, pulse_index[dim]))
+        elif dim in echo_index:
+            sources.append((False, echo_index[dim]))
+        else:
+            plpy.error('no dimension "{}" in schemas {:d} and {:d}'
+                       .format(dim, pulse_pcid, echo_pcid))
+
+    points = []
+    for p in pulses:
+        start = int(p[offset_idx])
+        for e in echoes[start:start + int(p[num_echoes_idx])]:
+            points.append([p[i] if from_pulse else e[i] for from_pulse, i in sources])
+
+    return make_patch(pcid, points)
+
+
+def image_corners(width, height, near, far):
+    ''' Return the eight (u, v, depth) corners of the frustum of an image of size
+        width x height between the near and far depths.
+    '''
+    corners = [(0, 0), (width, 0), (width, height), (0, height)]
+    return [[u, v, depth] for depth in (near, far) for u, v in corners]
+
+
+def frustum_wkt(points):
+    ''' Return the WKT of the polyhedral surface whose eight corners are points, the
+        four near corners first and the four far corners next.
+    '''
+    faces = [
+        (0, 3, 2, 1), (4, 5, 6, 7),
+        (0, 1, 5, 4), (1, 2, 6, 5), (2, 3, 7, 6), (3, 0, 4, 7),
+    ]
+    rings = []
+    for face in faces:
+        ring = [points[i] for i in face + face[:1]]
+        rings.append('(({}))'.format(','.join(' '.join(map(repr, p)) for p in ring)))
+    return 'POLYHEDRALSURFACE Z ({})'.format(','.join(rings))
+
+
+def image_datasources():
+    ''' Return the image datasources having a size.
+    '''
+    return plpy.execute(
+        '''
+        select ds.id, ds.referential, extract(epoch from ds.capture_start) as time
+               , (ds.parameters->>'width')::float8 as width
+               , (ds.parameters->>'height')::float8 as height
+        from li3ds.datasource ds
+        where ds.type = 'image' and ds.parameters ?& array['width', 'height']
+        ''')
+
+
+def image_time(image, transfos, snapshot):
+    ''' Return the capture time of the image. Return 0.0 if the image has no capture
+        time but the transfos are all static, and None, with a warning, if one of them
+        is dynamic.
+    '''
+    if image['time'] is not None:
+        return image['time']
+    for transfoid in transfos:
+        transfo = transfo_row(transfoid, snapshot)
+        if transfo['params_column'] or len(transfo['params'] or []) > 1:
+            plpy.warning('no capture time for image datasource {:d}, skipped'
+                         .format(image['id']))
+            return None
+    return 0.0
+
+
+def update_image_frustums(config, referential, near, far):
+    ''' Compute the frustum of every image datasource in the referential for the
+        provided config, and store them in the image_frustum table. Image datasources
+        are expected to be in a pixel referential linked to the referential by a path
+        whose first transfo maps (u, v, depth) coordinates to camera coordinates, that
+        is a projective_pinhole_inverse transfo, and to have their size in the "width"
+        and "height" parameters. The pose is the one at the capture_start time, images
+        without capture time being skipped if the path is dynamic.
+    '''
+    srid = plpy.execute(
+        'select srid from li3ds.referential where id = {:d}'.format(referential))
+    if not srid:
+        plpy.error('no referential with id {:d}'.format(referential))
+    srid = srid[0]['srid'] or 0
+    plan = plpy.prepare(
+        '''
+        insert into li3ds.image_frustum
+            (datasource, config, referential, capture_time, near, far, geom)
+        values ($1, $2, $3, to_timestamp($4), $5, $6, st_geomfromtext($7, $8))
+        on conflict (datasource, config, referential) do update
+        set capture_time = excluded.capture_time, near = excluded.near, far = excluded.far,
+            geom = excluded.geom
+        ''', ['integer', 'integer', 'integer', 'float8', 'float8', 'float8', 'text',
+              'integer'])
+
+    count = 0
+    for image in image_datasources():
+        transfos, snapshot, cached = config_path(config, image['referential'], referential)
+        if not transfos:
+            continue
+        time = image_time(image, transfos, snapshot)
+        if time is None:
+            continue
+        points = []
+        for corner in image_corners(image['width'], image['height'], near, far):
+            point = transform_point_list(corner, transfos, time, snapshot)
+            if not point:
+                break
+            points.append(point[:3])
+        else:
+            plpy.execute(plan, [image['id'], config, referential, image['time'], near, far,
+                                frustum_wkt(points), srid])
+            count += 1
+    return count
+
+
+def candidate_images(config, referential, geom):
+    ''' Return the image datasources whose frustum bounding box intersects the
+        bounding box of geom, with the near and far depths of their frustum.
+    '''
+    plan = plpy.prepare(
+        '''
+        select ds.id, ds.referential, extract(epoch from ds.capture_start) as time
+               , (ds.parameters->>'width')::float8 as width
+               , (ds.parameters->>'height')::float8 as height
+               , f.near, f.far
+        from li3ds.image_frustum f
+        join li3ds.datasource ds on ds.id = f.datasource
+        where f.config = $1 and f.referential = $2 and f.geom &&& $3
+        order by ds.id
+        ''', ['integer', 'integer', 'geometry'])
+    return plpy.execute(plan, [config, referential, geom])
+
+
+def in_image(u, v, depth, image):
+    ''' Return True if the projected point (u, v, depth) is inside the image, in front
+        of the camera and between the near and far depths of its frustum, if known.
+        Points behind the camera project to mirrored pixels, which may be in the image.
+    '''
+    if depth <= 0:
+        return False
+    if image['near'] is not None and depth < image['near']:
+        return False
+    if image['far'] is not None and depth > image['far']:
+        return False
+    return 0 <= u < image['width'] and 0 <= v < image['height']
+
+
+def images_seeing(config, referential, geom):
+    ''' Return the ids of the image datasources which may see geom, which is expressed
+        in the referential. Candidates are the images whose frustum bounding box
+        intersects the bounding box of geom. When geom is a point, candidates are then
+        checked by projecting the point into the images, so that the result is exact;
+        for other geometries, the candidates are returned as is.
+    '''
+    plan = plpy.prepare(
+        '''
+        select st_geometrytype($1) = 'ST_Point' as ispoint,
+               array[st_x($1), st_y($1), coalesce(st_z($1), 0)] as point
+        ''', ['geometry'])
+    rv = plpy.execute(plan, [geom])[0]
+
+    images = []
+    for image in candidate_images(config, referential, geom):
+        if rv['ispoint']:
+            transfos, snapshot, cached = config_path(config, referential, image['referential'])
+            if transfos:
+                time = image_time(image, transfos, snapshot)
+                if time is None:
+                    continue
+                point = transform_point_list(rv['point'], transfos, time, snapshot)
+                if not point or not in_image(point[0], point[1], point[2], image):
+                    continue
+        images.append(image['id'])
+    return images
+
+
+def colorize(patch, config, referential):
+    ''' Project the points of the patch, which is expressed in the referential, into the
+        images seeing it. Only the images whose frustum intersects the patch bounds are
+        considered. Yield (image, point, u, v) tuples, point being the 1-based index of
+        the point in the patch.
+    '''
+    plan = plpy.prepare(
+        '''
+        select st_setsrid(st_3dmakebox(
+            st_makepoint(pc_patchmin($1, 'x'), pc_patchmin($1, 'y'), pc_patchmin($1, 'z')),
+            st_makepoint(pc_patchmax($1, 'x'), pc_patchmax($1, 'y'), pc_patchmax($1, 'z'))
+        )::geometry, coalesce(r.srid, 0)) as geom
+        from li3ds.referential r where r.id = $2
+        ''', ['pcpatch', 'integer'])
+    rv = plpy.execute(plan, [patch, referential])
+    if not rv:
+        plpy.error('no referential with id {:d}'.format(referential))
+    box = rv[0]['geom']
+
+    transform_chunk = transform_chunk_size()
+    for image in candidate_images(config, referential, box):
+        transfos, snapshot, cached = config_path(config, referential, image['referential'])
+        if not transfos:
+            continue
+        time = image_time(image, transfos, snapshot)
+        if time is None:
+            continue
+        projected = transform_patch_list(patch, transfos, time, snapshot, transform_chunk)
+        if not projected:
+            continue
+        pcid, points = patch_points(projected)
+        index = dimension_index(get_dimensions(pcid))
+        x, y, z = index['x'], index['y'], index['z']
+        for i, point in enumerate(points):
+            if in_image(point[x], point[y], point[z], image):
+                yield image['id'], i + 1, point[x], point[y]
+
+
+def transfo_kind(params_column, nparams):
+    ''' Return the kind of a transfo: "static", "form-1" or "form-2".
+    '''
+    if params_column:
+        return 'form-1'
+    if nparams and nparams > 1:
+        return 'form-2'
+    return 'static'
+
+
+def record_transform_stats(func_name, kind, object_, elapsed):
+    ''' Add a measured hop timing (in ms) to the transform_stats table.
+    '''
+    plan = plpy.prepare(
+        '''
+        insert into li3ds.transform_stats (func_name, kind, object, calls, total_ms)
+        values ($1, $2, $3, 1, $4)
+        on conflict (func_name, kind, object) do update
+        set calls = transform_stats.calls + 1,
+            total_ms = transform_stats.total_ms + excluded.total_ms
+        ''', ['varchar', 'varchar', 'varchar', 'float8'])
+    plpy.execute(plan, [func_name, kind, object_, elapsed])
+
+
+def explain_transform(config, source, target, time, patch, analyze):
+    ''' Return the hops of the transform path from "source" to "target" for the provided
+        "config", with their kind and estimated cost, as of the config version used by
+        the transform. If analyze is True, the transform is also run on the patch, or
+        on the origin point if patch is None, and the actual hop timings are returned
+        and recorded.
+    '''
+    transfos, snapshot, cached = config_path(config, source, target)
+    if not transfos:
+        return []
+    object_ = 'point' if patch is None else 'patch'
+
+    plan = plpy.prepare(
+        '''
+        select func_name, kind, calls, total_ms from li3ds.transform_stats
+        where object = $1
+        ''', ['varchar'])
+    stats = dict(((r['func_name'], r['kind']), r) for r in plpy.execute(plan, [object_]))
+
+    hops = []
+    for i, transfoid in enumerate(transfos):
+        transfo = transfo_row(transfoid, snapshot)
+        kind = transfo_kind(transfo['params_column'], len(transfo['params'] or []))
+        stat = stats.get((transfo['func_name'], kind))
+        hops.append({
+            'hop': i + 1,
+            'transfo': transfoid,
+            'name': transfo['name'],
+            'func_name': transfo['func_name'],
+            'kind': kind,
+            # whether the path of the config version was found in the backend cache,
+            # parameters being looked up for each transform anyway
+            'path_cached': cached,
+            'estimated_ms': stat['total_ms'] / stat['calls'] if stat else None,
+            'lookup_ms': None,
+            'actual_ms': None,
+        })
+
+    if analyze:
+        obj = patch if patch is not None else [0.0, 0.0, 0.0]
+        for hop in hops:
+            start = timer()
+            transfo = get_transform(hop['transfo'], time, snapshot)
+            lookup = timer()
+            if not transfo:
+                break
+            name, params, func_name, func_sign = transfo
+            if patch is None:
+                obj = _transform_point(obj, func_name, func_sign, params)
+            else:
+                obj = _transform_patch(obj, func_name, func_sign, params)
+            end = timer()
+            hop['lookup_ms'] = (lookup - start) * 1000
+            hop['actual_ms'] = (end - start) * 1000
+            record_transform_stats(func_name, hop['kind'], object_, hop['actual_ms'])
+
+    return hops
+
+
+def parse_box4d(box4d):
+    ''' Return the min and max corners of a box4d as lists of floats.
+    '''
+    corners = box4d[box4d.index('(') + 1:box4d.rindex(')')].split(',')
+    return [list(map(float, corner.split())) for corner in corners]
+
+
+def make_box4d(mins, maxs):
+    ''' Return the box4d string whose corners are mins and maxs.
+    '''
+    return 'BOX4D({},{})'.format(' '.join(map(repr, mins)), ' '.join(map(repr, maxs)))
+
+
+def column_uri(uri):
+    ''' Return the quoted schema, table and column of a "column:" uri.
+    '''
+    scheme, _, path_ = uri.partition(':')
+    if scheme != 'column':
+        plpy.error('{} is not a column uri'.format(uri))
+    return tuple(map(plpy.quote_ident, path_.split('.')))
+
+
+class LasWriter(object):
+    ''' Write points to a LAS 1.2 file, using point data format 1 if the points have
+        a "time" dimension, and format 0 otherwise. Coordinates are stored with a
+        millimeter scale relative to offset, or, if offset is None, to the minimum
+        coordinates of the first points written. The header is written on close.
+    '''
+    header_size = 227
+    scale = 0.001
+
+    def __init__(self, path, dims, offset):
+        self.f = open(path, 'wb')
+        self.f.write(b'\0' * self.header_size)
+        self.offset = offset
+        self.count = 0
+        self.returns = [0] * 5
+        self.mins = [float('inf')] * 3
+        self.maxs = [float('-inf')] * 3
+        index = dimension_index(dims)
+        for dim in ('x', 'y', 'z'):
+            if dim not in index:
+                plpy.error('no dimension "{}" to export to LAS'.format(dim))
+        self.xyz = [index[d] for d in ('x', 'y', 'z')]
+        self.intensity = index.get('intensity', index.get('reflectance'))
+        self.echo = index.get('echo')
+        self.num_echoes = index.get('num_echoes')
+        self.classification = index.get('classification')
+        self.time = index.get('time')
+        self.format = 0 if self.time is None else 1
+        self.record = struct.Struct('<3iHBBbBH' + ('' if self.time is None else 'd'))
+
+    def write(self, points):
+        if self.offset is None and points:
+            self.offset = [min(p[i] for p in points) for i in self.xyz]
+        chunk = []
+        for point in points:
+            xyz = [point[i] for i in self.xyz]
+            for k in range(3):
+                self.mins[k] = min(self.mins[k], xyz[k])
+                self.maxs[k] = max(self.maxs[k], xyz[k])
+            echo = 1 if self.echo is None else max(1, min(5, int(point[self.echo])))
+            num_echoes = 1 if self.num_echoes is None else \
+                max(1, min(5, int(point[self.num_echoes])))
+            self.returns[echo - 1] += 1
+            values = [
+                int(round((xyz[k] - self.offset[k]) / self.scale)) for k in range(3)]
+            values.append(0 if self.intensity is None else
+                          max(0, min(65535, int(point[self.intensity]))))
+            values.append(echo | num_echoes << 3)
+            values.append(0 if self.classification is None else
+                          int(point[self.classification]) & 0xff)
+            values.extend((0, 0, 0))
+            if self.time is not None:
+                values.append(point[self.time])
+            try:
+                chunk.append(self.record.pack(*values))
+            except struct.error:
+                plpy.error('point ({}) is too far from the LAS offset ({})'.format(
+                    ' '.join(map(repr, xyz)), ' '.join(map(repr, self.offset))))
+        self.f.write(b''.join(chunk))
+        self.count += len(points)
+
+    def close(self):
+        if not self.count:
+            self.mins = self.maxs = [0.0] * 3
+            self.offset = self.offset or [0.0] * 3
+        today = datetime.date.today()
+        header = struct.pack(
+            '<4sHH16sBB32s32sHHHIIBHI5I12d',
+            b'LASF', 0, 0, b'\0' * 16, 1, 2, b'li3ds', b'pg_li3ds ' + __version__.encode(),
+            today.timetuple().tm_yday, today.year, self.header_size, self.header_size, 0,
+            self.format, self.record.size, self.count, *(self.returns + [
+                self.scale, self.scale, self.scale] + list(self.offset) + [
+                self.maxs[0], self.mins[0], self.maxs[1], self.mins[1],
+                self.maxs[2], self.mins[2]]))
+        self.f.seek(0)
+        self.f.write(header)
+        self.f.close()
+        return self.count
+
+
+class PlyWriter(object):
+    ''' Write points to a binary little endian PLY file, with one double property per
+        dimension. The vertex count is written on close.
+    '''
+    count_width = 20
+
+    def __init__(self, path, dims, offset):
+        self.f = open(path, 'wb')
+        self.dims = dims
+        header = ['ply', 'format binary_little_endian 1.0',
+                  'element vertex ' + '0' * self.count_width]
+        header.extend('property double {}'.format(dim) for dim in dims)
+        header.append('end_header\n')
+        header = '\n'.join(header).encode()
+        self.count_offset = header.index(b'element vertex ') + len(b'element vertex ')
+        self.f.write(header)
+        self.count = 0
+
+    def write(self, points):
+        values = list(chain.from_iterable(points))
+        self.f.write(struct.pack('<{:d}d'.format(len(values)), *values))
+        self.count += len(points)
+
+    def close(self):
+        self.f.seek(self.count_offset)
+        self.f.write('{:0{}d}'.format(self.count, self.count_width).encode())
+        self.f.close()
+        return self.count
+
+
+writers = {
+    'las': LasWriter,
+    'ply': PlyWriter,
+}
+
+
+def export_datasource(datasource, config, target, path, format_, time, chunk_size=100):
+    ''' Write the patches of the "column:" datasource, transformed into the target
+        referential for the provided config, to a LAS or PLY file at path on the
+        server. Patches are streamed through the transform chain chunk_size at a time.
+        The LAS coordinate offset is taken from the datasource bounds, or from the first
+        patch if the datasource has no bounds. A datasource without patches gives a
+        file with x, y and z dimensions and no points. Return the number of points
+        written.
+    '''
+    if format_ not in writers:
+        plpy.error('unknown export format "{}"'.format(format_))
+    rv = plpy.execute(
+        'select uri, referential, bounds from li3ds.datasource where id = {:d}'
+        .format(datasource))
+    if not rv:
+        plpy.error('no datasource with id {:d}'.format(datasource))
+    ds = rv[0]
+    schema, table, column = column_uri(ds['uri'])
+
+    transfos, snapshot = [], None
+    if ds['referential'] != target:
+        transfos, snapshot, cached = config_path(config, ds['referential'], target)
+        if not transfos:
+            plpy.error('no path from ref:{} to ref:{} with config {}'
+                       .format(ds['referential'], target, config))
+
+    offset = None
+    if ds['bounds'] and None not in ds['bounds']:
+        box4d = transform_box4d_list(
+            make_box4d(ds['bounds'][:3], ds['bounds'][3:]), transfos, time, snapshot)
+        if box4d:
+            offset = parse_box4d(box4d)[0][:3]
+
+    transform_chunk = transform_chunk_size()
+    cursor = plpy.cursor(
+        'select {column} as patch from {schema}.{table} where {column} is not null'
+        .format(schema=schema, table=table, column=column))
+    writer = None
+    pcid = None
+    try:
+        while True:
+            rows = cursor.fetch(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                patch = transform_patch_list(row['patch'], transfos, time, snapshot,
+                                             transform_chunk)
+                if not patch:
+                    continue
+                patch_pcid, points = patch_points(patch)
+                if writer is None:
+                    pcid = patch_pcid
+                    writer = writers[format_](path, get_dimensions(pcid), offset)
+                elif patch_pcid != pcid:
+                    plpy.error('patches of schemas {:d} and {:d} cannot be exported '
+                               'to the same file'.format(pcid, patch_pcid))
+                writer.write(points)
+        if writer is None:
+            # no patches: write a valid file without points
+            writer = writers[format_](path, ['x', 'y', 'z'], offset)
+    finally:
+        count = writer.close() if writer else 0
+    return count
+
+
+def file_uri(uri):
+    ''' Return the path of a "file:" uri.
+    '''
+    scheme, _, path_ = uri.partition(':')
+    if scheme != 'file':
+        plpy.error('{} is not a file uri'.format(uri))
+    return path_
+
+
+class LasReader(object):
+    ''' Read the points of a LAS file of point data format 0 to 5 from a memory map, as
+        the x, y, z, intensity, echo, num_echoes, classification and, for the formats
+        with a GPS time, time dimensions. Coordinates are scaled and offset.
+    '''
+    record = '<3iHBBbBH'
+    time_formats = (1, 3, 4, 5)
+
+    def __init__(self, data):
+        if data[:4] != b'LASF':
+            plpy.error('not a LAS file')
+        self.data = data
+        self.point_offset, = struct.unpack_from('<I', data, 96)
+        point_format, self.record_size, self.count = struct.unpack_from('<BHI', data, 104)
+        self.scale = struct.unpack_from('<3d', data, 131)
+        self.offset = struct.unpack_from('<3d', data, 155)
+        if point_format > 5:
+            plpy.error('unsupported LAS point data format {:d}'.format(point_format))
+        self.dims = ['x', 'y', 'z', 'intensity', 'echo', 'num_echoes', 'classification']
+        record = self.record
+        if point_format in self.time_formats:
+            self.dims.append('time')
+            record += 'd'
+        self.struct = struct.Struct(record)
+        if self.record_size < self.struct.size:
+            plpy.error('invalid LAS point record length {:d}'.format(self.record_size))
+
+    def chunks(self, chunk_size):
+        ''' Yield the file offset and number of points of the chunks of chunk_size
+            points.
+        '''
+        for start in range(0, self.count, chunk_size):
+            yield (self.point_offset + start * self.record_size,
+                   min(chunk_size, self.count - start))
+
+    def points(self, offset, count):
+        ''' Return the count points at offset in the file, each point being the list of
+            its dimension values.
+        '''
+        points = []
+        sx, sy, sz = self.scale
+        ox, oy, oz = self.offset
+        for i in range(offset, offset + count * self.record_size, self.record_size):
+            r = self.struct.unpack_from(self.data, i)
+            point = [r[0] * sx + ox, r[1] * sy + oy, r[2] * sz + oz, r[3],
+                     r[4] & 0x7, r[4] >> 3 & 0x7, r[5]]
+            point.extend(r[9:])
+            points.append(point)
+        return points
+
+
+class PlyReader(object):
+    ''' Read the vertices of a binary PLY file from a memory map, as one dimension per
+        vertex property. The vertex element must come first and have no list property.
+    '''
+    types = {
+        'char': 'b', 'int8': 'b', 'uchar': 'B', 'uint8': 'B',
+        'short': 'h', 'int16': 'h', 'ushort': 'H', 'uint16': 'H',
+        'int': 'i', 'int32': 'i', 'uint': 'I', 'uint32': 'I',
+        'float': 'f', 'float32': 'f', 'double': 'd', 'float64': 'd',
+    }
+    byte_orders = {
+        'binary_little_endian': '<',
+        'binary_big_endian': '>',
+    }
+
+    def __init__(self, data):
+        end = data.find(b'end_header\n')
+        if data[:4] != b'ply\n' or end < 0:
+            plpy.error('not a PLY file')
+        self.data = data
+        self.point_offset = end + len(b'end_header\n')
+        self.dims = []
+        self.count = None
+        byte_order, record, element = None, '', None
+        for line in data[:end].decode('ascii').splitlines()[1:]:
+            words = line.split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            if words[0] == 'format':
+                if words[1] not in self.byte_orders:
+                    plpy.error('unsupported PLY format "{}"'.format(words[1]))
+                byte_order = self.byte_orders[words[1]]
+            elif words[0] == 'element':
+                element = words[1]
+                if self.count is None:
+                    if element != 'vertex':
+                        plpy.error('the first element of a PLY file must be "vertex"')
+                    self.count = int(words[2])
+            elif words[0] == 'property' and element == 'vertex':
+                if words[1] not in self.types:
+                    plpy.error('unsupported PLY vertex property "{}"'.format(line))
+                record += self.types[words[1]]
+                self.dims.append(words[2])
+        if byte_order is None or self.count is None:
+            plpy.error('no format or vertex element in PLY header')
+        self.struct = struct.Struct(byte_order + record)
+        self.record_size = self.struct.size
+
+    def chunks(self, chunk_size):
+        ''' Yield the file offset and number of points of the chunks of chunk_size
+            points.
+        '''
+        for start in range(0, self.count, chunk_size):
+            yield (self.point_offset + start * self.record_size,
+                   min(chunk_size, self.count - start))
+
+    def points(self, offset, count):
+        ''' Return the count points at offset in the file, each point being the list of
+            its dimension values.
+        '''
+        return [list(self.struct.unpack_from(self.data, i))
+                for i in range(offset, offset + count * self.record_size, self.record_size)]
+
+
+readers = {
+    'las': LasReader,
+    'ply': PlyReader,
+}
+
+# default number of points of the chunks of file datasources
+file_chunk_size = 10000
+
+
+def file_datasource(datasource):
+    ''' Return the path, format, pcid and chunk size of a "file:" datasource. The format
+        and chunk size are read from the "format" and "chunk_size" datasource parameters,
+        the format defaulting to the file extension.
+    '''
+    rv = plpy.execute('select uri, parameters from li3ds.datasource where id = {:d}'
+                      .format(datasource))
+    if not rv:
+        plpy.error('no datasource with id {:d}'.format(datasource))
+    path_ = file_uri(rv[0]['uri'])
+    parameters = json.loads(rv[0]['parameters'] or '{}')
+    format_ = parameters.get('format', os.path.splitext(path_)[1][1:].lower())
+    if format_ not in readers:
+        plpy.error('unknown file format "{}" for datasource {:d}'.format(format_, datasource))
+    if 'pcid' not in parameters:
+        plpy.error('no pcid in the parameters of datasource {:d}'.format(datasource))
+    return path_, format_, parameters['pcid'], parameters.get('chunk_size', file_chunk_size)
+
+
+def open_file(path_):
+    ''' Return a read-only memory map of the file at path and its stat result.
+    '''
+    try:
+        with open(path_, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), os.fstat(f.fileno())
+    except (EnvironmentError, ValueError) as e:
+        plpy.error('cannot map file {}: {}'.format(path_, e))
+
+
+def lock_file_index(datasource):
+    ''' Lock the file index of the datasource until the end of the transaction, so that
+        concurrent transactions do not index the same file.
+    '''
+    plpy.execute("select pg_advisory_xact_lock('li3ds.file_index'::regclass::integer, {:d})"
+                 .format(datasource))
+
+
+def file_index_stale(datasource, stat):
+    ''' Return whether the file of the datasource, whose stat result is stat, is not
+        indexed or was modified since it was indexed.
+    '''
+    rv = plpy.execute('''
+        select file_size, file_mtime from li3ds.file_index where datasource = {:d}
+        '''.format(datasource))
+    return not rv or (rv[0]['file_size'], rv[0]['file_mtime']) != (
+        stat.st_size, stat.st_mtime)
+
+
+def _index_file_datasource(datasource, reader, stat, chunk_size):
+    ''' Replace the rows of the datasource in the file_index and file_chunk_index tables
+        by the size and modification time of the file and the file offset, number of
+        points, time range and bounds of each chunk of chunk_size points read by reader.
+        Return the number of chunks.
+    '''
+    index = dimension_index(reader.dims)
+    for dim in ('x', 'y', 'z'):
+        if dim not in index:
+            plpy.error('no dimension "{}" in the file of datasource {:d}'
+                       .format(dim, datasource))
+    xyz = [index[d] for d in ('x', 'y', 'z')]
+    time = index.get('time')
+    plpy.execute('delete from li3ds.file_index where datasource = {:d}'.format(datasource))
+    plan = plpy.prepare('''
+        insert into li3ds.file_index (datasource, file_size, file_mtime)
+        values ($1, $2, $3)
+        ''', ['integer', 'bigint', 'float8'])
+    plpy.execute(plan, [datasource, stat.st_size, stat.st_mtime])
+    plan = plpy.prepare('''
+        insert into li3ds.file_chunk_index
+            (datasource, chunk, file_offset, num_points, tmin, tmax, bounds)
+        values ($1, $2, $3, $4, $5, $6, st_3dmakebox(st_makepoint($7, $8, $9),
+                st_makepoint($10, $11, $12))::geometry)
+        ''', ['integer', 'integer', 'bigint', 'integer', 'float8', 'float8'] +
+        ['float8'] * 6)
+    chunk = -1
+    for chunk, (offset, count) in enumerate(reader.chunks(chunk_size)):
+        points = reader.points(offset, count)
+        mins, maxs = bounding_box([[p[i] for i in xyz] for p in points])
+        tmin = tmax = None
+        if time is not None:
+            tmin = min(p[time] for p in points)
+            tmax = max(p[time] for p in points)
+        plpy.execute(plan, [datasource, chunk, offset, count, tmin, tmax] + mins + maxs)
+    return chunk + 1
+
+
+def index_file_datasource(datasource, chunk_size=None):
+    ''' Build the chunk index of the "file:" datasource, using chunks of chunk_size
+        points or of the datasource chunk size. Return the number of chunks.
+    '''
+    path_, format_, pcid, default_chunk_size = file_datasource(datasource)
+    lock_file_index(datasource)
+    data, stat = open_file(path_)
+    try:
+        return _index_file_datasource(datasource, readers[format_](data), stat,
+                                      chunk_size or default_chunk_size)
+    finally:
+        data.close()
+
+
+def read_file_datasource(datasource, time_min, time_max, geom):
+    ''' Yield the chunks of the "file:" datasource as patches of the datasource pcid,
+        reading only the chunks whose time range intersects [time_min, time_max] and
+        whose bounds intersect the bounding box of geom, when provided. The chunk index
+        is built if the file is not indexed or was modified since, by a single one of
+        concurrent readers.
+    '''
+    path_, format_, pcid, chunk_size = file_datasource(datasource)
+    data, stat = open_file(path_)
+    try:
+        reader = readers[format_](data)
+        if file_index_stale(datasource, stat):
+            rv = plpy.execute("select current_setting('transaction_read_only') as ro")
+            if rv[0]['ro'] == 'on':
+                plpy.error('the file of datasource {:d} is not indexed or was modified, '
+                           'run index_file_datasource in a read-write transaction'
+                           .format(datasource))
+            lock_file_index(datasource)
+            # another transaction may have indexed the file while waiting for the lock
+            if file_index_stale(datasource, stat):
+                _index_file_datasource(datasource, reader, stat, chunk_size)
+
+        index = dimension_index(reader.dims)
+        columns = []
+        for dim in get_dimensions(pcid):
+            if dim.lower() not in index:
+                plpy.error('no dimension "{}" in the file of datasource {:d}'
+                           .format(dim, datasource))
+            columns.append(index[dim.lower()])
+
+        plan = plpy.prepare('''
+            select file_offset, num_points from li3ds.file_chunk_index
+            where datasource = $1
+            and ($2 is null or tmax >= $2) and ($3 is null or tmin <= $3)
+            and ($4 is null or bounds &&& $4)
+            order by chunk
+            ''', ['integer', 'float8', 'float8', 'geometry'])
+        for chunk in plpy.execute(plan, [datasource, time_min, time_max, geom]):
+            points = reader.points(chunk['file_offset'], chunk['num_points'])
+            yield make_patch(pcid, [[p[i] for i in columns] for p in points])
+    finally:
+        data.close()
+
+
+def transform_datasource(source, config, target, time, processing=None, chunk_size=100):
+    ''' Replace the patches of the "column:" target datasource by the patches of the
+        "column:" source datasource transformed into the target referential for the
+        provided config, and record the lineage in the processing table. If processing
+        is provided, that processing row is updated instead of a new one being added.
+        Return the processing id.
+    '''
+    rv = plpy.execute(
+        'select id, uri, referential from li3ds.datasource where id in ({:d}, {:d})'
+        .format(source, target))
+    datasources = dict((r['id'], r) for r in rv)
+    for datasource in (source, target):
+        if datasource not in datasources:
+            plpy.error('no datasource with id {:d}'.format(datasource))
+    src, tgt = datasources[source], datasources[target]
+    src_schema, src_table, src_column = column_uri(src['uri'])
+    tgt_schema, tgt_table, tgt_column = column_uri(tgt['uri'])
+
+    transfos, snapshot = [], None
+    if src['referential'] != tgt['referential']:
+        transfos, snapshot, cached = config_path(config, src['referential'], tgt['referential'])
+        if not transfos:
+            plpy.error('no path from ref:{} to ref:{} with config {}'
+                       .format(src['referential'], tgt['referential'], config))
+
+    plpy.execute('delete from {}.{}'.format(tgt_schema, tgt_table))
+    insert = plpy.prepare(
+        'insert into {}.{} ({}) values ($1)'.format(tgt_schema, tgt_table, tgt_column),
+        ['pcpatch'])
+    transform_chunk = transform_chunk_size()
+    cursor = plpy.cursor(
+        'select {column} as patch from {schema}.{table} where {column} is not null'
+        .format(schema=src_schema, table=src_table, column=src_column))
+    while True:
+        rows = cursor.fetch(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            patch = transform_patch_list(row['patch'], transfos, time, snapshot,
+                                         transform_chunk)
+            if patch:
+                plpy.execute(insert, [patch])
+    plpy.execute('select li3ds.refresh_datasource_bounds({:d})'.format(target))
+
+    if processing is None:
+        plan = plpy.prepare(
+            '''
+            insert into li3ds.processing
+                (launched, tool, source, target, config, transfos, ttime, stale)
+            values (now(), 'transform_datasource', $1, $2, $3, $4, $5, false)
+            returning id
+            ''', ['integer', 'integer', 'integer', 'integer[]', 'float8'])
+        return plpy.execute(plan, [source, target, config, transfos, time])[0]['id']
+
+    plan = plpy.prepare(
+        '''
+        update li3ds.processing
+        set launched = now(), transfos = $2, stale = false
+        where id = $1
+        ''', ['integer', 'integer[]'])
+    plpy.execute(plan, [processing, transfos])
+    return processing
+
+
+def reprocess_stale():
+    ''' Redo the stale processings, upstream processings first. Only the processings
+        made by transform_datasource can be redone. Return the number of processings
+        redone.
+    '''
+    count = 0
+    while True:
+        rv = plpy.execute(
+            '''
+            select p.id, p.source, p.target, p.config, p.ttime
+            from li3ds.processing p
+            where p.stale and p.tool = 'transform_datasource' and p.config is not null
+            and not exists (
+                select 1 from li3ds.processing q where q.stale and q.target = p.source)
+            order by p.id
+            ''')
+        if not rv:
+            break
+        for row in rv:
+            transform_datasource(row['source'], row['config'], row['target'],
+                                 row['ttime'] or 0.0, processing=row['id'])
+            count += 1
+
+    rv = plpy.execute('select count(*) as cnt from li3ds.processing where stale')
+    if rv[0]['cnt']:
+        plpy.notice('{} stale processings cannot be redone'.format(rv[0]['cnt']))
+    return count
+
+
+def fetch_rows(cursor, chunk_size):
+    ''' Yield the rows of the plpy cursor, fetching them chunk_size at a time.
+    '''
+    while True:
+        rows = cursor.fetch(chunk_size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+def pose_indexes(pcid, cache):
+    ''' Return the indexes of the x, y and z dimensions of the schema pcid, and of its
+        qw, qx, qy and qz dimensions, or None if it has no quaternion. Results are kept
+        in the cache dict.
+    '''
+    if pcid not in cache:
+        index = dimension_index(get_dimensions(pcid))
+        for dim in ('x', 'y', 'z'):
+            if dim not in index:
+                plpy.error('no dimension "{}" in schema {:d}'.format(dim, pcid))
+        quat = None
+        if all(dim in index for dim in ('qw', 'qx', 'qy', 'qz')):
+            quat = [index[dim] for dim in ('qw', 'qx', 'qy', 'qz')]
+        cache[pcid] = [index[dim] for dim in ('x', 'y', 'z')], quat
+    return cache[pcid]
+
+
+def rotate(quat, v):
+    ''' Rotate the vector v by the (w, x, y, z) quaternion, which is normalized first.
+    '''
+    norm = math.sqrt(sum(c * c for c in quat))
+    w, x, y, z = [c / norm for c in quat]
+    return [
+        (1 - 2 * (y * y + z * z)) * v[0] + 2 * (x * y - w * z) * v[1] +
+        2 * (x * z + w * y) * v[2],
+        2 * (x * y + w * z) * v[0] + (1 - 2 * (x * x + z * z)) * v[1] +
+        2 * (y * z - w * x) * v[2],
+        2 * (x * z - w * y) * v[0] + 2 * (y * z + w * x) * v[1] +
+        (1 - 2 * (x * x + y * y)) * v[2]]
+
+
+def apply_poses(patch, poses, cache):
+    ''' Return the patch whose points are moved by the poses of the trajectory patch
+        poses, which has one pose per point of the patch: points are rotated by the pose
+        quaternion, if any, and translated by the pose position.
+    '''
+    pcid, points = patch_points(patch)
+    traj_pcid, samples = patch_points(poses)
+    if len(points) != len(samples):
+        plpy.error('{:d} poses for {:d} points'.format(len(samples), len(points)))
+    xyz = pose_indexes(pcid, cache)[0]
+    position, quat = pose_indexes(traj_pcid, cache)
+    for point, sample in zip(points, samples):
+        v = [point[i] for i in xyz]
+        if quat is not None:
+            v = rotate([sample[i] for i in quat], v)
+        for i, j, c in zip(xyz, position, v):
+            point[i] = c + sample[j]
+    return make_patch(pcid, points)
+
+
+def georeference(lidar_table, lidar_col, traj_table, traj_col, dim, lidar_key,
+                 chunk_size=100):
+    ''' Move the points of the lidar patches into the trajectory frame, using the
+        trajectory poses interpolated at their times. Lidar and trajectory patches are
+        matched by merge-joining them on their time ranges. Trajectory patches are
+        expected to be time-ordered and disjoint. Lidar patches straddling several
+        trajectory patches are interpolated on the union of these patches. Yield a
+        (lidar_key, patch) tuple per lidar patch, following the lidar patches time order,
+        patch being None if no trajectory patch matches the lidar patch.
+    '''
+    q = '''
+        select {key} as key, {col} as patch, pc_patchmin({col}, {dim}) as tmin,
+               pc_patchmax({col}, {dim}) as tmax
+        from {table} where {col} is not null
+        order by pc_patchmin({col}, {dim}), pc_patchmax({col}, {dim})
+        '''
+    dim_literal = plpy.quote_literal(dim)
+    lidars = fetch_rows(plpy.cursor(q.format(
+        key=plpy.quote_ident(lidar_key), table=lidar_table,
+        col=plpy.quote_ident(lidar_col), dim=dim_literal)), chunk_size)
+    trajs = fetch_rows(plpy.cursor(q.format(
+        key='null', table=traj_table, col=plpy.quote_ident(traj_col), dim=dim_literal)),
+        chunk_size)
+
+    interpolate_one = plpy.prepare(
+        'select pc_interpolate($1, $2, $3) as patch', ['pcpatch', 'pcpatch', 'text'])
+    interpolate_union = plpy.prepare(
+        'select pc_interpolate(pc_union(p order by i), $2, $3) as patch '
+        'from unnest($1) with ordinality u(p, i)',
+        ['pcpatch[]', 'pcpatch', 'text'])
+
+    window = deque()
+    pending = next(trajs, None)
+    unmatched = 0
+    cache = {}
+    for lidar in lidars:
+        # trajectory patches ending before this lidar patch cannot match the next ones
+        while window and window[0]['tmax'] < lidar['tmin']:
+            window.popleft()
+        while pending is not None and pending['tmin'] <= lidar['tmax']:
+            if pending['tmax'] >= lidar['tmin']:
+                window.append(pending)
+            pending = next(trajs, None)
+
+        matches = [t['patch'] for t in window if t['tmin'] <= lidar['tmax']]
+        if not matches:
+            unmatched += 1
+            yield lidar['key'], None
+            continue
+        if len(matches) == 1:
+            rv = plpy.execute(interpolate_one, [matches[0], lidar['patch'], dim])
+        else:
+            rv = plpy.execute(interpolate_union, [matches, lidar['patch'], dim])
+        yield lidar['key'], apply_poses(lidar['patch'], rv[0]['patch'], cache)
+
+    if unmatched:
+        plpy.warning('{} lidar patches without trajectory'.format(unmatched))
+
+
+def _transform_batch(objs, type_, func_name, func_sign, params_list):
+    ''' Transform each obj of objs, whose type is type_, using func_name, func_sign and
+        the params of the same index in params_list, with a single query. Items are None
+        where the obj or the params are None.
+    '''
+    if func_name not in func_names:
+        plpy.error('function {} is unknown'.format(func_name))
+    params_list = [json.loads(params) if isinstance(params, basestring) else params  # NOQA
+                   for params in params_list]
+    indices = [i for i, (obj, params) in enumerate(zip(objs, params_list))
+               if obj is not None and params is not None]
+    result = [None] * len(objs)
+    if not indices:
+        return result
+
+    sign = [p for p in func_sign if p != '_time']
+    shapes = []
+    for p in sign:
+        param = params_list[indices[0]][p]
+        shapes.append(len(param) if isinstance(param, list) else None)
+
+    # one array per scalar argument, holding its value for each obj
+    columns = [[] for _ in range(sum(shape or 1 for shape in shapes))]
+    for i in indices:
+        params = params_list[i]
+        values = []
+        for p, shape in zip(sign, shapes):
+            param = params[p]
+            if (len(param) if isinstance(param, list) else None) != shape:
+                plpy.error('inconsistent shape for parameter "{}"'.format(p))
+            values.extend(param if shape is not None else [param])
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    args_str = ''
+    k = 1
+    for shape in shapes:
+        if shape is None:
+            args_str += ', u.a{}'.format(k)
+            k += 1
+        else:
+            args_str += ', ARRAY[{}]'.format(
+                ','.join('u.a{}'.format(k + j) for j in range(shape)))
+            k += shape
+    q = '''
+        select {func}(u.obj::{type_}{args}) r
+        from unnest($1::text[]{arrays}) with ordinality u(obj{names}, i)
+        order by u.i
+        '''.format(func=func_names[func_name], type_=type_, args=args_str,
+                   arrays=''.join(', ${}::numeric[]'.format(j + 2) for j in range(len(columns))),
+                   names=''.join(', a{}'.format(j + 1) for j in range(len(columns))))
+    plpy.debug(q)
+    plan = plpy.prepare(q, ['text[]'] + ['numeric[]'] * len(columns))
+    rv = plpy.execute(plan, [[objs[i] for i in indices]] + columns)
+    for i, row in zip(indices, rv):
+        result[i] = row['r']
+    return result
+
+
+def transform_box4d_times(box4d, transfoids, times, snapshot=None):
+    ''' Transform the box4d for each time of the times list, using all the transforms in
+        the transfoids list. Return a list of box4d, None for the times without
+        parameters.
+    '''
+    boxes = [box4d] * len(times)
+    for transfoid in transfoids:
+        name, params_list, func_name, func_sign = get_transforms(transfoid, times, snapshot)
+        plpy.log('apply transfo "{}" (function: "{}") to {} box4d'
+                 .format(name, func_name, len(times)))
+        boxes = _transform_box4d_batch(boxes, func_name, func_sign, params_list)
+    return boxes
+
+
+def transform_box4d_times_config(box4d, config, source, target, times):
+    ''' Apply the transform path from "source" to "target" for the provided "config" to
+        the box4d, for each time of the times list.
+    '''
+    transforms, snapshot, cached = config_path(config, source, target)
+    return transform_box4d_times(box4d, transforms, times, snapshot)
+
+
+def transform_point_times(point, transfoids, times, snapshot=None):
+    ''' Transform the point for each time of the times list, using all the transforms
+        in the transfoids list.
+    '''
+    point_str = ' '.join(map(str, point))
+    box4d = 'BOX4D({point_str},{point_str})'.format(point_str=point_str)
+    boxes = [box4d] * len(times)
+    for transfoid in transfoids:
+        name, params_list, func_name, func_sign = get_transforms(transfoid, times, snapshot)
+        plpy.log('apply transfo "{}" (function: "{}") to {} points'
+                 .format(name, func_name, len(times)))
+        boxes = _transform_batch(boxes, 'LIBOX4D', func_name, func_sign, params_list)
+    return [None if box is None else parse_box4d(box)[0] for box in boxes]
+
+
+def transform_point_times_config(point, config, source, target, times):
+    ''' Apply the transform path from "source" to "target" for the provided "config" to
+        the point, for each time of the times list.
+    '''
+    transforms, snapshot, cached = config_path(config, source, target)
+    return transform_point_times(point, transforms, times, snapshot)
+
+
+def transfo_params(transfoid, times):
+    ''' Return the parameters of the transfo for each time of the times list, as json
+        strings, None for the times without parameters.
+    '''
+    params_list = get_transforms(transfoid, times)[1]
+    return [None if params is None else json.dumps(params) for params in params_list]
+
+
+def static_transfos(transfoids, snapshot=None):
+    ''' Return the (name, params, func_name, func_sign) tuples of the transfos of the
+        transfoids list, in order, taken from snapshot, the transfos of a platform config
+        version, if provided, or None if one of them is dynamic.
+    '''
+    transfos = []
+    for transfoid in transfoids:
+        transfo = transfo_row(transfoid, snapshot)
+        params = transfo['params']
+        if transfo['params_column'] or not params or len(params) > 1:
+            return None
+        transfos.append(
+            (transfo['name'], params[0], transfo['func_name'], transfo['func_sign']))
+    return transfos
+
+
+def inverse_transfos(transfoids, snapshot=None):
+    ''' Return the (name, params, func_name, func_sign) tuples which transform back
+        what the transfoids list transforms, taken from snapshot if provided, or None if
+        one of the transfos is dynamic or has no inverse function.
+    '''
+    transfos = static_transfos(transfoids, snapshot)
+    if transfos is None:
+        return None
+    inverse = []
+    for name, params, func_name, func_sign in reversed(transfos):
+        if func_name not in inverse_func_names:
+            return None
+        inverse.append((name, params, inverse_func_names[func_name], func_sign))
+    return inverse
+
+
+def transformed_view_bounds(relation, geom):
+    ''' Return the 3D box, in the referential of the datasource of the transformed view
+        relation, which contains the bounding box of geom, expressed in the referential
+        of the view. Return None if the transform path of the view cannot be inverted.
+    '''
+    plan = plpy.prepare(
+        '''
+        select v.config, v.referential as target, d.referential as source
+        from li3ds.transformed_view v
+        join li3ds.datasource d on d.id = v.datasource
+        where v.relation = $1::regclass
+        ''', ['text'])
+    rv = plpy.execute(plan, [relation])
+    if not rv:
+        plpy.error('{} is not a transformed view'.format(relation))
+    view = rv[0]
+    transfos, snapshot, cached = config_path(view['config'], view['source'], view['target'])
+    inverse = inverse_transfos(transfos, snapshot)
+    if inverse is None:
+        return None
+
+    plan = plpy.prepare(
+        '''
+        select array[st_xmin(b), st_ymin(b), st_zmin(b)] as mins,
+               array[st_xmax(b), st_ymax(b), st_zmax(b)] as maxs
+        from box3d($1) b
+        ''', ['geometry'])
+    rv = plpy.execute(plan, [geom])[0]
+    box4d = make_box4d(rv['mins'], rv['maxs'])
+    for name, params, func_name, func_sign in inverse:
+        box4d = _transform_box4d(box4d, func_name, func_sign, params)
+    mins, maxs = parse_box4d(box4d)
+
+    plan = plpy.prepare(
+        '''
+        select st_3dmakebox(st_makepoint($1, $2, $3), st_makepoint($4, $5, $6))::geometry
+            as geom
+        ''', ['float8'] * 6)
+    return plpy.execute(plan, mins[:3] + maxs[:3])[0]['geom']
+
+
+def numeric_literal(arg):
+    ''' Return the SQL literal of a transfo argument, typed as the arguments bound by
+        _transform are.
+    '''
+    if isinstance(arg, list):
+        return 'ARRAY[{}]::numeric[]'.format(', '.join(repr(float(a)) for a in arg))
+    return '{}::numeric'.format(repr(float(arg)))
+
+
+def compiled_expression(arg, transfos):
+    ''' Return the SQL expression applying the static transfos to arg, the transfo
+        parameters being inlined as constants.
+    '''
+    expr = arg
+    for name, params, func_name, func_sign in transfos:
+        if func_name not in func_names:
+            plpy.error('function {} is unknown'.format(func_name))
+        args = [params[p] for p in func_sign if p != '_time']
+        expr = '{}({}{})'.format(
+            func_names[func_name], expr, ''.join(', ' + numeric_literal(a) for a in args))
+    return expr
+
+
+def transform_box4d_static(box4d, transfos):
+    ''' Transform the box4d using transfos, the json list of the func_name, func_sign
+        and params of static transfos inlined in a compiled transform. The box4d is
+        bounded as transform_box4d_list does, so that the result is conservative.
+    '''
+    for func_name, func_sign, params in json.loads(transfos):
+        box4d = _transform_box4d(box4d, func_name, func_sign, params)
+    return box4d
+
+
+def _compile_transform(config, source, target):
+    ''' Generate the li3ds.transform_<config>_<source>_<target> SQL functions applying
+        the transform path from "source" to "target" for the provided "config" to
+        patches and box4ds, and record them in the compiled_transform table. The patch
+        function is plain SQL, the box4d one bounds the transformed box samples with
+        the transfo parameters inlined. Return the name of the functions, or None,
+        after dropping the functions previously generated, if the path does not exist
+        or is not static.
+    '''
+    # the latest version of the config, whatever the version pinned in the session
+    rv = plpy.execute(
+        '''
+        select max(version) as version from li3ds.platform_config_version
+        where config = {:d}
+        '''.format(config))
+    version = rv[0]['version']
+    if version is None:
+        transfoids, transfos = [], None
+    else:
+        transfoids, snapshot, cached = config_path(config, source, target, version)
+        transfos = (static_transfos(transfoids, snapshot)
+                    if transfoids or source == target else None)
+
+    plan = plpy.prepare(
+        '''
+        delete from li3ds.compiled_transform
+        where config = $1 and source = $2 and target = $3
+        ''', ['integer'] * 3)
+    plpy.execute(plan, [config, source, target])
+    if transfos is None:
+        return None
+
+    name = 'transform_{:d}_{:d}_{:d}'.format(config, source, target)
+    plpy.execute(
+        '''
+        create or replace function li3ds.{name}(obj pcpatch)
+        returns pcpatch as $$
+            select {expr}
+        $$ language sql immutable parallel safe
+        '''.format(name=name, expr=compiled_expression('$1', transfos)))
+    inlined = json.dumps([[func_name, func_sign, params]
+                          for name_, params, func_name, func_sign in transfos])
+    plpy.execute(
+        '''
+        create or replace function li3ds.{name}(obj libox4d)
+        returns libox4d as $CODE$
+            import pg_li3ds
+            return pg_li3ds.transform_box4d_static(obj, {inlined!r})
+        $CODE$ language plpython2u immutable parallel safe
+        '''.format(name=name, inlined=inlined))
+
+    plan = plpy.prepare(
+        '''
+        insert into li3ds.compiled_transform (config, source, target, transfos, function_name)
+        values ($1, $2, $3, $4, $5)
+        ''', ['integer', 'integer', 'integer', 'integer[]', 'name'])
+    plpy.execute(plan, [config, source, target, transfoids, name])
+    return 'li3ds.' + name
+
+
+def compile_transform(config, source, target):
+    ''' Generate the SQL functions applying the static transform path from "source" to
+        "target" for the provided "config", and return their name.
+    '''
+    name = _compile_transform(config, source, target)
+    if name is None:
+        plpy.error('no static path from referential {} to referential {} with config {}'
+                   .format(source, target, config))
+    return name
+
+
+def recompile_transforms(configs):
+    ''' Regenerate the compiled transforms of the configs, dropping the ones whose path
+        no longer exists or is no longer static. Return the number of transforms
+        regenerated.
+    '''
+    plan = plpy.prepare(
+        '''
+        select config, source, target from li3ds.compiled_transform
+        where config = any($1)
+        ''', ['integer[]'])
+    count = 0
+    for row in plpy.execute(plan, [configs]):
+        if _compile_transform(row['config'], row['source'], row['target']):
+            count += 1
+    return count
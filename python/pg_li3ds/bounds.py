@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+'''
+Sample points for conservative box transforms.
+
+The box containing the images of all the points of a box by a transform function is
+the box containing the images of a finite set of sample points, at which every
+coordinate of the transformed point reaches its extrema over the box:
+
+- affine functions are linear, projective_pinhole is monotonic in each coordinate
+  where z > 0, and projective_pinhole_inverse is bilinear: the corners of the box
+  are enough.
+- spherical_to_cartesian coordinates are products of the range and of sines or
+  cosines of the two angles: the extrema of each factor are reached at the bounds of
+  the box or at the angles multiple of pi/2 between them.
+
+This module does not depend on plpy so that it can be tested on its own.
+'''
+import itertools
+import math
+
+
+# index of the coordinates which are angles, (range, theta, phi) being the spherical
+# coordinates
+angle_axes = {
+    'spherical_to_cartesian': (1, 2),
+}
+
+# index of the coordinate which has to be positive over the box
+positive_axes = {
+    'projective_pinhole': 2,
+}
+
+
+def critical_angles(lo, hi):
+    ''' Return the multiples of pi/2 within [lo, hi], over one period at most.
+    '''
+    step = math.pi / 2
+    hi = min(hi, lo + 4 * step)
+    k = int(math.ceil(lo / step))
+    angles = []
+    while k * step <= hi:
+        angles.append(k * step)
+        k += 1
+    return angles
+
+
+def box_samples(func_name, mins, maxs):
+    ''' Return the sample points of the box [mins, maxs] (x, y and z coordinates) whose
+        images by func_name bound the image of the box. Raise a ValueError if the box
+        is not within the domain where the samples are valid.
+    '''
+    axes = [sorted(set([lo, hi])) for lo, hi in zip(mins[:3], maxs[:3])]
+    if func_name in positive_axes:
+        i = positive_axes[func_name]
+        if mins[i] <= 0:
+            raise ValueError('coordinate {} of the box must be positive for {}'
+                             .format(i, func_name))
+    for i in angle_axes.get(func_name, ()):
+        axes[i] = sorted(set(axes[i] + critical_angles(mins[i], maxs[i])))
+    return [list(point) for point in itertools.product(*axes)]
+
+
+def bounding_box(points):
+    ''' Return the min and max corners of the box containing points.
+    '''
+    return ([min(p[i] for p in points) for i in range(3)],
+            [max(p[i] for p in points) for i in range(3)])
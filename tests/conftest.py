@@ -11,7 +11,8 @@ from tabulate import tabulate
 from pyembedpg import PyEmbedPg, PyEmbedPgException
 
 
-POSTGRES_VERSION = '9.6.3'
+# PostgreSQL 10 or later is needed by the partitioned patch table tests
+POSTGRES_VERSION = os.environ.get('LI3DS_POSTGRES_VERSION', '9.6.3')
 POSTGIS_VERSION = 'ff0a844e606622f45841fc25221bbaa136ed1001'  # 2017/05/31
 POSTGIS_URL = (
     'https://github.com/postgis/postgis/archive/{}.tar.gz'
@@ -32,7 +33,16 @@ def postgres(request):
         pg.shutdown()
     request.addfinalizer(endup)
 
-    pg = PyEmbedPg(POSTGRES_VERSION, config_options='--with-python').start(15432)
+    pg = start_postgres()
+    return pg
+
+
+def start_postgres(port=15432):
+    '''
+    Start a local PostgreSQL server with a testdb database where the li3ds extension
+    and its dependencies are loaded
+    '''
+    pg = PyEmbedPg(POSTGRES_VERSION, config_options='--with-python').start(port)
     pg.create_database('testdb')
 
     bin_dir = os.path.dirname(pg._postgres_cmd)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+'''
+Helpers shared by the tests and the load test.
+'''
+
+
+def pc_schema(*dims):
+    '''
+    Return a pointcloud schema made of double dimensions
+    '''
+    dimension = '''
+        <pc:dimension>
+          <pc:position>{}</pc:position>
+          <pc:size>8</pc:size>
+          <pc:name>{}</pc:name>
+          <pc:interpretation>double</pc:interpretation>
+          <pc:scale>1</pc:scale>
+        </pc:dimension>'''
+    return '''<?xml version="1.0" encoding="UTF-8"?>
+        <pc:PointCloudSchema xmlns:pc="http://pointcloud.org/schemas/PC/1.1"
+            xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">{}
+          <pc:metadata>
+            <Metadata name="compression">none</Metadata>
+          </pc:metadata>
+        </pc:PointCloudSchema>'''.format(
+            ''.join(dimension.format(i + 1, dim) for i, dim in enumerate(dims)))
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+'''
+Concurrent load test of the transform functions.
+
+Run it against a local PostgreSQL server started as for the tests::
+
+    python loadtest.py --clients 1,4,16,64 --duration 30
+
+or against an existing scratch database where the li3ds extension is loaded::
+
+    python loadtest.py --dsn "dbname=scratch"
+
+Synthetic platforms are created in a "loadtest" schema. Each platform has a lidar
+referential linked to its body by a static transfo, a camera referential linked to
+its body by a dynamic transfo with a list of timed parameters (form 2), and its body
+linked to the world by a dynamic transfo interpolated in a trajectory patch table
+(form 1). Clients then run a mix of point (camera to world), box4d and patch (lidar
+to world) transforms by config, at random times, for a fixed duration and for each
+number of clients. Throughput, latency percentiles and the memory of the backends
+are reported. Backend memory is read from /proc/<pid>/status, so that it is only
+reported for a server running on the same host.
+'''
+from __future__ import division, print_function
+
+import argparse
+import json
+import math
+import random
+import threading
+from timeit import default_timer as timer
+
+import psycopg2
+from tabulate import tabulate
+
+from conftest import start_postgres
+from helpers import pc_schema
+
+
+PATCH_DURATION = 60  # seconds of trajectory per trajectory patch
+
+# li3ds tables where rows are created, in the order they are removed by the cleanup
+created_tables = ('platform_config', 'transfo_tree', 'transfo', 'referential', 'platform')
+
+
+def cleanup(cursor):
+    ''' Remove the data of a previous run: the pcids and li3ds rows it recorded in the
+        loadtest schema, and the schema itself.
+    '''
+    pcids = []
+    created = {}
+    cursor.execute("select to_regclass('loadtest.formats')")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute('select pcid from loadtest.formats')
+        pcids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("select to_regclass('loadtest.created')")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute('select li3ds_table, array_agg(id) from loadtest.created '
+                       'group by li3ds_table')
+        created = dict(cursor.fetchall())
+    cursor.execute('drop schema if exists loadtest cascade')
+    cursor.execute('delete from pointcloud_formats where pcid = any(%s)', (pcids,))
+    for table in created_tables:
+        cursor.execute('delete from li3ds.{} where id = any(%s)'.format(table),
+                       (created.get(table, []),))
+
+
+def insert(cursor, q, args):
+    cursor.execute(q + ' returning id', args)
+    return cursor.fetchone()[0]
+
+
+def create(cursor, table, columns, args):
+    ''' Insert a row in the li3ds table, and record its id to be removed by the cleanup
+        of the next run. Return the id.
+    '''
+    id_ = insert(cursor, 'insert into li3ds.{} ({}) values ({})'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns))), args)
+    cursor.execute('insert into loadtest.created values (%s, %s)', (table, id_))
+    return id_
+
+
+def trajectory_patch(start):
+    ''' Return the samples of a trajectory patch starting at start: a straight line
+        along x at 1 m/s, slowly turning around z, sampled every second.
+    '''
+    values = []
+    for t in range(int(start), int(start) + PATCH_DURATION + 1):
+        angle = t * 1e-3
+        values.extend([t, t, 0, 0, math.cos(angle / 2), 0, 0, math.sin(angle / 2)])
+    return values
+
+
+def setup(conn, n_platforms, n_patches, n_points, duration, rng):
+    ''' Create the synthetic platforms, and return, for each of them, a dict with its
+        config, its referentials and the ids and start times of its lidar patches.
+    '''
+    platforms = []
+    with conn.cursor() as cursor:
+        cleanup(cursor)
+        cursor.execute('create schema loadtest')
+        cursor.execute('select coalesce(max(pcid), 0) + 1 from pointcloud_formats')
+        traj_pcid = cursor.fetchone()[0]
+        lidar_pcid = traj_pcid + 1
+        cursor.execute(
+            'insert into pointcloud_formats (pcid, srid, schema) values (%s, 0, %s), (%s, 0, %s)',
+            (traj_pcid, pc_schema('time', 'x', 'y', 'z', 'qw', 'qx', 'qy', 'qz'),
+             lidar_pcid, pc_schema('time', 'x', 'y', 'z')))
+        # pcids are recorded to be removed by the cleanup of the next run
+        cursor.execute('create table loadtest.formats (pcid integer)')
+        cursor.execute('insert into loadtest.formats values (%s), (%s)',
+                       (traj_pcid, lidar_pcid))
+        # as are the ids of the li3ds rows
+        cursor.execute('create table loadtest.created (li3ds_table text, id integer)')
+        # an existing affine_quat type is shared with the other users of the database
+        cursor.execute('''
+            insert into li3ds.transfo_type (name, func_signature)
+            values ('affine_quat', ARRAY['quat', 'vec3', '_time'])
+            on conflict (name) do nothing
+            ''')
+        cursor.execute(
+            "select id, func_signature from li3ds.transfo_type where name = 'affine_quat'")
+        transfo_type, func_signature = cursor.fetchone()
+        if [p for p in func_signature if p != '_time'] != ['quat', 'vec3']:
+            raise RuntimeError('unexpected signature {} of the existing affine_quat '
+                               'transfo type'.format(func_signature))
+
+        for i in range(n_platforms):
+            name = 'loadtest{}'.format(i)
+            platform = create(cursor, 'platform', ['name'], (name,))
+            refs = dict(
+                (ref, create(cursor, 'referential', ['name'], ('{}_{}'.format(name, ref),)))
+                for ref in ('world', 'body', 'lidar', 'camera'))
+
+            traj_table = 'loadtest.traj{}'.format(i)
+            cursor.execute('create table {} (id serial, points pcpatch)'.format(traj_table))
+            for start in range(0, int(duration), PATCH_DURATION):
+                cursor.execute(
+                    'insert into {} (points) values (pc_makepatch(%s, %s::float8[]))'
+                    .format(traj_table), (traj_pcid, trajectory_patch(start)))
+            cursor.execute('create index on {} (pc_patchmin(points, \'time\'))'.format(traj_table))
+
+            transfo = ['name', 'source', 'target', 'transfo_type', 'parameters']
+            body_world = create(
+                cursor, 'transfo', transfo + ['parameters_column'],
+                (name + '_body_world', refs['body'], refs['world'], transfo_type,
+                 json.dumps([{'quat': ['qw', 'qx', 'qy', 'qz'], 'vec3': ['x', 'y', 'z']}]),
+                 traj_table + '.points'))
+            lidar_body = create(
+                cursor, 'transfo', transfo,
+                (name + '_lidar_body', refs['lidar'], refs['body'], transfo_type,
+                 json.dumps([{'quat': [1, 0, 0, 0], 'vec3': [0, 0, 1.5]}])))
+            camera_body = create(
+                cursor, 'transfo', transfo,
+                (name + '_camera_body', refs['camera'], refs['body'], transfo_type,
+                 json.dumps([{'quat': [1, 0, 0, 0], 'vec3': [0.1 * k, 0, 2], '_time': t}
+                             for k, t in enumerate(range(0, int(duration) + 1, 600))])))
+            sensors = create(
+                cursor, 'transfo_tree', ['name', 'transfos'],
+                (name + '_sensors', [lidar_body, camera_body]))
+            trajectory = create(
+                cursor, 'transfo_tree', ['name', 'transfos'],
+                (name + '_trajectory', [body_world]))
+            config = create(
+                cursor, 'platform_config', ['name', 'platform', 'transfo_trees'],
+                (name, platform, [sensors, trajectory]))
+
+            lidar_table = 'loadtest.lidar{}'.format(i)
+            cursor.execute('create table {} (id serial primary key, points pcpatch)'
+                           .format(lidar_table))
+            patches = []
+            for _ in range(n_patches):
+                start = rng.uniform(0, duration - 1)
+                values = []
+                for k in range(n_points):
+                    values.extend([start + k / n_points, rng.uniform(-10, 10),
+                                   rng.uniform(-10, 10), rng.uniform(0, 5)])
+                patches.append((insert(
+                    cursor, 'insert into {} (points) values (pc_makepatch(%s, %s::float8[]))'
+                    .format(lidar_table), (lidar_pcid, values)), start))
+
+            platforms.append({'config': config, 'refs': refs, 'lidar_table': lidar_table,
+                              'patches': patches, 'duration': duration})
+    conn.commit()
+    return platforms
+
+
+def point_query(platform, rng):
+    refs = platform['refs']
+    return 'select li3ds.transform(%s::float8[3], %s, %s, %s, %s)', (
+        [rng.uniform(-10, 10), rng.uniform(-10, 10), rng.uniform(1, 50)],
+        platform['config'], refs['camera'], refs['world'],
+        rng.uniform(0, platform['duration'] - 1))
+
+
+def box4d_query(platform, rng):
+    refs = platform['refs']
+    x, y = rng.uniform(-10, 10), rng.uniform(-10, 10)
+    return 'select li3ds.transform(%s::libox4d, %s, %s, %s, %s)', (
+        'BOX4D({} {} 0,{} {} 5)'.format(x, y, x + 1, y + 1),
+        platform['config'], refs['lidar'], refs['world'],
+        rng.uniform(0, platform['duration'] - 1))
+
+
+def patch_query(platform, rng):
+    refs = platform['refs']
+    patch, start = rng.choice(platform['patches'])
+    return ('select pc_numpoints(li3ds.transform(points, %s, %s, %s, %s)) '
+            'from {} where id = %s'.format(platform['lidar_table'])), (
+        platform['config'], refs['lidar'], refs['world'], start, patch)
+
+
+workloads = {
+    'point': point_query,
+    'box4d': box4d_query,
+    'patch': patch_query,
+}
+
+
+def backend_memory(pid):
+    ''' Return the resident and peak resident memory of a backend in MB, or None's if
+        the backend is not running on this host.
+    '''
+    memory = {}
+    try:
+        with open('/proc/{:d}/status'.format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    memory[key] = int(value.split()[0]) / 1024
+    except IOError:
+        pass
+    return memory.get('VmRSS'), memory.get('VmHWM')
+
+
+class Client(threading.Thread):
+    ''' Client running the workloads on its own connection, from the start event until
+        the deadline.
+    '''
+
+    def __init__(self, dsn, platforms, mix, start, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.dsn = dsn
+        self.platforms = platforms
+        self.mix = mix
+        self.start_event = start
+        self.ready = threading.Event()
+        self.deadline = None
+        self.rng = random.Random(seed)
+        self.latencies = dict((kind, []) for kind in mix)
+        self.errors = dict((kind, 0) for kind in mix)
+        self.memory = (None, None)
+
+    def choose(self):
+        total = sum(self.mix.values())
+        x = self.rng.uniform(0, total)
+        for kind, weight in sorted(self.mix.items()):
+            x -= weight
+            if x <= 0:
+                return kind
+        return kind
+
+    def execute(self, cursor, kind):
+        q, args = workloads[kind](self.rng.choice(self.platforms), self.rng)
+        try:
+            cursor.execute(q, args)
+            cursor.fetchall()
+        except psycopg2.Error:
+            self.errors[kind] += 1
+            return False
+        return True
+
+    def run(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('select pg_backend_pid()')
+                pid = cursor.fetchone()[0]
+                # warm up the backend: load plpython and pg_li3ds
+                for kind in self.mix:
+                    self.execute(cursor, kind)
+                self.errors = dict((kind, 0) for kind in self.mix)
+                self.ready.set()
+                self.start_event.wait()
+                while timer() < self.deadline:
+                    kind = self.choose()
+                    start = timer()
+                    if self.execute(cursor, kind):
+                        self.latencies[kind].append(timer() - start)
+                self.memory = backend_memory(pid)
+        finally:
+            self.ready.set()
+            conn.close()
+
+
+def percentile(values, q):
+    ''' Return the q-th percentile of the sorted values, using the nearest rank.
+    '''
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(q / 100 * len(values))) - 1)]
+
+
+def run_step(dsn, platforms, mix, n_clients, duration, seed):
+    ''' Run the workloads with n_clients concurrent clients for duration seconds, and
+        return the report rows.
+    '''
+    start = threading.Event()
+    clients = [Client(dsn, platforms, mix, start, seed + i) for i in range(n_clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.ready.wait()
+    deadline = timer() + duration
+    for client in clients:
+        client.deadline = deadline
+    start.set()
+    for client in clients:
+        client.join()
+
+    rss = [c.memory[0] for c in clients if c.memory[0] is not None]
+    hwm = [c.memory[1] for c in clients if c.memory[1] is not None]
+    rows = []
+    for kind in sorted(mix) + ['all']:
+        kinds = mix if kind == 'all' else [kind]
+        latencies = sorted(l * 1000 for c in clients for k in kinds for l in c.latencies[k])
+        errors = sum(c.errors[k] for c in clients for k in kinds)
+        rows.append([
+            n_clients, kind, len(latencies), errors, len(latencies) / duration,
+            percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+            max(rss) if rss else None, max(hwm) if hwm else None])
+    return rows
+
+
+def parse_mix(mix):
+    ''' Parse a workload mix such as "point=4,box4d=2,patch=1".
+    '''
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in workloads:
+            raise argparse.ArgumentTypeError('unknown workload "{}"'.format(kind))
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description='li3ds transform load test')
+    parser.add_argument('--dsn', help='libpq connection string of an existing database, '
+                        'a local server is started otherwise')
+    parser.add_argument('--port', type=int, default=15433, help='port of the local server')
+    parser.add_argument('--clients', default='1,2,4,8,16,32,64',
+                        help='comma separated numbers of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='duration of each step, in seconds')
+    parser.add_argument('--mix', type=parse_mix, default='point=4,box4d=2,patch=1',
+                        help='weights of the workloads')
+    parser.add_argument('--platforms', type=int, default=4, help='number of platforms')
+    parser.add_argument('--patches', type=int, default=20, help='lidar patches per platform')
+    parser.add_argument('--points', type=int, default=1000, help='points per lidar patch')
+    parser.add_argument('--trajectory', type=float, default=3600,
+                        help='duration of the trajectories, in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    pg = None
+    dsn = args.dsn
+    if dsn is None:
+        pg = start_postgres(args.port)
+        dsn = 'host=/tmp/ dbname=testdb user={} port={}'.format(pg.ADMIN_USER, pg.running_port)
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            platforms = setup(conn, args.platforms, args.patches, args.points,
+                              args.trajectory, random.Random(args.seed))
+        finally:
+            conn.close()
+
+        headers = ['clients', 'workload', 'requests', 'errors', 'tps', 'p50 ms', 'p95 ms',
+                   'p99 ms', 'backend MB', 'peak MB']
+        rows = []
+        for n_clients in map(int, args.clients.split(',')):
+            step = run_step(dsn, platforms, args.mix, n_clients, args.duration, args.seed)
+            print(tabulate(step, headers=headers, floatfmt='.2f'))
+            print()
+            rows.extend(step)
+        print(tabulate([row for row in rows if row[1] == 'all'], headers=headers,
+                       floatfmt='.2f'))
+    finally:
+        if pg is not None:
+            pg.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import sys
+
+import pytest
+from hypothesis import given, strategies as st
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.path.pardir, 'python', 'pg_li3ds'))
+
+from bounds import box_samples, bounding_box, critical_angles  # NOQA
+
+
+coords = st.floats(min_value=-1000, max_value=1000)
+fractions = st.lists(st.floats(min_value=0, max_value=1), min_size=3, max_size=3)
+matrices = st.lists(st.floats(min_value=-10, max_value=10), min_size=12, max_size=12)
+
+
+@st.composite
+def boxes(draw, mins=(-1000, -1000, -1000), maxs=(1000, 1000, 1000)):
+    box_mins, box_maxs = [], []
+    for lo, hi in zip(mins, maxs):
+        a = draw(st.floats(min_value=lo, max_value=hi))
+        b = draw(st.floats(min_value=lo, max_value=hi))
+        box_mins.append(min(a, b))
+        box_maxs.append(max(a, b))
+    return box_mins, box_maxs
+
+
+def affine(m):
+    return lambda p: [m[4 * i] * p[0] + m[4 * i + 1] * p[1] + m[4 * i + 2] * p[2] +
+                      m[4 * i + 3] for i in range(3)]
+
+
+def spherical(p):
+    r, theta, phi = p
+    return [r * math.cos(phi) * math.cos(theta), r * math.cos(phi) * math.sin(theta),
+            r * math.sin(phi)]
+
+
+def spherical_colatitude(p):
+    r, theta, phi = p
+    return [r * math.sin(phi) * math.cos(theta), r * math.sin(phi) * math.sin(theta),
+            r * math.cos(phi)]
+
+
+def pinhole(focal, cx, cy):
+    return lambda p: [focal * p[0] / p[2] + cx, focal * p[1] / p[2] + cy, p[2]]
+
+
+def pinhole_inverse(focal, cx, cy):
+    return lambda p: [(p[0] - cx) * p[2] / focal, (p[1] - cy) * p[2] / focal, p[2]]
+
+
+def check_conservative(func_name, func, box, fraction):
+    mins, maxs = box
+    point = [lo + (hi - lo) * f for lo, hi, f in zip(mins, maxs, fraction)]
+    out_mins, out_maxs = bounding_box([func(p) for p in box_samples(func_name, mins, maxs)])
+    for value, lo, hi in zip(func(point), out_mins, out_maxs):
+        tolerance = 1e-9 * max(1.0, abs(lo), abs(hi))
+        assert lo - tolerance <= value <= hi + tolerance
+
+
+@given(boxes(), fractions, matrices)
+def test_affine_box(box, fraction, matrix):
+    check_conservative('affine_mat4x3', affine(matrix), box, fraction)
+
+
+@given(boxes(mins=(0, -10, -10), maxs=(100, 10, 10)), fractions)
+def test_spherical_to_cartesian_box(box, fraction):
+    check_conservative('spherical_to_cartesian', spherical, box, fraction)
+    check_conservative('spherical_to_cartesian', spherical_colatitude, box, fraction)
+
+
+@given(boxes(mins=(-1000, -1000, 0.1), maxs=(1000, 1000, 1000)), fractions,
+       st.floats(min_value=1, max_value=5000), coords, coords)
+def test_projective_pinhole_box(box, fraction, focal, cx, cy):
+    check_conservative('projective_pinhole', pinhole(focal, cx, cy), box, fraction)
+
+
+@given(boxes(mins=(0, 0, 0.1), maxs=(5000, 5000, 1000)), fractions,
+       st.floats(min_value=1, max_value=5000), coords, coords)
+def test_projective_pinhole_inverse_box(box, fraction, focal, cx, cy):
+    check_conservative('projective_pinhole_inverse', pinhole_inverse(focal, cx, cy),
+                       box, fraction)
+
+
+def test_projective_pinhole_box_behind_camera():
+    with pytest.raises(ValueError):
+        box_samples('projective_pinhole', [0, 0, -1], [1, 1, 1])
+
+
+def test_critical_angles():
+    assert critical_angles(0.1, 3.2) == pytest.approx([math.pi / 2, math.pi])
+    assert len(critical_angles(0, 100)) == 5
@@ -38,10 +38,16 @@ Graph used in tests (nodes are referentials, edges are transformations)
            +-+                  /
 
 '''
+import json
+import struct
+from itertools import chain
+
 import pytest
 import psycopg2
+from hypothesis import given, settings, HealthCheck, strategies as st
 
 from conftest import Database
+from helpers import pc_schema
 
 
 @pytest.yield_fixture(scope="function")
@@ -129,6 +135,22 @@ create_patch_table = '''
 '''
 
 
+add_echo_schemas = '''
+    insert into pointcloud_formats (pcid, srid, schema) values
+    (100, 0, '{}'), (101, 0, '{}'), (102, 0, '{}');
+'''.format(
+    pc_schema('time', 'theta', 'num_echoes', 'echo', 'range'),
+    pc_schema('time', 'theta', 'num_echoes', 'echo_offset'),
+    pc_schema('echo', 'range'))
+
+# two pulses, with two and one echoes
+multi_echo_patch = '''
+    pc_makepatch(100, ARRAY[1, 10, 2, 1, 5.5,
+                            1, 10, 2, 2, 7.5,
+                            2, 20, 1, 1, 3.5]::float8[])
+'''
+
+
 def test_schema_li3ds(db):
     assert db.hasschema('li3ds')
 
@@ -145,6 +167,13 @@ def test_table_list(db):
     assert db.hastable('li3ds', 'transfo')
     assert db.hastable('li3ds', 'transfo_type')
     assert db.hastable('li3ds', 'transfo_tree')
+    assert db.hastable('li3ds', 'image_frustum')
+    assert db.hastable('li3ds', 'transform_stats')
+    assert db.hastable('li3ds', 'datasource_lod')
+    assert db.hastable('li3ds', 'transformed_view')
+    assert db.hastable('li3ds', 'compiled_transform')
+    assert db.hastable('li3ds', 'trajectory_summary')
+    assert db.hastable('li3ds', 'platform_config_version')
 
 
 def test_check_datasource_uri_bad_scheme_ko(db):
@@ -377,6 +406,977 @@ def test_dijkstra_findref_ko(db):
         db.query("select dijkstra(1, 1, 8, 'lidar')")[0][0]
 
 
+def test_platform_config_versions(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    version = db.query("select max(version) from platform_config_version where config = 1")
+    assert db.query("select dijkstra(1, 1, 5)")[0][0] == [1, 4]
+    db.execute("update transfo_tree set transfos = ARRAY[1, 2, 3] where id = 1")
+    assert db.query("select count(*) from platform_config_version where config = 1")[0][0] == 2
+    assert db.query("select dijkstra(1, 1, 5)")[0][0] == []
+    # readers can pin a version
+    db.execute("set local li3ds.config_1_version = {}".format(version[0][0]))
+    assert db.query("select dijkstra(1, 1, 5)")[0][0] == [1, 4]
+
+
+def test_explain_transform_cached(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    db.query("select * from explain_transform(1, 1, 7)")
+    assert db.query("select bool_and(path_cached) from explain_transform(1, 1, 7)")[0][0]
+
+
+def test_pcid_dimensions(db):
+    db.execute(add_echo_schemas)
+    assert db.query("select pcid_dimensions(101)")[0][0] == [
+        'time', 'theta', 'num_echoes', 'echo_offset']
+
+
+def test_split_echoes(db):
+    db.execute(add_echo_schemas)
+    pulse, echo = db.query('''
+        select pc_astext(pulse), pc_astext(echo)
+        from split_echoes({}, 101, 102)
+    '''.format(multi_echo_patch))[0]
+    assert '"pts":[[1,10,2,0],[2,20,1,2]]' in pulse
+    assert '"pts":[[1,5.5],[2,7.5],[1,3.5]]' in echo
+
+
+def test_join_echoes(db):
+    db.execute(add_echo_schemas)
+    assert db.query('''
+        select pc_astext(join_echoes(pulse, echo, 100)) = pc_astext({})
+        from split_echoes({}, 101, 102)
+    '''.format(multi_echo_patch, multi_echo_patch))[0][0]
+
+
+def test_explain_transform(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    assert db.query('''
+        select hop, transfo, kind, actual_ms
+        from explain_transform(1, 1, 7)
+    ''') == [
+        (1, 1, 'static', None), (2, 4, 'static', None),
+        (3, 5, 'static', None), (4, 6, 'static', None)]
+    assert db.query("select count(*) from explain_transform(1, 3, 8)")[0][0] == 0
+
+
+def test_explain_transform_pinned_version(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    version = db.query("select max(version) from platform_config_version where config = 1")
+    db.execute("set local li3ds.config_1_version = {}".format(version[0][0]))
+    name = db.query("select name from transfo where id = 1")[0][0]
+    db.execute('''
+        update transfo set name = 'changed', parameters = '[
+            {"quat": [1, 0, 0, 0], "vec3": [0, 0, 0], "_time": 1},
+            {"quat": [1, 0, 0, 0], "vec3": [1, 0, 0], "_time": 2}]'
+        where id = 1
+    ''')
+    # the hops are described as of the pinned version
+    assert db.query('''
+        select name, kind from explain_transform(1, 1, 7) where transfo = 1
+    ''') == [(name, 'static')]
+
+
+def parse_box4d(box4d):
+    corners = box4d[box4d.index('(') + 1:box4d.rindex(')')].split(',')
+    return [list(map(float, corner.split())) for corner in corners]
+
+
+def check_box4d_conservative(db, func_name, func_sign, params, mins, maxs, fraction):
+    # a point of the box is transformed within the transformed box
+    point = [lo + (hi - lo) * f for lo, hi, f in zip(mins, maxs, fraction)]
+    q = "select transform('{}'::libox4d, '{}', {}, '{}')::text"
+    box = parse_box4d(db.query(q.format(
+        'BOX4D({} {} {},{} {} {})'.format(*(mins + maxs)), func_name, func_sign,
+        params))[0][0])
+    out = parse_box4d(db.query(q.format(
+        'BOX4D({0} {1} {2},{0} {1} {2})'.format(*point), func_name, func_sign,
+        params))[0][0])[0]
+    for i in range(3):
+        tolerance = 1e-6 * (1 + abs(out[i]))
+        assert box[0][i] - tolerance <= out[i] <= box[1][i] + tolerance
+
+
+def sorted_corners(lows, highs):
+    return ([min(a, b) for a, b in zip(lows, highs)],
+            [max(a, b) for a, b in zip(lows, highs)])
+
+
+@settings(max_examples=25, deadline=None, suppress_health_check=list(HealthCheck))
+@given(st.lists(st.floats(min_value=-100, max_value=100), min_size=6, max_size=6),
+       st.lists(st.floats(min_value=0, max_value=1), min_size=3, max_size=3),
+       st.lists(st.floats(min_value=-1, max_value=1), min_size=4, max_size=4).filter(
+           lambda q: sum(c * c for c in q) > 0.1))
+def test_transform_box4d_conservative(db, corners, fraction, quat):
+    mins, maxs = sorted_corners(corners[:3], corners[3:])
+    params = '{{"quat": [{}], "vec3": [1, 2, 3]}}'.format(', '.join(map(repr, quat)))
+    check_box4d_conservative(db, 'affine_quat', "ARRAY['quat', 'vec3']", params,
+                             mins, maxs, fraction)
+
+
+spherical_corner = st.tuples(st.floats(min_value=0, max_value=100),
+                             st.floats(min_value=-10, max_value=10),
+                             st.floats(min_value=-10, max_value=10))
+
+
+@settings(max_examples=25, deadline=None, suppress_health_check=list(HealthCheck))
+@given(spherical_corner, spherical_corner,
+       st.lists(st.floats(min_value=0, max_value=1), min_size=3, max_size=3))
+def test_transform_box4d_conservative_spherical(db, low, high, fraction):
+    mins, maxs = sorted_corners(low, high)
+    check_box4d_conservative(db, 'spherical_to_cartesian', 'ARRAY[]::text[]', '{}',
+                             mins, maxs, fraction)
+
+
+pinhole_corner = st.tuples(st.floats(min_value=-100, max_value=100),
+                           st.floats(min_value=-100, max_value=100),
+                           st.floats(min_value=0.1, max_value=100))
+
+
+@settings(max_examples=25, deadline=None, suppress_health_check=list(HealthCheck))
+@given(pinhole_corner, pinhole_corner,
+       st.lists(st.floats(min_value=0, max_value=1), min_size=3, max_size=3),
+       st.floats(min_value=1, max_value=100),
+       st.lists(st.floats(min_value=-100, max_value=100), min_size=2, max_size=2))
+def test_transform_box4d_conservative_pinhole(db, low, high, fraction, focal, center):
+    mins, maxs = sorted_corners(low, high)
+    params = '{{"projmat": [{0!r}, 0, {1!r}, 0, {0!r}, {2!r}, 0, 0, 1]}}'.format(
+        focal, *center)
+    check_box4d_conservative(db, 'projective_pinhole', "ARRAY['projmat']", params,
+                             mins, maxs, fraction)
+
+
+def test_transform_box4d_text_params(db):
+    assert parse_box4d(db.query('''
+        select transform('BOX4D(0 0 0,1 1 1)'::libox4d, 'affine_quat', ARRAY['quat', 'vec3'],
+                         '{"quat": [1, 0, 0, 0], "vec3": [1, 2, 3]}')::text
+    ''')[0][0]) == [[1, 2, 3], [2, 3, 4]]
+
+
+add_lod_datasource = '''
+    create schema test;
+    create table test.lidar (id serial, points pcpatch);
+    insert into pointcloud_formats (pcid, srid, schema) values (110, 0, '{}');
+    insert into test.lidar (points)
+    values (pc_makepatch(110, ARRAY[0, 0, 0, 1, 0, 0, 2, 0, 0, 3, 0, 0,
+                                    0, 4, 0, 1, 4, 0, 2, 4, 0, 3, 4, 0]::float8[]));
+    insert into project (id, name) values (1, 'project');
+    insert into platform (id, name) values (1, 'platform');
+    insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+    insert into referential (id, name) values (1, 'lidar');
+    insert into datasource (id, uri, type, session, referential)
+    values (1, 'column:test.lidar.points', 'pointcloud', 1, 1);
+'''.format(pc_schema('x', 'y', 'z'))
+
+
+def test_build_lod(db):
+    db.execute(add_lod_datasource)
+    assert db.query("select build_lod(1, 2, 2)")[0][0] == 2
+    assert db.query('''
+        select level, uri, bounds from datasource_lod order by level
+    ''') == [
+        (1, 'column:test.lidar_lod1.points', [0, 0, 0, 3, 4, 0]),
+        (2, 'column:test.lidar_lod2.points', [0, 0, 0, 3, 4, 0])]
+    assert db.query('''
+        select array_agg(resolution order by level) from datasource_lod
+    ''')[0][0] == pytest.approx([3 ** 0.5, 6 ** 0.5])
+    assert db.query("select sum(pc_numpoints(points)) from test.lidar_lod2")[0][0] == 2
+    # appended patches are decimated into the existing levels
+    db.execute('''
+        insert into test.lidar (points)
+        values (pc_makepatch(110, ARRAY[0, 8, 0, 1, 8, 0]::float8[]))
+    ''')
+    assert db.query("select sum(pc_numpoints(points)) from test.lidar_lod1")[0][0] == 5
+    # and the metadata of the levels follow
+    assert db.query('''
+        select level, bounds, num_points from datasource_lod order by level
+    ''') == [(1, [0, 0, 0, 3, 8, 0], 5), (2, [0, 0, 0, 3, 8, 0], 3)]
+    assert db.query('''
+        select array_agg(resolution order by level) from datasource_lod
+    ''')[0][0] == pytest.approx([4.8 ** 0.5, 8 ** 0.5])
+
+
+def test_lod_for_resolution(db):
+    db.execute(add_lod_datasource)
+    db.execute("select build_lod(1, 2, 2)")
+    assert db.query("select lod_for_resolution(1, 1)")[0][0] == 'column:test.lidar.points'
+    assert db.query("select lod_for_resolution(1, 2)")[0][0] == \
+        'column:test.lidar_lod1.points'
+    assert db.query("select lod_for_resolution(1, 10)")[0][0] == \
+        'column:test.lidar_lod2.points'
+
+
+def read_las(path):
+    '''
+    Return the x, y and z coordinates of the points of a LAS file
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == b'LASF'
+    point_offset, = struct.unpack_from('<I', data, 96)
+    record_size, count = struct.unpack_from('<HI', data, 105)
+    scale = struct.unpack_from('<3d', data, 131)
+    offset = struct.unpack_from('<3d', data, 155)
+    return [
+        [v * s + o for v, s, o in zip(
+            struct.unpack_from('<3i', data, point_offset + i * record_size), scale, offset)]
+        for i in range(count)]
+
+
+def read_ply(path, ndims):
+    '''
+    Return the points of a binary little endian PLY file of double properties
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == b'ply\n'
+    start = data.index(b'end_header\n') + len(b'end_header\n')
+    values = struct.unpack_from('<{:d}d'.format((len(data) - start) // 8), data, start)
+    return [list(values[i:i + ndims]) for i in range(0, len(values), ndims)]
+
+
+def test_export_datasource(db, tmpdir):
+    db.execute(add_lod_datasource)
+    points = [[x, y, 0] for y in (0, 4) for x in range(4)]
+    path = str(tmpdir.join('lidar.las'))
+    assert db.query("select export_datasource(1, 1, 1, '{}', 'las')".format(path))[0][0] == 8
+    assert list(chain.from_iterable(read_las(path))) == pytest.approx(
+        list(chain.from_iterable(points)))
+    path = str(tmpdir.join('lidar.ply'))
+    assert db.query("select export_datasource(1, 1, 1, '{}', 'ply')".format(path))[0][0] == 8
+    assert read_ply(path, 3) == points
+
+
+def test_export_datasource_without_bounds(db, tmpdir):
+    db.execute(add_lod_datasource)
+    db.execute('''
+        update test.lidar set points = pc_makepatch(110, ARRAY[
+            6000000.5, 2000000, 100, 6000001, 2000000.25, 101]::float8[]);
+        update datasource set bounds = null;
+    ''')
+    path = str(tmpdir.join('lidar.las'))
+    assert db.query("select export_datasource(1, 1, 1, '{}', 'las')".format(path))[0][0] == 2
+    coords = list(chain.from_iterable(read_las(path)))
+    assert coords == pytest.approx([6000000.5, 2000000, 100, 6000001, 2000000.25, 101],
+                                   abs=1e-3)
+
+
+def test_export_datasource_empty(db, tmpdir):
+    db.execute(add_lod_datasource)
+    db.execute('delete from test.lidar')
+    for format_, read in (('las', read_las), ('ply', lambda path: read_ply(path, 3))):
+        path = str(tmpdir.join('empty.' + format_))
+        assert db.query("select export_datasource(1, 1, 1, '{}', '{}')"
+                        .format(path, format_))[0][0] == 0
+        assert read(path) == []
+
+
+def test_read_file_datasource(db, tmpdir):
+    db.execute(add_lod_datasource)
+    for format_ in ('las', 'ply'):
+        path = str(tmpdir.join('lidar.' + format_))
+        db.query("select export_datasource(1, 1, 1, '{}', '{}')".format(path, format_))
+        db.execute('''
+            insert into datasource (uri, type, parameters, session, referential)
+            values ('file:{}', 'pointcloud', '{{"pcid": 110, "chunk_size": 3}}', 1, 1)
+        '''.format(path))
+        datasource = db.query("select id from datasource where uri = 'file:{}'"
+                              .format(path))[0][0]
+        assert db.query('''
+            select sum(pc_numpoints(p)), min(pc_pcid(p)) from read_file_datasource({}) p
+        '''.format(datasource))[0] == (8, 110)
+        assert db.query('''
+            select num_points from file_chunk_index where datasource = {}
+            order by chunk
+        '''.format(datasource)) == [(3,), (3,), (2,)]
+        assert db.query('''
+            select pc_astext(p) from read_file_datasource({}, geom => st_3dmakebox(
+                st_makepoint(2.5, -1, -1), st_makepoint(4, 1, 1))::geometry) p
+        '''.format(datasource)) == [
+            ('{"pcid":110,"pts":[[3,0,0],[0,4,0],[1,4,0]]}',)]
+
+
+def test_read_file_datasource_empty(db, tmpdir):
+    db.execute(add_lod_datasource)
+    path = tmpdir.join('empty.ply')
+    path.write('ply\nformat binary_little_endian 1.0\nelement vertex 0\n'
+               'property double x\nproperty double y\nproperty double z\nend_header\n')
+    db.execute('''
+        insert into datasource (id, uri, type, parameters, session, referential)
+        values (2, 'file:{}', 'pointcloud', '{{"pcid": 110}}', 1, 1)
+    '''.format(path))
+    assert db.query('select count(*) from read_file_datasource(2)')[0][0] == 0
+    # the file is indexed once, although it has no chunk
+    assert db.query('select count(*) from file_index where datasource = 2')[0][0] == 1
+    db.execute('set transaction read only')
+    assert db.query('select count(*) from read_file_datasource(2)')[0][0] == 0
+
+
+def test_read_file_datasource_read_only(db, tmpdir):
+    db.execute(add_lod_datasource)
+    path = str(tmpdir.join('lidar.ply'))
+    db.query("select export_datasource(1, 1, 1, '{}', 'ply')".format(path))
+    db.execute('''
+        insert into datasource (id, uri, type, parameters, session, referential)
+        values (2, 'file:{}', 'pointcloud', '{{"pcid": 110}}', 1, 1)
+    '''.format(path))
+    db.execute('set transaction read only')
+    with pytest.raises(psycopg2.Error):
+        db.query('select count(*) from read_file_datasource(2)')
+
+
+add_trajectory_datasource = '''
+    create schema test;
+    create table test.traj (id serial, points pcpatch);
+    insert into pointcloud_formats (pcid, srid, schema) values (120, 0, '{}');
+    insert into project (id, name) values (1, 'project');
+    insert into platform (id, name) values (1, 'platform');
+    insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+    insert into referential (id, name) values (1, 'world');
+    insert into datasource (id, uri, type, session, referential)
+    values (1, 'column:test.traj.points', 'trajectory', 1, 1);
+'''.format(pc_schema('time', 'x', 'y', 'z'))
+
+
+def test_datasource_bounds_maintained(db):
+    db.execute(add_trajectory_datasource)
+    assert db.query("select bounds from datasource where id = 1")[0][0] is None
+    db.execute('''
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[])),
+               (pc_makepatch(120, ARRAY[30, -1, 5, 0, 40, 0, 0, 0]::float8[]));
+    ''')
+    assert db.query('''
+        select bounds, extract(epoch from capture_start), extract(epoch from capture_end)
+        from datasource where id = 1
+    ''')[0] == ([-1, 0, 0, 1, 5, 3], 10, 40)
+    assert db.query('''
+        select extract(epoch from start_time), extract(epoch from end_time)
+        from session where id = 1
+    ''')[0] == (10, 40)
+
+
+def test_read_file_datasource_time(db, tmpdir):
+    db.execute(add_trajectory_datasource)
+    db.execute('''
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[])),
+               (pc_makepatch(120, ARRAY[30, -1, 5, 0, 40, 0, 0, 0]::float8[]));
+    ''')
+    path = str(tmpdir.join('traj.ply'))
+    db.query("select export_datasource(1, 1, 1, '{}', 'ply')".format(path))
+    db.execute('''
+        insert into datasource (id, uri, type, parameters, session, referential)
+        values (2, 'file:{}', 'trajectory', '{{"pcid": 120}}', 1, 1)
+    '''.format(path))
+    assert db.query('select index_file_datasource(2, 2)')[0][0] == 2
+    assert db.query('''
+        select pc_astext(p) from read_file_datasource(2, 25, 35) p
+    ''') == [('{"pcid":120,"pts":[[30,-1,5,0],[40,0,0,0]]}',)]
+    assert db.query('select count(*) from read_file_datasource(2, 50)')[0][0] == 0
+    db.execute("update datasource set parameters = '{\"pcid\": 120, \"chunk_size\": 1}' "
+               "where id = 2")
+    assert db.query('select count(*) from file_chunk_index where datasource = 2')[0][0] == 0
+    assert db.query('select count(*) from read_file_datasource(2)')[0][0] == 4
+
+
+def test_refresh_datasource_bounds(db):
+    db.execute(add_trajectory_datasource)
+    db.execute('''
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[])),
+               (pc_makepatch(120, ARRAY[30, -1, 5, 0, 40, 0, 0, 0]::float8[]));
+        delete from test.traj where id = 2;
+    ''')
+    assert db.query("select refresh_datasource_bounds(1)")[0][0] == [0, 0, 0, 1, 2, 3]
+    assert db.query('''
+        select extract(epoch from end_time) from session where id = 1
+    ''')[0][0] == 20
+
+
+def test_datasource_bounds_without_xyz(db):
+    db.execute(add_echo_schemas)
+    db.execute('''
+        create schema test;
+        create table test.pulse (id serial, points pcpatch);
+        insert into project (id, name) values (1, 'project');
+        insert into platform (id, name) values (1, 'platform');
+        insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+        insert into referential (id, name) values (1, 'lidar');
+        insert into datasource (id, uri, type, session, referential)
+        values (1, 'column:test.pulse.points', 'pointcloud', 1, 1);
+        insert into test.pulse (points)
+        values (pc_makepatch(101, ARRAY[1, 10, 2, 0, 2, 20, 1, 2]::float8[]));
+    ''')
+    assert db.query('''
+        select bounds, extract(epoch from capture_start), extract(epoch from capture_end)
+        from datasource where id = 1
+    ''')[0] == ([None] * 6, 1, 2)
+    assert db.query("select refresh_datasource_bounds(1)")[0][0] == [None] * 6
+
+
+def test_trajectory_summary(db):
+    db.execute(add_trajectory_datasource)
+    db.execute('''
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 0, 0, 30, 2, 0, 0]::float8[]));
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[40, 2, 1, 0, 50, 2, 2, 0]::float8[]));
+    ''')
+    # the collinear vertex of the first patch is simplified away
+    assert db.query('''
+        select st_astext(geom), lower(time_range) = to_timestamp(10)
+        from trajectory_summary where datasource = 1
+    ''') == [('LINESTRING ZM (0 0 0 10,2 0 0 30,2 1 0 40,2 2 0 50)', True)]
+    # when did the trajectory pass near (1, 0)?
+    assert db.query('''
+        select st_interpolatepoint(geom, 'POINT(1 0)') from trajectory_summary
+        where st_dwithin(geom, 'POINT(1 0)', 0.5)
+    ''') == [(20,)]
+    # patches inserted out of time order rebuild the summary
+    db.execute('''
+        insert into test.traj (points)
+        values (pc_makepatch(120, ARRAY[0, -1, 0, 0, 5, -0.5, 0, 0]::float8[]))
+    ''')
+    assert db.query('''
+        select st_npoints(geom), st_m(st_startpoint(geom)) from trajectory_summary
+    ''') == [(3, 0)]
+
+
+add_lineage_datasources = '''
+    create schema test;
+    create table test.traj1 (id serial, points pcpatch);
+    create table test.traj2 (id serial, points pcpatch);
+    create table test.traj3 (id serial, points pcpatch);
+    insert into pointcloud_formats (pcid, srid, schema) values (120, 0, '{}');
+    insert into project (id, name) values (1, 'project');
+    insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+    insert into datasource (id, uri, type, session, referential)
+    values (1, 'column:test.traj1.points', 'trajectory', 1, 1),
+           (2, 'column:test.traj2.points', 'trajectory', 1, 1),
+           (3, 'column:test.traj3.points', 'trajectory', 1, 1);
+'''.format(pc_schema('time', 'x', 'y', 'z'))
+
+
+def test_transfo_update_marks_processing_stale(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    db.execute(add_lineage_datasources)
+    db.execute('''
+        insert into processing (id, tool, source, target, config, transfos)
+        values (1, 'transform_datasource', 1, 2, 1, ARRAY[1, 4]),
+               (2, 'transform_datasource', 2, 3, 1, ARRAY[6]),
+               (3, 'transform_datasource', 1, 3, 1, ARRAY[5]);
+    ''')
+    db.execute("update transfo set description = 'recalibrated' where id = 4")
+    # processing 2 uses the target of processing 1
+    assert db.query("select array_agg(id order by id) from processing where stale")[0][0] == [1, 2]
+
+
+def test_reprocess_stale(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    db.execute(add_lineage_datasources)
+    db.execute('''
+        insert into test.traj1 (points)
+        values (pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[]));
+    ''')
+    processing = db.query("select transform_datasource(1, 1, 2)")[0][0]
+    assert db.query("select count(*) from test.traj2")[0][0] == 1
+    db.execute("update processing set stale = true where id = {}".format(processing))
+    db.execute("insert into test.traj2 (points) select points from test.traj1")
+    assert db.query("select reprocess_stale()")[0][0] == 1
+    assert db.query("select count(*) from test.traj2")[0][0] == 1
+    assert not db.query("select stale from processing where id = {}".format(processing))[0][0]
+
+
+def test_transfo_delete_marks_processing_stale(db):
+    db.execute(add_sensor_group1)
+    db.execute(add_sensor_group2)
+    db.execute(add_transfo_trees)
+    db.execute(add_sensor_connection)
+    db.execute(add_platform_config)
+    db.execute(add_lineage_datasources)
+    db.execute('''
+        insert into processing (id, tool, source, target, config, transfos)
+        values (1, 'transform_datasource', 1, 2, 1, ARRAY[1, 4]),
+               (2, 'transform_datasource', 1, 3, null, ARRAY[6]);
+    ''')
+    db.execute("delete from transfo where id = 4")
+    assert db.query("select array_agg(id order by id) from processing where stale")[0][0] == [1]
+
+
+def test_transfo_update_reprocess(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    db.execute('''
+        create table test.lidar_world (id serial, points pcpatch);
+        insert into datasource (id, uri, type, session, referential)
+        values (2, 'column:test.lidar_world.points', 'pointcloud', 1, 2);
+    ''')
+    processing = db.query("select transform_datasource(1, 1, 2)")[0][0]
+    assert db.query('''
+        select pc_patchmin(points, 'x'), pc_patchmin(points, 'z') from test.lidar_world
+    ''') == [(1, 3)]
+    db.execute('''
+        update transfo set parameters = '[{"quat": [1, 0, 0, 0], "vec3": [10, 0, 0]}]'
+        where id = 1
+    ''')
+    assert db.query("select stale from processing where id = {}".format(processing))[0][0]
+    assert db.query("select reprocess_stale()")[0][0] == 1
+    assert db.query('''
+        select pc_patchmin(points, 'x'), pc_patchmin(points, 'z') from test.lidar_world
+    ''') == [(10, 0)]
+
+
+add_georeference_tables = '''
+    create schema test;
+    insert into pointcloud_formats (pcid, srid, schema)
+    values (120, 0, '{}'), (121, 0, '{}');
+    create table test.traj (id serial, points pcpatch);
+    create table test.lidar (id serial, points pcpatch);
+    insert into test.traj (points)
+    values (pc_makepatch(120, ARRAY[0, 0, 0, 0, 1, 0, 0, 0,
+                                    10, 10, 0, 0, 1, 0, 0, 0]::float8[])),
+           -- rotated by 90 degrees around z
+           (pc_makepatch(120, ARRAY[20, 20, 0, 0, 0.5, 0, 0, 0.5,
+                                    30, 30, 0, 0, 0.5, 0, 0, 0.5]::float8[]));
+    insert into test.lidar (points)
+    values (pc_makepatch(121, ARRAY[2, 1, 0, 0, 4, 0, 1, 0]::float8[])),
+           (pc_makepatch(121, ARRAY[8, 1, 0, 0, 25, 1, 0, 0]::float8[])),
+           (pc_makepatch(121, ARRAY[40, 1, 0, 0]::float8[]));
+'''.format(pc_schema('time', 'x', 'y', 'z', 'qw', 'qx', 'qy', 'qz'),
+           pc_schema('time', 'x', 'y', 'z'))
+
+
+def test_georeference(db):
+    db.execute(add_georeference_tables)
+    rv = db.query('''
+        select id, pc_astext(patch)
+        from georeference('test.lidar', 'points', 'test.traj', 'points')
+    ''')
+    assert [id_ for id_, patch in rv] == [1, 2, 3]
+    assert json.loads(rv[0][1])['pts'] == [[2, 3, 0, 0], [4, 4, 1, 0]]
+    # the second patch straddles both trajectory patches
+    assert list(chain.from_iterable(json.loads(rv[1][1])['pts'])) == pytest.approx(
+        [8, 9, 0, 0, 25, 25, 1, 0])
+    # the last lidar patch has no trajectory
+    assert rv[2][1] is None
+
+
+add_partitioned_patch_table = '''
+    create schema test;
+    insert into pointcloud_formats (pcid, srid, schema) values (120, 0, '{}');
+    insert into project (id, name) values (1, 'project');
+    insert into platform (id, name) values (1, 'platform');
+    insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+    select create_patch_table('test', 'traj', 100);
+'''.format(pc_schema('time', 'x', 'y', 'z'))
+
+
+def server_version_num(db):
+    return int(db.query("select current_setting('server_version_num')")[0][0])
+
+
+def test_create_patch_table_unsupported(db):
+    if server_version_num(db) >= 100000:
+        pytest.skip('declarative partitioning is supported')
+    with pytest.raises(psycopg2.Error):
+        db.execute(add_partitioned_patch_table)
+
+
+def test_patch_partitions(db):
+    if server_version_num(db) < 100000:
+        pytest.skip('declarative partitioning requires PostgreSQL 10')
+    db.execute(add_partitioned_patch_table)
+    assert db.query("select add_patch_partition('test.traj', 1, 0, 1000)")[0][0] == \
+        'test.traj_s1_0'
+    assert db.query("select add_patch_partition('test.traj', 1, 1000, 2000)")[0][0] == \
+        'test.traj_s1_1000'
+    db.execute('''
+        insert into test.traj (session, points)
+        values (1, pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[])),
+               (1, pc_makepatch(120, ARRAY[1010, 0, 0, 0, 1020, 1, 2, 3]::float8[]));
+    ''')
+    assert db.query("select count(*) from test.traj_s1_1000")[0][0] == 1
+    assert db.query("select check_pcpatch_column('test.traj.points')")[0][0]
+    assert db.query("select drop_patch_partitions('test.traj', 1000)")[0][0] == 1
+    assert db.query("select count(*) from test.traj")[0][0] == 1
+    # partition names do not depend on the partitions dropped before
+    assert db.query("select add_patch_partition('test.traj', 1, 2000, 3000)")[0][0] == \
+        'test.traj_s1_2000'
+
+
+def test_patch_partitions_datasource_bounds(db):
+    if server_version_num(db) < 100000:
+        pytest.skip('declarative partitioning requires PostgreSQL 10')
+    db.execute(add_partitioned_patch_table)
+    db.execute('''
+        select add_patch_partition('test.traj', 1, 0, 1000);
+        insert into referential (id, name) values (1, 'r1');
+        insert into datasource (id, uri, type, session, referential)
+        values (1, 'column:test.traj.points', 'trajectory', 1, 1);
+        select add_patch_partition('test.traj', 1, 1000, 2000);
+        insert into test.traj (session, points)
+        values (1, pc_makepatch(120, ARRAY[10, 0, 0, 0, 20, 1, 2, 3]::float8[])),
+               (1, pc_makepatch(120, ARRAY[1010, 4, 5, 6, 1020, 1, 2, 3]::float8[]));
+    ''')
+    assert db.query("select bounds from datasource where id = 1")[0][0] == [0, 0, 0, 4, 5, 6]
+
+
+add_bounded_form_1_transfo = '''
+    create schema test;
+    insert into pointcloud_formats (pcid, srid, schema) values (120, 0, '{}');
+    create table test.traj (id serial, points pcpatch);
+    insert into test.traj (points)
+    values (pc_makepatch(120, ARRAY[0, 0, 0, 0, 1, 0, 0, 0,
+                                    10, 10, 0, 0, 1, 0, 0, 0]::float8[])),
+           (pc_makepatch(120, ARRAY[10, 10, 0, 0, 1, 0, 0, 0,
+                                    20, 20, 0, 0, 1, 0, 0, 0]::float8[]));
+    insert into platform (id, name) values (1, 'platform');
+    insert into referential (id, name) values (1, 'r1'), (2, 'r2');
+    insert into transfo_type (id, name, func_signature)
+    values (1, 'affine_quat', ARRAY['quat', 'vec3']);
+    insert into transfo (id, name, source, target, transfo_type, parameters_column, parameters)
+    values (1, 't1', 1, 2, 1, 'test.traj.points',
+            '[{{"quat": ["qw", "qx", "qy", "qz"], "vec3": ["x", "y", "z"]}}]');
+    insert into transfo_tree (id, name, transfos) values (1, 't1', ARRAY[1]);
+    insert into platform_config (id, name, platform, transfo_trees)
+    values (1, 'p1', 1, ARRAY[1]);
+'''.format(pc_schema('time', 'x', 'y', 'z', 'qw', 'qx', 'qy', 'qz'))
+
+
+def test_form_1_transfo_bounded_patch_duration(db):
+    db.execute(add_bounded_form_1_transfo)
+    # patch tables of bounded patch duration also prune the patches starting too early
+    db.execute('''
+        insert into patch_partitioning (parent, patch_column, dimension, max_patch_duration)
+        values ('test.traj', 'points', 'time', 10);
+    ''')
+    assert db.query("select transform(ARRAY[0, 0, 0]::float8[], 1, 1, 2, 15.0)") == \
+        [([15, 0, 0],)]
+    assert db.query("select transform(ARRAY[0, 0, 0]::float8[], 1, 1, 2, 5.0)") == \
+        [([5, 0, 0],)]
+
+
+def test_form_1_transfo_patch_duration_changed(db):
+    db.execute(add_bounded_form_1_transfo)
+    db.execute('''
+        insert into patch_partitioning (parent, patch_column, dimension, max_patch_duration)
+        values ('test.traj', 'points', 'time', 1);
+    ''')
+    # the patch starting at 10 is pruned for a duration of 1
+    assert db.query("select transform(ARRAY[0, 0, 0]::float8[], 1, 1, 2, 15.0)") == \
+        [(None,)]
+    # changing the partitioning of the table makes a new config version
+    db.execute("update patch_partitioning set max_patch_duration = 10")
+    assert db.query('''
+        select transfos->0->>'max_patch_duration' from platform_config_version
+        where config = 1 order by version desc limit 1
+    ''')[0][0] == '10'
+    assert db.query("select transform(ARRAY[0, 0, 0]::float8[], 1, 1, 2, 15.0)") == \
+        [([15, 0, 0],)]
+
+
+def test_transform_config_form_1_twice(db):
+    db.execute(add_bounded_form_1_transfo)
+    # the cached config version is left untouched by the parameters lookups
+    for _ in range(2):
+        assert db.query("select transform(ARRAY[0, 0, 0]::float8[], 1, 1, 2, 15.0)") == \
+            [([15, 0, 0],)]
+
+
+add_form_2_transfo = '''
+    insert into transfo_type (id, name, func_signature)
+    values (1, 'affine_quat', ARRAY['quat', 'vec3', '_time']);
+    insert into referential (id, name) values (1, 'r1'), (2, 'r2');
+    insert into transfo (id, name, source, target, transfo_type, parameters)
+    values (1, 't1', 1, 2, 1, '[
+        {"quat": [1, 0, 0, 0], "vec3": [1, 0, 0], "_time": 10},
+        {"quat": [1, 0, 0, 0], "vec3": [2, 0, 0], "_time": 20}]');
+'''
+
+
+def test_transfo_params(db):
+    db.execute(add_form_2_transfo)
+    assert db.query("select transfo_params(1, ARRAY[10, 15, 25])") == [
+        ({"quat": [1, 0, 0, 0], "vec3": [1, 0, 0], "_time": 10},),
+        ({"quat": [1, 0, 0, 0], "vec3": [2, 0, 0], "_time": 20},),
+        (None,)]
+
+
+add_lidar_transfo = '''
+    insert into transfo_type (id, name, func_signature)
+    values (1, 'affine_quat', ARRAY['quat', 'vec3']);
+    insert into referential (id, name) values (2, 'world');
+    insert into transfo (id, name, source, target, transfo_type, parameters)
+    values (1, 't1', 1, 2, 1, '[{"quat": [1, 0, 0, 0], "vec3": [1, 2, 3]}]');
+    insert into transfo_tree (id, name, transfos) values (1, 't1', ARRAY[1]);
+    insert into platform_config (id, name, platform, transfo_trees)
+    values (1, 'p1', 1, ARRAY[1]);
+'''
+
+
+def test_transform_patch_by_chunks(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    expected = db.query("select pc_astext(transform(points, 1)) from test.lidar")
+    db.execute("set local li3ds.transform_chunk_size = 3")
+    assert db.query("select pc_astext(transform(points, 1)) from test.lidar") == expected
+    assert db.query("select pc_numpoints(transform(points, 1)) from test.lidar")[0][0] == 8
+
+
+def test_explain_transform_analyze(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    assert db.query('''
+        select hop, kind, estimated_ms, actual_ms >= lookup_ms
+        from explain_transform(1, 1, 2, run_analyze => true)
+    ''') == [(1, 'static', None, True)]
+    assert db.query('''
+        select func_name, kind, object, calls from transform_stats
+    ''') == [('affine_quat', 'static', 'point', 1)]
+    db.query('''
+        select * from explain_transform(1, 1, 2, run_analyze => true,
+                                        patch => (select points from test.lidar))
+    ''')
+    assert db.query('''
+        select object, calls from transform_stats order by object
+    ''') == [('patch', 1), ('point', 1)]
+    # the recorded timings are used as estimates
+    assert db.query('''
+        select e.estimated_ms = s.total_ms
+        from explain_transform(1, 1, 2) e, transform_stats s where s.object = 'point'
+    ''') == [(True,)]
+
+
+def test_create_transformed_view(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    assert db.query("select create_transformed_view(1, 1, 2)")[0][0] == 'test.lidar_ref2'
+    assert db.query('''
+        select pc_patchmin(points, 'x'), pc_patchmax(points, 'z') from test.lidar_ref2
+    ''') == [(1, 3)]
+    assert db.query('''
+        select st_xmin(transformed_view_bounds('test.lidar_ref2',
+            st_3dmakebox(st_makepoint(1, 2, 3), st_makepoint(2, 2, 3))))
+    ''')[0][0] == pytest.approx(0)
+
+
+def test_transformed_view_patches(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    db.execute("select create_transformed_view(1, 1, 2)")
+    assert db.query('''
+        select count(*) from transformed_view_patches(null::test.lidar_ref2,
+            st_3dmakebox(st_makepoint(0, 0, 0), st_makepoint(2, 3, 4)))
+    ''')[0][0] == 1
+    # the patch spans [0, 3] x [0, 4] x [0, 0] before the transform
+    assert db.query('''
+        select count(*) from transformed_view_patches(null::test.lidar_ref2,
+            st_3dmakebox(st_makepoint(0, 0, 0), st_makepoint(2, 3, 2)))
+    ''')[0][0] == 0
+
+
+def test_compile_transform(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    assert db.query("select compile_transform(1, 1, 2)")[0][0] == 'li3ds.transform_1_1_2'
+    assert db.query('''
+        select pc_astext(transform_1_1_2(points)) = pc_astext(transform(points, 1, 1, 2))
+        from test.lidar
+    ''')[0][0]
+    assert db.query('''
+        select provolatile, proparallel from pg_proc where proname = 'transform_1_1_2'
+    ''') == [('i', 's'), ('i', 's')]
+    # the functions are regenerated when a transfo of the path changes
+    db.execute('''
+        update transfo set parameters = '[{"quat": [1, 0, 0, 0], "vec3": [0, 0, 1]}]'
+    ''')
+    assert db.query("select pc_patchmin(transform_1_1_2(points), 'z') from test.lidar") == [(1,)]
+
+
+def test_compile_transform_pinned_version(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    db.execute("select compile_transform(1, 1, 2)")
+    version = db.query("select max(version) from platform_config_version where config = 1")
+    db.execute("set local li3ds.config_1_version = {}".format(version[0][0]))
+    # the functions are regenerated from the new version, not from the pinned one
+    db.execute('''
+        update transfo set parameters = '[{"quat": [1, 0, 0, 0], "vec3": [0, 0, 1]}]'
+    ''')
+    assert db.query("select pc_patchmin(transform_1_1_2(points), 'z') from test.lidar") == [(1,)]
+    assert db.query('''
+        select pc_patchmin(transform(points, 1, 1, 2), 'z') from test.lidar
+    ''') == [(3,)]
+
+
+def test_compile_transform_box(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    # rotation of pi / 4 around z, the corners of the box are not mapped to corners
+    db.execute('''
+        update transfo set parameters =
+            '[{"quat": [0.9238795325112867, 0, 0, 0.3826834323650898], "vec3": [0, 0, 0]}]'
+    ''')
+    db.execute("select compile_transform(1, 1, 2)")
+    box = 'BOX4D(0 0 0,1 1 1)'
+    compiled, expected = db.query('''
+        select transform_1_1_2('{0}'::libox4d)::text,
+               transform('{0}'::libox4d, 1, 1, 2)::text
+    '''.format(box))[0]
+    assert compiled == expected
+    mins, maxs = parse_box4d(compiled)
+    # the corners (0, 1, 0), (1, 0, 0) and (1, 1, 0) are mapped within the box
+    assert mins[0] <= -0.7 and maxs[0] >= 0.7 and maxs[1] >= 1.41
+
+
+def test_compile_transform_dropped(db):
+    db.execute(add_lod_datasource)
+    db.execute(add_lidar_transfo)
+    db.execute("select compile_transform(1, 1, 2)")
+    # the path becomes dynamic
+    db.execute('''
+        update transfo set parameters = '[
+            {"quat": [1, 0, 0, 0], "vec3": [0, 0, 0]},
+            {"quat": [1, 0, 0, 0], "vec3": [1, 0, 0]}]'
+    ''')
+    assert db.query("select count(*) from compiled_transform")[0][0] == 0
+    assert db.query("select count(*) from pg_proc where proname = 'transform_1_1_2'")[0][0] == 0
+
+
+add_image_datasource = '''
+    insert into project (id, name) values (1, 'project');
+    insert into platform (id, name) values (1, 'platform');
+    insert into session (id, name, project, platform) values (1, 'session', 1, 1);
+    insert into sensor (id, name, serial_number, type) values (1, 'cam', 'XKB', 'camera');
+    insert into referential (id, sensor, name) values (1, 1, 'image'), (2, 1, 'world');
+    insert into platform_config (id, name, platform) values (1, 'p1', 1);
+    insert into datasource (id, uri, type, parameters, session, referential)
+    values (1, 'file:/path/to/image.jpg', 'image', '{"width": 10, "height": 10}', 1, 1);
+    insert into image_frustum (datasource, config, referential, geom)
+    values (1, 1, 2, 'POLYHEDRALSURFACE Z (
+        ((0 0 0,0 1 0,1 1 0,1 0 0,0 0 0)),((0 0 1,1 0 1,1 1 1,0 1 1,0 0 1)),
+        ((0 0 0,1 0 0,1 0 1,0 0 1,0 0 0)),((1 0 0,1 1 0,1 1 1,1 0 1,1 0 0)),
+        ((1 1 0,0 1 0,0 1 1,1 1 1,1 1 0)),((0 1 0,0 0 0,0 0 1,0 1 1,0 1 0)))');
+'''
+
+
+def test_images_seeing(db):
+    db.execute(add_image_datasource)
+    assert db.query('''
+        select array_agg(i) from images_seeing(1, 2, 'LINESTRING Z (0.5 0.5 0.5, 2 2 2)') i
+    ''')[0][0] == [1]
+    assert db.query('''
+        select array_agg(i) from images_seeing(1, 2, 'LINESTRING Z (2 2 2, 3 3 3)') i
+    ''')[0][0] is None
+
+
+add_image_transfos = '''
+    insert into transfo_type (id, name, func_signature)
+    values (1, 'affine_quat', ARRAY['quat', 'vec3', '_time']);
+    insert into transfo (id, name, source, target, transfo_type, parameters)
+    values (1, 'image_world', 1, 2, 1, '[{"quat": [1, 0, 0, 0], "vec3": [1, 2, 3]}]'),
+           (2, 'world_image', 2, 1, 1, '[{"quat": [1, 0, 0, 0], "vec3": [-1, -2, -3]}]');
+    insert into transfo_tree (id, name, transfos) values (1, 'camera', ARRAY[1, 2]);
+    update platform_config set transfo_trees = ARRAY[1] where id = 1;
+'''
+
+
+def test_update_image_frustums(db):
+    db.execute(add_image_datasource)
+    db.execute(add_image_transfos)
+    assert db.query("select update_image_frustums(1, 2, 1, 2)")[0][0] == 1
+    assert db.query('''
+        select st_xmin(geom), st_ymin(geom), st_zmin(geom),
+               st_xmax(geom), st_ymax(geom), st_zmax(geom)
+        from image_frustum where datasource = 1
+    ''') == [(1, 2, 4, 11, 12, 5)]
+
+
+def test_update_image_frustums_untimed(db):
+    db.execute(add_image_datasource)
+    db.execute(add_image_transfos)
+    db.execute('''
+        update transfo set parameters = '[
+            {"quat": [1, 0, 0, 0], "vec3": [1, 2, 3], "_time": 10},
+            {"quat": [1, 0, 0, 0], "vec3": [1, 2, 4], "_time": 20}]'
+        where id = 1
+    ''')
+    # the image has no capture time and the path is dynamic: it is skipped
+    assert db.query("select update_image_frustums(1, 2, 1, 2)")[0][0] == 0
+    db.execute("update datasource set capture_start = to_timestamp(15) where id = 1")
+    assert db.query("select update_image_frustums(1, 2, 1, 2)")[0][0] == 1
+
+
+def test_colorize(db):
+    db.execute(add_image_datasource)
+    db.execute(add_image_transfos)
+    db.execute("select update_image_frustums(1, 2, 1, 2)")
+    db.execute("insert into pointcloud_formats (pcid, srid, schema) values (110, 0, '{}')"
+               .format(pc_schema('x', 'y', 'z')))
+    # the second point projects outside of the image
+    assert db.query('''
+        select * from colorize(
+            pc_makepatch(110, ARRAY[2, 3, 4.5, 20, 20, 4.5]::float8[]), 1, 2)
+    ''') == [(1, 1, 1, 1)]
+
+
+add_pinhole_transfos = '''
+    insert into referential (id, sensor, name) values (3, 1, 'camera');
+    insert into transfo_type (id, name, func_signature)
+    values (1, 'affine_quat', ARRAY['quat', 'vec3', '_time']),
+           (2, 'projective_pinhole', ARRAY['projmat']),
+           (3, 'projective_pinhole_inverse', ARRAY['projmat']);
+    insert into transfo (id, name, source, target, transfo_type, parameters)
+    values (1, 'image_camera', 1, 3, 3, '[{"projmat": [10, 0, 5, 0, 10, 5, 0, 0, 1]}]'),
+           (2, 'camera_image', 3, 1, 2, '[{"projmat": [10, 0, 5, 0, 10, 5, 0, 0, 1]}]'),
+           (3, 'camera_world', 3, 2, 1, '[{"quat": [1, 0, 0, 0], "vec3": [0, 0, 0]}]'),
+           (4, 'world_camera', 2, 3, 1, '[{"quat": [1, 0, 0, 0], "vec3": [0, 0, 0]}]');
+    insert into transfo_tree (id, name, transfos) values (1, 'camera', ARRAY[1, 2, 3, 4]);
+    update platform_config set transfo_trees = ARRAY[1] where id = 1;
+'''
+
+
+def test_colorize_pinhole(db):
+    db.execute(add_image_datasource)
+    db.execute(add_pinhole_transfos)
+    db.execute("select update_image_frustums(1, 2, 1, 2)")
+    db.execute("insert into pointcloud_formats (pcid, srid, schema) values (110, 0, '{}')"
+               .format(pc_schema('x', 'y', 'z')))
+    # the second point is behind the camera and the third one beyond the far plane,
+    # they project to the center of the image too
+    assert db.query('''
+        select * from colorize(
+            pc_makepatch(110, ARRAY[0, 0, 1.5, 0, 0, -1.5, 0, 0, 3]::float8[]), 1, 2)
+    ''') == [(1, 1, 5, 5)]
+    assert db.query('''
+        select array_agg(i) from images_seeing(1, 2, 'POINT Z (0 0 1.5)') i
+    ''')[0][0] == [1]
+
+
 # FIXME activate when delete triggers will be ready
 # def test_delete_transfo_cascade(db):
 #     '''deleting a transfo should propagate deletion of related platform_config
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.path.pardir, 'tools'))
+
+from trajstore import TrajectoryStore, write_store  # NOQA
+
+
+params = {'quat': ['qw', 'qx', 'qy', 'qz'], 'vec3': ['x', 'y', 'z']}
+dims = ['qw', 'qx', 'qy', 'qz', 'x', 'y', 'z']
+
+
+@pytest.fixture
+def store(tmpdir):
+    path = str(tmpdir.join('traj.bin'))
+    half = np.sqrt(0.5)
+    times = [2.0, 0.0, 1.0, 1.0]
+    values = [
+        [half, 0, 0, half, 2, 4, 0],
+        [1, 0, 0, 0, 0, 0, 0],
+        [half, 0, 0, half, 1, 2, 0],
+        [half, 0, 0, half, 1, 2, 0],
+    ]
+    write_store(path, params, times, values, dims)
+    return TrajectoryStore(path)
+
+
+def test_trajstore_sorted_and_deduplicated(store):
+    assert len(store) == 3
+    assert list(store.times) == [0.0, 1.0, 2.0]
+
+
+def test_trajstore_lerp(store):
+    params = store.interpolate([0.5, 1.5])
+    assert params[0]['vec3'] == pytest.approx([0.5, 1.0, 0.0])
+    assert params[1]['vec3'] == pytest.approx([1.5, 3.0, 0.0])
+
+
+def test_trajstore_slerp(store):
+    quat = store.interpolate_arrays([0.5])['quat'][0]
+    angle = np.pi / 8
+    assert quat == pytest.approx([np.cos(angle), 0, 0, np.sin(angle)])
+    assert np.linalg.norm(quat) == pytest.approx(1.0)
+
+
+def test_trajstore_outside(store):
+    params = store.interpolate([-1.0, 2.0, 3.0])
+    assert params[0] is None
+    assert params[1]['vec3'] == pytest.approx([2.0, 4.0, 0.0])
+    assert params[2] is None
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+'''
+Memory-mapped local trajectory store.
+
+A trajectory store is a time-sorted binary copy of the trajectory referenced
+by the ``parameters_column`` of a dynamic transfo (form 1). It lets clients and
+batch jobs interpolate transfo parameters for many times without querying the
+database once per time, as ``get_dyn_transfo_params_form_1`` does.
+
+File layout (little endian)::
+
+    magic (8 bytes) | header length (uint32) | JSON header | padding | data
+
+``data`` is a C-ordered float64 array of shape (count, len(columns)), sorted by
+time, whose first column is the time. The data offset is aligned on 64 bytes so
+that the array can be memory-mapped as is. Several processes opening the same
+file share a single copy of it through the page cache.
+
+Export a store::
+
+    python trajstore.py export --dsn "dbname=li3ds" --transfo 12 traj.bin
+
+Read it::
+
+    store = TrajectoryStore('traj.bin')
+    params = store.interpolate([1234.5, 1235.0])
+'''
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b'LI3DSTRJ'
+VERSION = 1
+ALIGNMENT = 64
+TIME_DIMENSION = 'time'
+FETCH_SIZE = 100000
+
+
+def is_quaternion(name, param):
+    ''' Return True if the transfo parameter "name" is a quaternion, that is a list of
+        four dimensions whose name contains "quat".
+    '''
+    return isinstance(param, list) and len(param) == 4 and 'quat' in name
+
+
+def param_dimensions(params):
+    ''' Return the list of the dimensions referenced by the transfo parameters, in
+        the order they appear.
+    '''
+    dims = []
+    for key in sorted(params):
+        param = params[key]
+        for dim in (param if isinstance(param, list) else [param]):
+            if dim not in dims:
+                dims.append(dim)
+    return dims
+
+
+def write_store(path, params, times, values, dimensions):
+    ''' Write a trajectory store to path. times is a sequence of times, values an
+        array of shape (len(times), len(dimensions)). Samples are sorted by time,
+        and duplicated times are dropped.
+    '''
+    times = np.asarray(times, dtype='<f8')
+    values = np.asarray(values, dtype='<f8').reshape(len(times), len(dimensions))
+    order = np.argsort(times, kind='mergesort')
+    times, values = times[order], values[order]
+    if len(times):
+        keep = np.concatenate(([True], np.diff(times) > 0))
+        times, values = times[keep], values[keep]
+
+    header = json.dumps({
+        'version': VERSION,
+        'params': params,
+        'columns': [TIME_DIMENSION] + list(dimensions),
+        'count': int(len(times)),
+    }).encode('utf-8')
+    offset = len(MAGIC) + 4 + len(header)
+    padding = (-offset) % ALIGNMENT
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header) + padding))
+        f.write(header)
+        f.write(b' ' * padding)
+        f.write(np.column_stack((times, values)).astype('<f8').tobytes())
+    os.rename(tmp, path)
+
+
+def export_store(conn, transfoid, path):
+    ''' Export the trajectory behind the parameters_column of the transfo whose id
+        is transfoid to a store at path.
+    '''
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            select parameters_column, parameters
+            from li3ds.transfo where id = %s
+            ''', (transfoid,))
+        row = cursor.fetchone()
+    if row is None:
+        raise ValueError('no transfo with id {:d}'.format(transfoid))
+    params_column, params = row
+    if not params_column:
+        raise ValueError('transfo {:d} is not a dynamic transfo of form 1'.format(transfoid))
+    if isinstance(params, str):
+        params = json.loads(params)
+    params = params[0]
+    dims = param_dimensions(params)
+
+    with conn.cursor() as cursor:
+        cursor.execute('select quote_ident(%s), quote_ident(%s), quote_ident(%s)',
+                       tuple(params_column.split('.')))
+        schema, table, column = cursor.fetchone()
+
+    select = ', '.join(['pc_get(point, %s)'] * (len(dims) + 1))
+    q = '''
+        select {select}
+        from {schema}.{table}, pc_explode({column}) point
+        '''.format(select=select, schema=schema, table=table, column=column)
+
+    chunks = []
+    with conn.cursor(name='li3ds_trajstore') as cursor:
+        cursor.itersize = FETCH_SIZE
+        cursor.execute(q, [TIME_DIMENSION] + dims)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype='<f8'))
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(dims) + 1))
+    write_store(path, params, data[:, 0], data[:, 1:], dims)
+    return len(data)
+
+
+class TrajectoryStore(object):
+    ''' Read-only, memory-mapped trajectory store.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a trajectory store'.format(path))
+            length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length).decode('utf-8'))
+        if header['version'] != VERSION:
+            raise ValueError('unsupported trajectory store version {}'
+                             .format(header['version']))
+        self.params = header['params']
+        self.columns = header['columns']
+        self.count = header['count']
+        offset = len(MAGIC) + 4 + length
+        if self.count:
+            self.data = np.memmap(path, dtype='<f8', mode='r', offset=offset,
+                                  shape=(self.count, len(self.columns)))
+        else:
+            self.data = np.empty((0, len(self.columns)), dtype='<f8')
+        self.times = self.data[:, 0]
+        self.index = dict((dim, i) for i, dim in enumerate(self.columns))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def start(self):
+        return self.times[0] if self.count else None
+
+    @property
+    def end(self):
+        return self.times[-1] if self.count else None
+
+    def _locate(self, times):
+        ''' Return the index of the left sample and the interpolation weight of the
+            right sample for each time, together with a mask of the times outside
+            the trajectory.
+        '''
+        i = np.searchsorted(self.times, times, side='right') - 1
+        outside = (i < 0) | (times > self.times[-1])
+        i = np.clip(i, 0, max(self.count - 2, 0))
+        if self.count > 1:
+            t0, t1 = self.times[i], self.times[i + 1]
+            w = np.clip((times - t0) / (t1 - t0), 0.0, 1.0)
+        else:
+            w = np.zeros(times.shape)
+        return i, w, outside
+
+    def _lerp(self, dims, i, w):
+        cols = [self.index[dim] for dim in dims]
+        v0 = self.data[i][:, cols]
+        v1 = self.data[np.minimum(i + 1, self.count - 1)][:, cols]
+        return v0 + (v1 - v0) * w[:, None]
+
+    def _slerp(self, dims, i, w):
+        cols = [self.index[dim] for dim in dims]
+        q0 = self.data[i][:, cols]
+        q1 = self.data[np.minimum(i + 1, self.count - 1)][:, cols]
+        dot = np.einsum('ij,ij->i', q0, q1)
+        # take the shortest arc
+        q1 = np.where(dot[:, None] < 0, -q1, q1)
+        dot = np.abs(dot)
+        # fall back to normalized lerp when quaternions are nearly parallel
+        linear = dot > 0.9995
+        theta = np.arccos(np.clip(dot, -1.0, 1.0))
+        sin = np.where(linear, 1.0, np.sin(theta))
+        s0 = np.where(linear, 1.0 - w, np.sin((1.0 - w) * theta) / sin)
+        s1 = np.where(linear, w, np.sin(w * theta) / sin)
+        q = q0 * s0[:, None] + q1 * s1[:, None]
+        return q / np.linalg.norm(q, axis=1)[:, None]
+
+    def interpolate_arrays(self, times):
+        ''' Interpolate the transfo parameters for times. Return a dict mapping each
+            parameter name to an array of shape (len(times),) or (len(times), n).
+            Times outside the trajectory get NaN values.
+        '''
+        times = np.atleast_1d(np.asarray(times, dtype='<f8'))
+        if self.count:
+            i, w, outside = self._locate(times)
+        result = {}
+        for name, param in self.params.items():
+            dims = param if isinstance(param, list) else [param]
+            if not self.count:
+                values = np.full((len(times), len(dims)), np.nan)
+            elif is_quaternion(name, param):
+                values = self._slerp(dims, i, w)
+                values[outside] = np.nan
+            else:
+                values = self._lerp(dims, i, w)
+                values[outside] = np.nan
+            result[name] = values if isinstance(param, list) else values[:, 0]
+        return result
+
+    def interpolate(self, times):
+        ''' Interpolate the transfo parameters for times. Return a list with, for each
+            time, a params dict shaped like the ones returned by
+            get_dyn_transfo_params_form_1, or None if the time is outside the
+            trajectory.
+        '''
+        arrays = self.interpolate_arrays(times)
+        missing = np.zeros(len(np.atleast_1d(times)), dtype=bool)
+        for values in arrays.values():
+            missing |= np.isnan(values.reshape(len(missing), -1)).any(axis=1)
+        params = []
+        for k in range(len(missing)):
+            if missing[k]:
+                params.append(None)
+                continue
+            params.append(dict(
+                (name, values[k].tolist() if values.ndim > 1 else float(values[k]))
+                for name, values in arrays.items()))
+        return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='li3ds trajectory store')
+    subparsers = parser.add_subparsers(dest='command')
+    export = subparsers.add_parser(
+        'export', help='export the trajectory of a dynamic transfo to a store')
+    export.add_argument('--dsn', required=True, help='libpq connection string')
+    export.add_argument('--transfo', type=int, required=True, help='transfo id')
+    export.add_argument('path', help='output file')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        import psycopg2
+        with psycopg2.connect(args.dsn) as conn:
+            count = export_store(conn, args.transfo, args.path)
+        print('{} samples written to {}'.format(count, args.path))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()